@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# Stand-in for the tangelo executable, for benchmarking tangelo-wrapper
+# without real servers. Understands what tangelo-wrapper asks of tangelo:
+#
+#   status --pids
+#   status --pid <pid> --attr <status|interface|log|root|config>
+#   start -c <config> [--verbose]
+#   restart --pid <pid> -c <config> [--verbose]
+#   stop --pid <pid> [--verbose]
+#
+# A started "instance" is a daemon that listens on the port from its config
+# (so readiness checks succeed) and answers every HTTP request with
+# $FAKE_TANGELO_HTTP_STATUS (200 unless set, so health checks do too). What is running
+# is kept in one file per pid under $FAKE_TANGELO_STATE. The first command
+# an interpreter runs sleeps for $FAKE_TANGELO_LATENCY seconds, to stand in
+# for the time it takes to start python and import tangelo.
+import sys, os, json, time, signal, socket, tempfile
+
+stateDir = os.environ.get('FAKE_TANGELO_STATE', os.path.join(tempfile.gettempdir(), 'fake-tangelo'))
+latency = float(os.environ.get('FAKE_TANGELO_LATENCY', '0'))
+# Daemons exit on their own after this long, in case nobody stops them
+lifetime = float(os.environ.get('FAKE_TANGELO_LIFETIME', '3600'))
+httpStatus = int(os.environ.get('FAKE_TANGELO_HTTP_STATUS', '200'))
+
+def argument(args, name):
+    return args[args.index(name) + 1]
+
+def readConfig(path):
+    infile = open(path)
+    try:
+        return json.loads(''.join(line for line in infile if not line.strip().startswith('//')))
+    finally:
+        infile.close()
+
+def recordPath(pid):
+    return os.path.join(stateDir, str(pid))
+
+def runningPids():
+    pids = []
+    for name in os.listdir(stateDir):
+        if name.isdigit():
+            try:
+                os.kill(int(name), 0)
+                pids.append(name)
+            except OSError:
+                # Killed without a chance to clean up
+                os.remove(recordPath(name))
+    return sorted(pids, key=int)
+
+def status(args):
+    if '--pids' in args:
+        pids = runningPids()
+        if len(pids) > 0:
+            sys.stderr.write('running tangelo instances: ' + ', '.join(pids) + '\n')
+        else:
+            sys.stderr.write('no tangelo instances\n')
+        return
+    pid = argument(args, '--pid')
+    try:
+        infile = open(recordPath(pid))
+        try:
+            record = json.load(infile)
+        finally:
+            infile.close()
+    except IOError:
+        sys.stderr.write('no such instance: ' + pid + '\n')
+        return
+    sys.stdout.write(str(record.get(argument(args, '--attr'), '')) + '\n')
+
+def serve(configPath):
+    # Runs in the daemon: write our record, hold the port, wait to be stopped
+    config = readConfig(configPath)
+    hostname = config.get('hostname', 'localhost')
+    port = int(config.get('port', 8080))
+    logdir = os.path.expanduser(config.get('logdir', stateDir))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((hostname, port))
+    listener.listen(5)
+
+    record = {
+        'status' : 'running',
+        'interface' : hostname + ':' + str(port),
+        'log' : os.path.join(logdir, 'tangelo.log'),
+        'root' : config.get('root', ''),
+        'config' : os.path.abspath(configPath)
+    }
+    temporary = recordPath(os.getpid()) + '.tmp'
+    outfile = open(temporary, 'w')
+    json.dump(record, outfile)
+    outfile.close()
+    os.rename(temporary, recordPath(os.getpid()))
+
+    def exit(*args):
+        # The record goes first: once it's gone, we're stopped as far as
+        # anyone can tell (an exited daemon may linger as a zombie)
+        os.remove(recordPath(os.getpid()))
+        os._exit(0)
+    signal.signal(signal.SIGTERM, exit)
+    listener.settimeout(1.0)
+    deadline = time.time() + lifetime
+    while time.time() < deadline:
+        try:
+            answer(listener.accept()[0])
+        except socket.timeout:
+            pass
+    exit()
+
+def answer(connection):
+    # One response per connection, whatever was asked
+    try:
+        connection.settimeout(1.0)
+        connection.recv(4096)
+        connection.sendall('HTTP/1.0 %d Fake\r\nConnection: close\r\nContent-Length: 3\r\n\r\nok\n' % httpStatus)
+    except socket.error:
+        pass
+    finally:
+        connection.close()
+
+def start(args):
+    configPath = argument(args, '-c')
+    readConfig(configPath)
+    if os.fork() == 0:
+        os.setsid()
+        if os.fork() == 0:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            try:
+                serve(configPath)
+            finally:
+                os._exit(1)
+        os._exit(0)
+    os.wait()
+    sys.stdout.write('started ' + configPath + '\n')
+
+def stop(args):
+    pid = argument(args, '--pid')
+    try:
+        os.kill(int(pid), signal.SIGTERM)
+    except OSError:
+        sys.stderr.write('no such instance: ' + pid + '\n')
+        return
+    for attempt in range(500):
+        if not os.path.exists(recordPath(pid)):
+            break
+        time.sleep(0.01)
+    sys.stdout.write('stopped ' + pid + '\n')
+
+def main(args):
+    if not os.path.isdir(stateDir):
+        os.makedirs(stateDir)
+    if not getattr(sys, 'fakeTangeloLoaded', False):
+        # Later runs in the same interpreter (the status helper) have
+        # everything imported already
+        time.sleep(latency)
+        sys.fakeTangeloLoaded = True
+    if args[0] == 'status':
+        status(args)
+    elif args[0] == 'start':
+        start(args)
+    elif args[0] == 'restart':
+        stop(args)
+        start(args)
+    elif args[0] == 'stop':
+        stop(args)
+    else:
+        sys.stderr.write('fake tangelo: unknown command ' + args[0] + '\n')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Measures how the wrapper's main code paths scale with the number of
+# instances, against bench/fake_tangelo.py instead of a real tangelo.
+# Everything runs headlessly through Fleet, the GUI-free core that both
+# front ends are built on:
+#
+#   configs        write N config files (prepareStart)
+#   loadConfig     read them all, with a cold and then a warm config cache
+#   start          start all N (runBatch, as Start Configs... / cli start)
+#   refresh        what Overview.refresh does on startup: one status
+#                  snapshot, then probe and apply every instance (as
+#                  Process.updateWidget's probes do)
+#   refresh-warm   the same again, with the discovery index already warm
+#   modify         restart a single instance (as modifyProcess does)
+#   stop           stop all N (runBatch)
+#
+# For each phase and N the results give the wall time, how many
+# subprocesses the wrapper launched, and the resident memory of this
+# process. They are saved as JSON; --compare prints the change against an
+# earlier run.
+#
+# usage: python bench/run.py [--sizes 1,10,50] [--latency 0.05] [--output results.json] [--compare old.json]
+import sys, os, json, time, shutil, signal, tempfile, argparse, platform, subprocess, psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tangelo_wrapper.core import Fleet, Instance, defaultConfig
+from tangelo_wrapper.config import ConfigCache
+from tangelo_wrapper.ports import PortAllocator
+
+fakeTangelo = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_tangelo.py')
+
+class CountingPopen(subprocess.Popen):
+    # Counts what the wrapper launches; the processes themselves are real
+    launched = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.launched += 1
+        realPopen.__init__(self, *args, **kwargs)
+
+realPopen = subprocess.Popen
+subprocess.Popen = CountingPopen
+
+class Phase:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.process = psutil.Process()
+
+    def __enter__(self):
+        self.launched = CountingPopen.launched
+        self.rss = self.process.memory_info().rss
+        self.begin = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.wall = time.time() - self.begin
+        self.subprocesses = CountingPopen.launched - self.launched
+        rss = self.process.memory_info().rss
+        self.result = {
+            'phase' : self.name,
+            'instances' : self.size,
+            'wall' : round(self.wall, 4),
+            'subprocesses' : self.subprocesses,
+            'rss' : rss,
+            'rssDelta' : rss - self.rss
+        }
+
+def makeConfigs(fleet, directory, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'instance-%03d.conf' % i)
+        config = defaultConfig()
+        config['logdir'] = os.path.join(directory, 'logs-%03d' % i)
+        config['root'] = directory
+        config['drop_privileges'] = False
+        fleet.saveConfig(config, path)
+        fleet.prepareStart(path, True)
+        paths.append(path)
+    return paths
+
+def runSize(size, parallelism, workDirectory):
+    directory = os.path.join(workDirectory, str(size))
+    os.makedirs(directory)
+    fleet = Fleet(sys.executable, fakeTangelo)
+    fleet.portAllocator = PortAllocator()
+    phases = []
+
+    with Phase('configs', size) as phase:
+        paths = makeConfigs(fleet, directory, size)
+    phases.append(phase)
+
+    with Phase('loadConfig', size) as phase:
+        fleet.configCache = ConfigCache()
+        for path in paths:
+            fleet.loadConfig(path)
+    phases.append(phase)
+
+    with Phase('loadConfig-warm', size) as phase:
+        for path in paths:
+            fleet.loadConfig(path)
+    phases.append(phase)
+
+    instances = []
+    for path in paths:
+        instance = Instance(fleet, configPath=path)
+        instance.config = fleet.loadConfig(path)
+        instances.append(instance)
+    with Phase('start', size) as phase:
+        results = fleet.runBatch('start', instances, parallelism)
+        fleet.finishBatch(results)
+    phases.append(phase)
+    failed = [result for result in results if not result.succeeded()]
+    if len(failed) > 0:
+        raise AssertionError(str(len(failed)) + ' of ' + str(size) + ' starts failed: ' + str(failed[0].error))
+
+    # A fresh Fleet knows nothing, like the GUI when it opens
+    observer = Fleet(sys.executable, fakeTangelo)
+    with Phase('refresh', size) as phase:
+        found = observer.discover()
+    phases.append(phase)
+    if len(found) != size:
+        raise AssertionError('refresh found ' + str(len(found)) + ' of ' + str(size) + ' instances')
+
+    with Phase('refresh-warm', size) as phase:
+        observer.discover()
+    phases.append(phase)
+
+    with Phase('modify', size) as phase:
+        instance = instances[0]
+        command, output = fleet.beginCommand(fleet.actionCommand('restart', instance), instance)
+        fleet.finishCommand(instance, fleet.runCommand(command, instance))
+    phases.append(phase)
+
+    with Phase('stop', size) as phase:
+        fleet.finishBatch(fleet.runBatch('stop', instances, parallelism))
+    phases.append(phase)
+    fleet.close()
+    observer.close()
+    return [phase.result for phase in phases]
+
+def stopLeftovers(stateDirectory):
+    # Whatever a failed run left running
+    if not os.path.isdir(stateDirectory):
+        return
+    for name in os.listdir(stateDirectory):
+        if name.isdigit():
+            try:
+                os.kill(int(name), signal.SIGTERM)
+            except OSError:
+                pass
+
+def compare(previous, current):
+    before = dict(((result['phase'], result['instances']), result) for result in previous['results'])
+    print('')
+    print('%-16s %9s %12s %12s %8s' % ('phase', 'instances', 'before (s)', 'now (s)', 'change'))
+    for result in current['results']:
+        old = before.get((result['phase'], result['instances']))
+        if old == None:
+            continue
+        change = (result['wall'] - old['wall']) / old['wall'] * 100 if old['wall'] > 0 else 0.0
+        print('%-16s %9d %12.4f %12.4f %+7.0f%%' % (result['phase'], result['instances'], old['wall'], \
+            result['wall'], change))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark tangelo-wrapper against a fake tangelo.')
+    parser.add_argument('--sizes', default='1,10,50,100,200', help='instance counts to try (default: 1,10,50,100,200)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every fake tangelo command takes (default: 0)')
+    parser.add_argument('--parallel', type=int, default=4, help='instances started / stopped at once (default: 4)')
+    parser.add_argument('--output', default='bench-results.json', help='where to save the results')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    workDirectory = tempfile.mkdtemp(prefix='tangelo-wrapper-bench-')
+    stateDirectory = os.path.join(workDirectory, 'state')
+    os.environ['FAKE_TANGELO_STATE'] = stateDirectory
+    os.environ['FAKE_TANGELO_LATENCY'] = str(args.latency)
+
+    results = []
+    try:
+        print('%-16s %9s %10s %12s %10s' % ('phase', 'instances', 'wall (s)', 'subprocesses', 'rss (MB)'))
+        for size in [int(size) for size in args.sizes.split(',')]:
+            for result in runSize(size, args.parallel, workDirectory):
+                results.append(result)
+                print('%-16s %9d %10.4f %12d %10.1f' % (result['phase'], result['instances'], result['wall'], \
+                    result['subprocesses'], result['rss'] / 1048576.0))
+    finally:
+        stopLeftovers(stateDirectory)
+        shutil.rmtree(workDirectory, True)
+
+    current = {
+        'time' : time.time(),
+        'python' : sys.version.split()[0],
+        'platform' : platform.platform(),
+        'latency' : args.latency,
+        'parallel' : args.parallel,
+        'results' : results
+    }
+    outfile = open(args.output, 'w')
+    json.dump(current, outfile, indent=4, sort_keys=True)
+    outfile.close()
+    print('\nSaved ' + args.output)
+
+    if args.compare:
+        infile = open(args.compare)
+        try:
+            compare(json.load(infile), current)
+        finally:
+            infile.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
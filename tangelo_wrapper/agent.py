@@ -0,0 +1,543 @@
+import os, socket, threading, json, time, hmac, itertools, inspect, psutil
+from tangelo_wrapper.core import Instance, BatchResult, LaunchError
+from tangelo_wrapper.logtail import LogTail
+from tangelo_wrapper.workers import WorkerPool
+from tangelo_wrapper.instrument import tracer
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+# Managing tangelo on other machines. An agent runs next to the tangelos of
+# one host (tangelo-wrapper.py agent) and does for whoever connects what the
+# wrapper does locally: discovery, status, start / stop / restart, reading
+# and writing configs, and tailing logs. The protocol is one JSON document
+# per line in each direction over a plain TCP connection:
+#
+#   -> {"id" : 7, "op" : "stop", "args" : {"pid" : "1234"}}
+#   <- {"id" : 7, "ok" : true, "result" : {...}}
+#   <- {"id" : 7, "ok" : false, "error" : "No tangelo instance with pid 1234"}
+#
+# Connections stay open for as many requests as the client likes. Every
+# agent has a token, and the first request on a connection has to be
+# {"op" : "hello", "args" : {"token" : ...}}: even on localhost, anyone else
+# with an account on the host could connect otherwise. Agents listen on
+# localhost unless told otherwise; there is no encryption, so anything else
+# should go through a VPN or an SSH tunnel. An agent only deals with
+# instances, and reads and writes only .conf files, under its config
+# directory, so several agents can share a host, each with its own
+# instances.
+
+protocolVersion = 1
+defaultAgentPort = 7071
+maxLineBytes = 16 * 1024 * 1024
+# Asking again on a fresh connection can't do any harm for these
+readOnlyOperations = set(['hello', 'ping', 'discover', 'status', 'loadConfig', 'tail'])
+defaultConfigDirectory = os.path.expanduser('~/.config/tangelo')
+configSuffix = '.conf'
+
+class AgentError(Exception):
+    pass
+
+def parseAddress(address):
+    # 'host:port', 'host' or ':port'
+    host, separator, port = address.rpartition(':')
+    if separator == '':
+        host, port = port, ''
+    try:
+        return (host or 'localhost', int(port) if port != '' else defaultAgentPort)
+    except ValueError:
+        raise AgentError('Not an agent address: ' + address)
+
+def checkArguments(op, function, args):
+    # Raises AgentError unless function(**args) fits function's signature,
+    # so a TypeError from inside an operation isn't blamed on the client
+    spec = inspect.getargspec(function)
+    names = spec.args[1:] if inspect.ismethod(function) else spec.args
+    required = names[:len(names) - len(spec.defaults or ())]
+    unknown = sorted(str(name) for name in args if name not in names)
+    missing = [name for name in required if name not in args]
+    if len(unknown) > 0:
+        raise AgentError('Bad arguments to ' + str(op) + ': unknown ' + ', '.join(unknown))
+    if len(missing) > 0:
+        raise AgentError('Bad arguments to ' + str(op) + ': missing ' + ', '.join(missing))
+
+class Agent:
+    # The operations themselves, on this host's Fleet
+    def __init__(self, fleet, token, configDirectory=defaultConfigDirectory):
+        if not token:
+            raise AgentError('An agent needs a token')
+        self.fleet = fleet
+        self.token = token
+        self.configDirectory = os.path.join(os.path.realpath(configDirectory), '')
+        # {pid : Instance}: what we found or started, so that the processes
+        # we run without daemonizing can be stopped again
+        self.instances = {}
+        self.lock = threading.Lock()
+        self.discoverLock = threading.Lock()
+        self.operations = {
+            'ping' : self.ping,
+            'discover' : self.discover,
+            'status' : self.status,
+            'start' : self.start,
+            'stop' : self.stop,
+            'restart' : self.restart,
+            'loadConfig' : self.loadConfig,
+            'saveConfig' : self.saveConfig,
+            'tail' : self.tail
+        }
+
+    def handle(self, request, connection):
+        # Returns the response to one request; connection is a dict the
+        # server keeps per connection
+        response = {'id' : request.get('id')}
+        op = request.get('op')
+        args = request.get('args') or {}
+        try:
+            if not isinstance(args, dict):
+                raise AgentError('Bad arguments to ' + str(op) + ': not a JSON object')
+            if op == 'hello':
+                connection['authenticated'] = hmac.compare_digest(str(args.get('token', '')), str(self.token))
+                if not connection['authenticated']:
+                    raise AgentError('Wrong token')
+                result = self.ping()
+            elif not connection.get('authenticated'):
+                raise AgentError('Say hello with the token first')
+            elif op not in self.operations:
+                raise AgentError('Unknown operation: ' + str(op))
+            else:
+                checkArguments(op, self.operations[op], args)
+                with tracer.span('agent.' + op, 'agent'):
+                    result = self.operations[op](**args)
+            response['ok'] = True
+            response['result'] = result
+        except (AgentError, LaunchError, IOError, OSError, ValueError, KeyError, psutil.Error) as e:
+            response['ok'] = False
+            response['error'] = str(e) or e.__class__.__name__
+        except Exception as e:
+            # Anything else (a LimitsError from a bad config, a bug) still
+            # gets an answer rather than a dropped connection
+            response['ok'] = False
+            response['error'] = e.__class__.__name__ + ': ' + str(e) if str(e) else e.__class__.__name__
+        return response
+
+    def ping(self):
+        return {'host' : socket.gethostname(), 'pid' : os.getpid(), 'version' : protocolVersion, \
+            'configDirectory' : self.configDirectory}
+
+    def ours(self, configPath):
+        return configPath != None and os.path.realpath(configPath).startswith(self.configDirectory)
+
+    def checkPath(self, configPath):
+        # Config files clients may have read, written or started; returns
+        # where the file really is, so a symlink can't be swapped afterwards
+        if not isinstance(configPath, basestring) or not self.ours(configPath):
+            raise AgentError(str(configPath) + ' is not under ' + self.configDirectory)
+        path = os.path.realpath(configPath)
+        if not path.endswith(configSuffix):
+            raise AgentError(str(configPath) + ' is not a ' + configSuffix + ' file')
+        return path
+
+    def describe(self, instance):
+        description = instance.describe()
+        if instance.config != None:
+            description['logdir'] = instance.config['logdir']
+        return description
+
+    def discover(self):
+        # Concurrent discovers would only do the same work twice
+        self.discoverLock.acquire()
+        try:
+            found = [instance for instance in self.fleet.discover() if self.ours(instance.configPath)]
+        finally:
+            self.discoverLock.release()
+        self.lock.acquire()
+        try:
+            instances = {}
+            for instance in found:
+                known = self.instances.get(instance.pid)
+                if known != None and known.nonDaemonProcess != None and instance.nonDaemonProcess != None:
+                    # Keep our own handle (and console capture) of a child
+                    instance.nonDaemonProcess = known.nonDaemonProcess
+                    instance.capture = known.capture
+                instances[instance.pid] = instance
+            self.instances = instances
+        finally:
+            self.lock.release()
+        return [self.describe(instance) for instance in found]
+
+    def find(self, pid):
+        pid = str(pid)
+        if pid not in self.instances:
+            self.discover()
+        instance = self.instances.get(pid)
+        if instance == None:
+            raise AgentError('No tangelo instance with pid ' + pid + ' is running.')
+        return instance
+
+    def status(self, pid):
+        record = self.fleet.getDaemonStatuses().get(str(pid))
+        if record == None or not self.ours(record.config):
+            raise AgentError('tangelo knows no instance with pid ' + str(pid))
+        return {
+            'pid' : record.pid,
+            'status' : record.status,
+            'hostname' : record.hostname,
+            'port' : record.port,
+            'config' : record.config,
+            'log' : record.log,
+            'root' : record.root
+        }
+
+    def run(self, action, instance):
+        # One command on one instance, the way runBatch does it
+        oldPid = instance.pid
+        command, output = self.fleet.beginCommand(self.fleet.actionCommand(action, instance), instance)
+        output += self.fleet.finishCommand(instance, self.fleet.runCommand(command, instance))
+        if instance.pid != None:
+            # See how the new process is doing
+            record = self.fleet.getDaemonStatuses().get(instance.pid)
+            instance.apply(instance.probe(record))
+        else:
+            instance.runningStatus = 'not running'
+
+        self.lock.acquire()
+        try:
+            if oldPid != None:
+                self.instances.pop(oldPid, None)
+            if instance.pid != None:
+                self.instances[instance.pid] = instance
+        finally:
+            self.lock.release()
+        return {'pid' : instance.pid, 'output' : output, 'instance' : self.describe(instance)}
+
+    def start(self, configPath, autodetectPort=False):
+        configPath = self.checkPath(configPath)
+        output = self.fleet.prepareStart(configPath, autodetectPort)
+        instance = Instance(self.fleet, configPath=configPath)
+        instance.config = self.fleet.loadConfig(configPath)
+        result = self.run('start', instance)
+        result['output'] = output + result['output']
+        return result
+
+    def stop(self, pid):
+        return self.run('stop', self.find(pid))
+
+    def restart(self, pid, configPath=None):
+        instance = self.find(pid)
+        if configPath != None:
+            instance.configPath = self.checkPath(configPath)
+            instance.config = self.fleet.loadConfig(instance.configPath)
+        return self.run('restart', instance)
+
+    def loadConfig(self, configPath):
+        return self.fleet.loadConfig(self.checkPath(configPath))
+
+    def saveConfig(self, configPath, config):
+        # Whether the file had to be written
+        return self.fleet.saveConfig(config, self.checkPath(configPath))
+
+    def tail(self, pid, maxBytes=64 * 1024):
+        # The end of an instance's log; only whole lines
+        instance = self.find(pid)
+        if instance.config == None:
+            raise AgentError('Nothing is known about pid ' + str(pid) + ' yet.')
+        reader = LogTail(instance.logPath(), maxBytes)
+        if not reader.exists():
+            raise AgentError('No such log file: ' + instance.logPath())
+        return {'log' : instance.logPath(), 'text' : reader.read()[1]}
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = {}
+        while True:
+            line = self.rfile.readline(maxLineBytes)
+            if line == '':
+                return
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('a request is a JSON object')
+            except ValueError as e:
+                response = {'id' : None, 'ok' : False, 'error' : 'Bad request: ' + str(e)}
+            else:
+                response = self.server.agent.handle(request, connection)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    # A thread per connection; connections are long-lived
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, agent, address):
+        socketserver.ThreadingTCPServer.__init__(self, address, AgentRequestHandler)
+        self.agent = agent
+
+class AgentConnection:
+    def __init__(self, host, port, timeout):
+        self.socket = socket.create_connection((host, port), timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.socket.makefile('rb')
+
+    def request(self, message):
+        self.socket.sendall(json.dumps(message) + '\n')
+        line = self.reader.readline(maxLineBytes)
+        if line == '':
+            raise IOError('the agent closed the connection')
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.socket.close()
+        except (IOError, OSError):
+            pass
+
+class AgentClient:
+    # Talks to one agent over a few kept-open connections, so requests don't
+    # pay for a connect (and hello) each, and several can be under way at
+    # once. Failures to reach the agent raise IOError, failures of the
+    # operation itself AgentError.
+    def __init__(self, address, token=None, poolSize=4, timeout=60.0):
+        self.address = address
+        self.host, self.port = parseAddress(address)
+        self.token = token
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.idle = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        connection = AgentConnection(self.host, self.port, self.timeout)
+        try:
+            if self.token != None:
+                self.exchange(connection, 'hello', {'token' : self.token})
+        except:
+            connection.close()
+            raise
+        return connection
+
+    def exchange(self, connection, op, args):
+        response = connection.request({'id' : next(self.ids), 'op' : op, 'args' : args})
+        if not response.get('ok'):
+            raise AgentError(self.address + ': ' + str(response.get('error')))
+        return response.get('result')
+
+    def call(self, op, **args):
+        self.lock.acquire()
+        try:
+            connection = self.idle.pop() if len(self.idle) > 0 else None
+        finally:
+            self.lock.release()
+        reused = connection != None
+
+        with tracer.span('agent.call', 'network', op=op, agent=self.address):
+            try:
+                if connection == None:
+                    connection = self.connect()
+                result = self.exchange(connection, op, args)
+            except AgentError:
+                self.checkIn(connection)
+                raise
+            except (IOError, OSError, ValueError) as e:
+                if connection != None:
+                    connection.close()
+                if not (reused and op in readOnlyOperations):
+                    raise IOError(self.address + ': ' + str(e))
+                # The agent may just have dropped a connection that sat idle
+                # (or restarted); once more on a new one
+                connection = None
+                try:
+                    connection = self.connect()
+                    result = self.exchange(connection, op, args)
+                except AgentError:
+                    self.checkIn(connection)
+                    raise
+                except (IOError, OSError, ValueError) as e:
+                    if connection != None:
+                        connection.close()
+                    raise IOError(self.address + ': ' + str(e))
+        self.checkIn(connection)
+        return result
+
+    def checkIn(self, connection):
+        if connection == None:
+            return
+        self.lock.acquire()
+        try:
+            if len(self.idle) < self.poolSize:
+                self.idle.append(connection)
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+        finally:
+            self.lock.release()
+        for connection in idle:
+            connection.close()
+
+class RemoteInstance:
+    # An instance on another host, as its agent last described it; looks
+    # enough like an Instance to go in the same lists and batches
+    def __init__(self, client, description):
+        self.client = client
+        self.host = client.address
+        self.nonDaemonProcess = None
+        self.health = None
+        self.resources = None
+        self.update(description)
+
+    def update(self, description):
+        self.description = description
+        self.pid = description.get('pid')
+        self.runningStatus = description.get('status', 'unknown')
+        self.configPath = description.get('config')
+        self.config = None
+        if 'hostname' in description:
+            self.config = {
+                'hostname' : description['hostname'],
+                'port' : description['port'],
+                'root' : description['root'],
+                'logdir' : description.get('logdir', os.path.dirname(description.get('log', ''))),
+                'daemonize' : description.get('daemonize', True)
+            }
+
+    def isRunning(self):
+        return self.runningStatus.startswith('running')
+
+    def logPath(self):
+        return os.path.join(self.config['logdir'], 'tangelo.log')
+
+    def describe(self):
+        description = {
+            'host' : self.host,
+            'pid' : self.pid,
+            'status' : self.runningStatus,
+            'config' : self.configPath
+        }
+        if self.config != None:
+            description['hostname'] = self.config['hostname']
+            description['port'] = self.config['port']
+            description['root'] = self.config['root']
+            description['log'] = self.logPath()
+            description['daemonize'] = self.config['daemonize']
+        return description
+
+class AgentPool:
+    # Every agent we know of. Requests to different agents (and batches of
+    # requests to one) go out at the same time, from a pool of threads of
+    # our own, so this can be called from any worker.
+    def __init__(self, addresses=(), token=None, parallelism=8):
+        self.token = token
+        self.clients = {}
+        # What discover() makes of each description; front ends can use a
+        # subclass of RemoteInstance
+        self.instanceClass = RemoteInstance
+        self.workers = WorkerPool(parallelism)
+        self.setAddresses(addresses)
+
+    def setAddresses(self, addresses):
+        for address in addresses:
+            if address not in self.clients:
+                parseAddress(address)
+                self.clients[address] = AgentClient(address, self.token)
+        for address in self.clients.keys():
+            if address not in addresses:
+                self.clients.pop(address).close()
+
+    def setToken(self, token):
+        # Connections said hello with the old token; start them over
+        addresses = self.addresses()
+        self.setAddresses([])
+        self.token = token
+        self.setAddresses(addresses)
+
+    def addresses(self):
+        return sorted(self.clients.keys())
+
+    def client(self, address):
+        client = self.clients.get(address)
+        if client == None:
+            raise AgentError('No agent at ' + address + ' is configured.')
+        return client
+
+    def discover(self):
+        # Returns (instances, failures): RemoteInstances of every agent that
+        # answered, sorted by host and pid, and {address : error} for the
+        # rest
+        def discover(client):
+            try:
+                return client.call('discover'), None
+            except (AgentError, IOError) as e:
+                return None, e
+
+        clients = [self.clients[address] for address in self.addresses()]
+        instances = []
+        failures = {}
+        for client, outcome, unexpected in self.workers.map(discover, clients):
+            result, error = outcome or (None, unexpected)
+            if error != None:
+                failures[client.address] = error
+                continue
+            instances.extend(self.instanceClass(client, description) for description in result)
+        instances.sort(key=lambda instance: (instance.host, int(instance.pid)))
+        return instances, failures
+
+    def start(self, address, configPath, autodetectPort=False):
+        client = self.client(address)
+        result = client.call('start', configPath=configPath, autodetectPort=autodetectPort)
+        return self.instanceClass(client, result['instance']), result['output']
+
+    def runBatch(self, action, instances, parallelism=4):
+        # Like Fleet.runBatch, for RemoteInstances; the instances are updated
+        # in place, so there is no finishBatch. Starting needs configPath and
+        # a host (see start()).
+        results = [BatchResult(instance, action) for instance in instances]
+
+        def run(result):
+            instance = result.instance
+            begin = time.time()
+            try:
+                if action == 'stop':
+                    response = instance.client.call('stop', pid=instance.pid)
+                elif action == 'restart' and instance.pid != None:
+                    response = instance.client.call('restart', pid=instance.pid)
+                else:
+                    response = instance.client.call('start', configPath=instance.configPath)
+                instance.update(response['instance'])
+                result.output = response['output']
+            except (AgentError, IOError) as e:
+                result.error = e
+            result.elapsed = time.time() - begin
+
+        # At most parallelism at a time, however many workers there are
+        pending = list(results)
+        while len(pending) > 0:
+            self.workers.map(run, pending[:parallelism])
+            pending = pending[parallelism:]
+        return results
+
+    def loadConfig(self, address, configPath):
+        return self.client(address).call('loadConfig', configPath=configPath)
+
+    def saveConfig(self, address, configPath, config):
+        return self.client(address).call('saveConfig', configPath=configPath, config=config)
+
+    def tail(self, instance, maxBytes=64 * 1024):
+        # Returns (log path, text)
+        result = instance.client.call('tail', pid=instance.pid, maxBytes=maxBytes)
+        return result['log'], result['text']
+
+    def close(self):
+        # The pool can't be used afterwards
+        for client in self.clients.values():
+            client.close()
+        self.workers.shutdown()
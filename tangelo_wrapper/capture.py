@@ -0,0 +1,129 @@
+import os, threading, itertools
+from collections import deque
+
+# Console output of the non-daemonized instances we start. A reader thread
+# per pipe splits what the child writes into lines, which go into a ring
+# bounded by size and, optionally, into a log file that is rotated when it
+# gets too big. Readers follow the ring by line number.
+
+class OutputCapture:
+    def __init__(self, maxBytes=1024 * 1024, logPath=None, logMaxBytes=10 * 1024 * 1024, logBackups=3):
+        self.maxBytes = maxBytes
+        self.lines = deque()
+        self.size = 0
+        # Line number of self.lines[0], and of the line after the last one
+        self.first = 0
+        self.end = 0
+        self.logPath = logPath
+        self.logMaxBytes = logMaxBytes
+        self.logBackups = logBackups
+        self.logFile = None
+        self.lock = threading.Lock()
+        if logPath != None:
+            logDir = os.path.dirname(logPath)
+            if logDir != '' and not os.path.isdir(logDir):
+                os.makedirs(logDir)
+            self.logFile = open(logPath, 'ab')
+
+    def attach(self, process):
+        # Starts following the stdout and stderr pipes of a subprocess.Popen
+        for pipe in (process.stdout, process.stderr):
+            if pipe != None:
+                thread = threading.Thread(target=self.follow, args=(pipe,), name='tangelo-wrapper-capture')
+                thread.daemon = True
+                thread.start()
+
+    def follow(self, pipe):
+        partial = ''
+        while True:
+            chunk = os.read(pipe.fileno(), 65536)
+            if chunk == '':
+                break
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            if len(lines) > 0:
+                self.append([line + '\n' for line in lines])
+        if partial != '':
+            self.append([partial + '\n'])
+        pipe.close()
+
+    def append(self, lines):
+        self.lock.acquire()
+        try:
+            for line in lines:
+                self.lines.append(line)
+                self.size += len(line)
+                self.end += 1
+            while self.size > self.maxBytes and len(self.lines) > 1:
+                self.size -= len(self.lines.popleft())
+                self.first += 1
+            if self.logFile != None:
+                self.logFile.write(''.join(lines))
+                self.logFile.flush()
+                if self.logFile.tell() > self.logMaxBytes:
+                    self.rotate()
+        finally:
+            self.lock.release()
+
+    def rotate(self):
+        # name.log -> name.log.1 -> ... -> name.log.<logBackups>
+        self.logFile.close()
+        for i in range(self.logBackups - 1, 0, -1):
+            older = self.logPath + '.' + str(i)
+            if os.path.exists(older):
+                os.rename(older, self.logPath + '.' + str(i + 1))
+        if self.logBackups > 0:
+            os.rename(self.logPath, self.logPath + '.1')
+        else:
+            os.remove(self.logPath)
+        self.logFile = open(self.logPath, 'ab')
+
+    def readFrom(self, position):
+        # Returns (position, reset, text): everything from line position on,
+        # or all that's left with reset set if those lines were dropped
+        self.lock.acquire()
+        try:
+            reset = position < self.first
+            if reset:
+                position = self.first
+            text = ''.join(itertools.islice(self.lines, position - self.first, None))
+            return self.end, reset, text
+        finally:
+            self.lock.release()
+
+    def text(self):
+        return self.readFrom(0)[2]
+
+    def reader(self):
+        return CaptureReader(self)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.logFile != None:
+                self.logFile.close()
+                self.logFile = None
+        finally:
+            self.lock.release()
+
+class CaptureReader:
+    # Follows an OutputCapture the way LogTail follows a file
+    def __init__(self, capture):
+        self.capture = capture
+        self.path = capture.logPath
+        self.position = None
+
+    def exists(self):
+        return True
+
+    def read(self):
+        first = self.position == None
+        self.position, reset, text = self.capture.readFrom(self.position or 0)
+        return first or reset, text
+
+    def hasOlder(self):
+        # Whatever left the ring is only in the log file
+        return False
+
+    def readOlder(self, maxBytes):
+        return ''
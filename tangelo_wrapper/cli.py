@@ -0,0 +1,517 @@
+import sys, os, re, json, time, argparse
+from tangelo_wrapper.core import Fleet, Instance, findExecutable, formatBatch, groupByRoot
+from tangelo_wrapper.health import HEALTHY
+from tangelo_wrapper.config import diffConfigs, describeChanges
+from tangelo_wrapper.logindex import severityNames, parseTime
+from tangelo_wrapper.ports import PortAllocator, PortError, parseRanges, defaultRecordPath
+from tangelo_wrapper.supervisor import Supervisor
+from tangelo_wrapper.limits import LimitsError
+from tangelo_wrapper.agent import Agent, AgentServer, AgentPool, AgentError, parseAddress, defaultConfigDirectory
+from tangelo_wrapper.instrument import tracer
+
+# Command line front end for headless machines; nothing here imports Qt.
+
+commands = ['status', 'health', 'logs', 'start', 'stop', 'restart', 'rolling-restart', 'supervise', 'config', 'agent']
+
+def wantsCli(args):
+    return len(args) > 0 and args[0] in commands
+
+def buildParser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--python', help='python interpreter that runs tangelo (default: the one on the PATH)')
+    common.add_argument('--tangelo', help='tangelo executable (default: the one on the PATH)')
+    common.add_argument('--timings', action='store_true', help='print where the time went to stderr afterwards')
+    common.add_argument('--trace', metavar='PATH', help='save a Chrome trace (chrome://tracing) of the run to PATH')
+    bulk = argparse.ArgumentParser(add_help=False)
+    bulk.add_argument('--parallel', type=int, default=4, help='how many instances to work on at once (default: 4)')
+    bulk.add_argument('--wait', type=float, default=10.0, \
+        help='seconds to wait for each started instance to answer on its port (default: 10)')
+    remote = argparse.ArgumentParser(add_help=False)
+    remote.add_argument('--agent', metavar='HOST:PORT', action='append', \
+        help='work on the instances of the agent there instead of local ones; repeat for several agents')
+    remote.add_argument('--token', default=os.environ.get('TANGELO_WRAPPER_TOKEN'), \
+        help="the agents' token (default: $TANGELO_WRAPPER_TOKEN)")
+
+    parser = argparse.ArgumentParser(prog='tangelo-wrapper', \
+        description='Manage tangelo instances. Run without a command to open the GUI.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    status = subparsers.add_parser('status', parents=[common, remote], help='list running tangelo instances')
+    status.add_argument('--json', action='store_true', help='print machine-readable output')
+
+    health = subparsers.add_parser('health', parents=[common], help='check that running instances answer over HTTP')
+    health.add_argument('--pid', nargs='+', help='instances to check (default: all running ones)')
+    health.add_argument('--samples', type=int, default=5, help='requests per instance (default: 5)')
+    health.add_argument('--interval', type=float, default=0.2, help='seconds between requests (default: 0.2)')
+    health.add_argument('--json', action='store_true', help='print machine-readable output')
+
+    logs = subparsers.add_parser('logs', parents=[common], help='search the logs of running instances')
+    logs.add_argument('pattern', help='regular expression to look for')
+    logs.add_argument('--pid', nargs='+', help='instances whose logs to search (default: all running ones)')
+    logs.add_argument('--since', help='e.g. 30m, 2h, 1d, or a time like "2026-10-18 07:30"')
+    logs.add_argument('--until', help='same formats as --since')
+    logs.add_argument('--severity', choices=severityNames, default='debug', help='only lines at least this bad')
+    logs.add_argument('-i', '--ignore-case', action='store_true')
+    logs.add_argument('--limit', type=int, default=100, help='show at most this many (newest) matches (default: 100)')
+    logs.add_argument('--json', action='store_true', help='print machine-readable output')
+
+    start = subparsers.add_parser('start', parents=[common, bulk, remote], help='start instances from config files')
+    start.add_argument('-c', '--config', required=True, action='append', \
+        help='config file (created if it does not exist); repeat to start several instances')
+    start.add_argument('--autodetect-port', action='store_true', \
+        help='pick an open port and save it in the config (the same one as last time, if it is still free)')
+    start.add_argument('--port-range', default='', help='with --autodetect-port, ports to pick from, e.g. 8080-8099,9000')
+    start.add_argument('--spread-cores', action='store_true', \
+        help='give each instance its own share of the CPUs (saved in its config as launch_limits)')
+
+    stop = subparsers.add_parser('stop', parents=[common, bulk, remote], help='stop running instances')
+    stop.add_argument('--pid', required=True, nargs='+')
+
+    restart = subparsers.add_parser('restart', parents=[common, bulk, remote], help='restart running instances')
+    restart.add_argument('--pid', required=True, nargs='+')
+    restart.add_argument('-c', '--config', help='config file to restart with (default: the current one; single pid only)')
+
+    rolling = subparsers.add_parser('rolling-restart', parents=[common], \
+        help='restart instances without losing capacity: each is replaced by a healthy one on a new port first')
+    rolling.add_argument('--pid', nargs='+', help='instances to restart (default: all running ones)')
+    rolling.add_argument('--root', help='only restart instances serving this root')
+    rolling.add_argument('--at-once', type=int, default=1, \
+        help='how many instances of each root to replace at a time (default: 1)')
+    rolling.add_argument('--health-timeout', type=float, default=30.0, \
+        help='seconds to wait for a replacement to answer health checks before giving up (default: 30)')
+    rolling.add_argument('--wait', type=float, default=10.0, \
+        help='seconds to wait for each replacement to answer on its port (default: 10)')
+    rolling.add_argument('--port-range', default='', help='ports to pick new ones from, e.g. 8080-8099,9000')
+
+    supervise = subparsers.add_parser('supervise', parents=[common], \
+        help='restart instances whenever they crash, until interrupted')
+    supervise.add_argument('--pid', nargs='+', help='instances to watch (default: all running ones)')
+    supervise.add_argument('--interval', type=float, default=1.0, help='seconds between checks (default: 1)')
+    supervise.add_argument('--max-delay', type=float, default=60.0, \
+        help='longest wait before a restart; the wait doubles with every crash in a row (default: 60)')
+    supervise.add_argument('--crash-loop', type=int, default=5, \
+        help='give up on an instance after this many crashes in 5 minutes (default: 5)')
+
+    config = subparsers.add_parser('config', parents=[common], help='show or change config files')
+    config.add_argument('path', nargs='+')
+    config.add_argument('--set', metavar='KEY=VALUE', action='append', \
+        help='change a setting in every config given (VALUE is JSON, or else a string); repeat for several')
+    config.add_argument('--dry-run', action='store_true', help='with --set, only show what would change')
+    config.add_argument('--json', action='store_true', help='print machine-readable output')
+
+    agent = subparsers.add_parser('agent', parents=[common], \
+        help="serve this host's instances to tangelo-wrappers elsewhere, until interrupted")
+    agent.add_argument('--listen', default='localhost:7071', metavar='HOST:PORT', \
+        help='where to accept connections (default: localhost:7071)')
+    agent.add_argument('--token', default=os.environ.get('TANGELO_WRAPPER_TOKEN'), \
+        help='the token clients have to present (required; default: $TANGELO_WRAPPER_TOKEN)')
+    agent.add_argument('--config-dir', default=defaultConfigDirectory, \
+        help='only deal with instances, and .conf files, under this directory (default: ' + \
+        defaultConfigDirectory + ')')
+    return parser
+
+class CliError(Exception):
+    pass
+
+# Every Fleet a command made, closed once it is done
+fleets = []
+
+def makeFleet(args, residentStatus=False):
+    # Only commands that keep asking about status (supervise, agent, rolling
+    # restarts) are worth keeping a status helper running for
+    pythonPath = os.path.expanduser(args.python) if args.python else findExecutable('python')
+    tangeloPath = os.path.expanduser(args.tangelo) if args.tangelo else findExecutable('tangelo')
+    if not os.path.exists(pythonPath):
+        raise CliError("Sorry, couldn't find a python interpreter; use --python.")
+    if not os.path.exists(tangeloPath):
+        raise CliError("Sorry, couldn't find the tangelo executable; use --tangelo.")
+    fleet = Fleet(pythonPath, tangeloPath, residentStatus)
+    fleets.append(fleet)
+    return fleet
+
+def findInstances(fleet, pids):
+    byPid = dict((instance.pid, instance) for instance in fleet.discover())
+    for pid in pids:
+        if pid not in byPid:
+            raise CliError('No tangelo instance with pid ' + pid + ' is running.')
+    return [byPid[pid] for pid in pids]
+
+def runBatch(fleet, action, instances, args):
+    parallelism = args.parallel
+    fleet.readinessTimeout = args.wait
+    begin = time.time()
+    results = fleet.runBatch(action, instances, parallelism)
+    fleet.finishBatch(results)
+    print(formatBatch(action, results, time.time() - begin, parallelism))
+    if len([result for result in results if not result.succeeded()]) > 0:
+        raise CliError('Some instances failed to ' + action + '.')
+
+def makeAgentPool(args):
+    if not args.token:
+        raise CliError('Agents only answer with their token; use --token or set $TANGELO_WRAPPER_TOKEN.')
+    try:
+        return AgentPool(args.agent, args.token)
+    except AgentError as e:
+        raise CliError(str(e))
+
+def discoverRemote(pool):
+    instances, failures = pool.discover()
+    for address in sorted(failures.keys()):
+        # The errors name the agent
+        sys.stderr.write("Couldn't ask " + str(failures[address]) + '\n')
+    return instances
+
+def findRemoteInstances(pool, pids):
+    if len(pool.clients) > 1:
+        raise CliError('--pid only names instances of a single --agent.')
+    byPid = dict((instance.pid, instance) for instance in discoverRemote(pool))
+    for pid in pids:
+        if pid not in byPid:
+            raise CliError('No tangelo instance with pid ' + pid + ' is running at ' + pool.addresses()[0] + '.')
+    return [byPid[pid] for pid in pids]
+
+def runRemoteBatch(pool, action, instances, args):
+    begin = time.time()
+    results = pool.runBatch(action, instances, args.parallel)
+    print(formatBatch(action, results, time.time() - begin, args.parallel))
+    if len([result for result in results if not result.succeeded()]) > 0:
+        raise CliError('Some instances failed to ' + action + '.')
+
+def status(args):
+    if args.agent:
+        pool = makeAgentPool(args)
+        try:
+            instances = [instance.describe() for instance in discoverRemote(pool)]
+        finally:
+            pool.close()
+    else:
+        instances = [instance.describe() for instance in makeFleet(args).discover()]
+    if args.json:
+        print(json.dumps(instances, indent=4))
+    elif len(instances) == 0:
+        print('No tangelo instances are running.')
+    else:
+        for instance in instances:
+            line = '%-8s %-26s %-22s %s' % (instance['pid'], instance['status'], \
+                instance['hostname'] + ':' + str(instance['port']), instance['config'])
+            if args.agent:
+                line = '%-22s ' % instance['host'] + line
+            print(line)
+
+def health(args):
+    fleet = makeFleet(args)
+    if args.pid:
+        instances = findInstances(fleet, args.pid)
+    else:
+        instances = [instance for instance in fleet.discover() if instance.isRunning()]
+    for i in range(max(1, args.samples)):
+        if i > 0:
+            time.sleep(args.interval)
+        for instance in instances:
+            instance.health = fleet.checkHealth(instance)
+
+    if args.json:
+        print(json.dumps([instance.describe() for instance in instances], indent=4))
+    elif len(instances) == 0:
+        print('No tangelo instances are running.')
+    else:
+        for instance in instances:
+            health = instance.health.describe() if instance.health != None else 'not running'
+            print('%-8s %-22s %s' % (instance.pid, instance.config['hostname'] + ':' + str(instance.config['port']), health))
+    if len([instance for instance in instances if instance.health == None or instance.health.state != HEALTHY]) > 0:
+        raise CliError('Some instances are not healthy.')
+
+def logs(args):
+    try:
+        pattern = re.compile(args.pattern, re.IGNORECASE if args.ignore_case else 0)
+        since = parseTime(args.since) if args.since else None
+        until = parseTime(args.until) if args.until else None
+    except (re.error, ValueError) as e:
+        raise CliError(str(e))
+    fleet = makeFleet(args)
+    if args.pid:
+        instances = findInstances(fleet, args.pid)
+    else:
+        instances = [instance for instance in fleet.discover() if instance.isRunning()]
+    sources = fleet.logSources(instances)
+    matches, failures = fleet.searchLogs(sources.keys(), pattern, since, until, \
+        severityNames.index(args.severity), args.limit)
+
+    for path, error in failures.iteritems():
+        sys.stderr.write("Couldn't search " + path + ": " + str(error) + '\n')
+    if args.json:
+        found = []
+        for match in matches:
+            description = match.describe()
+            description['pids'] = [instance.pid for instance in sources[match.path]]
+            found.append(description)
+        print(json.dumps(found, indent=4))
+    else:
+        for match in matches:
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(match.when)) if match.when != None else '-'
+            print('%s %-7s %s:%d: %s' % (when, severityNames[match.severity], match.path, match.lineNumber, match.text))
+
+def start(args):
+    if args.agent:
+        # The config files are the agent's
+        if len(args.agent) > 1:
+            raise CliError('Start on one --agent at a time.')
+        if args.spread_cores:
+            raise CliError('--spread-cores is not supported with --agent.')
+        pool = makeAgentPool(args)
+        try:
+            for path in args.config:
+                try:
+                    instance, output = pool.start(args.agent[0], path, args.autodetect_port)
+                except (AgentError, IOError) as e:
+                    raise CliError("Couldn't start " + path + ": " + str(e))
+                print('=== pid ' + str(instance.pid) + ' ' + path + ' on ' + instance.host + '\n' + output)
+        finally:
+            pool.close()
+        return
+    fleet = makeFleet(args)
+    try:
+        fleet.portAllocator = PortAllocator(defaultRecordPath, parseRanges(args.port_range))
+    except PortError as e:
+        raise CliError(str(e))
+    instances = []
+    for path in args.config:
+        path = os.path.abspath(os.path.expanduser(path))
+        try:
+            fleet.prepareStart(path, args.autodetect_port)
+        except PortError as e:
+            raise CliError("Couldn't start " + path + ": " + str(e))
+        instance = Instance(fleet, configPath=path)
+        instance.config = fleet.loadConfig(path)
+        if not instance.config['daemonize'] or sys.platform.startswith('win'):
+            raise CliError("Non-daemonized instances only live as long as whoever started them; " + \
+                "set daemonize in " + path + " or use the GUI.")
+        instances.append(instance)
+    if args.spread_cores:
+        try:
+            print(fleet.spreadCores(instances))
+        except LimitsError as e:
+            raise CliError("Couldn't spread the instances across cores: " + str(e))
+    runBatch(fleet, 'start', instances, args)
+
+def stop(args):
+    if args.agent:
+        pool = makeAgentPool(args)
+        try:
+            runRemoteBatch(pool, 'stop', findRemoteInstances(pool, args.pid), args)
+        finally:
+            pool.close()
+        return
+    fleet = makeFleet(args)
+    runBatch(fleet, 'stop', findInstances(fleet, args.pid), args)
+
+def restart(args):
+    if args.agent:
+        if args.config:
+            raise CliError('-c is not supported with --agent.')
+        pool = makeAgentPool(args)
+        try:
+            runRemoteBatch(pool, 'restart', findRemoteInstances(pool, args.pid), args)
+        finally:
+            pool.close()
+        return
+    fleet = makeFleet(args)
+    instances = findInstances(fleet, args.pid)
+    if args.config:
+        if len(instances) > 1:
+            raise CliError('-c can only be used when restarting a single instance.')
+    for instance in instances:
+        # What the restart will change: the config it runs with now against
+        # the file it will be started from
+        running = instance.config
+        if args.config:
+            instance.configPath = os.path.abspath(os.path.expanduser(args.config))
+        instance.config = fleet.loadConfig(instance.configPath)
+        changes = diffConfigs(running, instance.config)
+        if len(changes) > 0:
+            print('pid ' + instance.pid + ' config changes:\n' + describeChanges(changes))
+        else:
+            print('pid ' + instance.pid + ': config unchanged')
+    print('')
+    runBatch(fleet, 'restart', instances, args)
+
+def rollingRestart(args):
+    fleet = makeFleet(args, residentStatus=True)
+    try:
+        fleet.portAllocator = PortAllocator(defaultRecordPath, parseRanges(args.port_range))
+    except PortError as e:
+        raise CliError(str(e))
+    fleet.readinessTimeout = args.wait
+    if args.pid:
+        instances = findInstances(fleet, args.pid)
+    else:
+        instances = [instance for instance in fleet.discover() if instance.isRunning()]
+    if args.root:
+        root = os.path.abspath(os.path.expanduser(args.root))
+        instances = [instance for instance in instances if os.path.abspath(instance.config['root']) == root]
+    if len(instances) == 0:
+        raise CliError('No tangelo instances to restart.')
+    for instance in instances:
+        if not instance.config['daemonize']:
+            raise CliError('pid ' + instance.pid + " isn't daemonized, so its replacement would only live as long " + \
+                'as this command; restart it from the GUI.')
+
+    atOnce = max(1, args.at_once)
+    failed = False
+    for root, group in groupByRoot(instances):
+        begin = time.time()
+        results = fleet.rollingRestart(group, atOnce, args.health_timeout)
+        fleet.finishRollingRestart(results)
+        print('== ' + root)
+        print(formatBatch('rolling restart', results, time.time() - begin, atOnce))
+        sys.stdout.flush()
+        failed = failed or len([result for result in results if not result.succeeded()]) > 0
+    if failed:
+        raise CliError('Some instances were not replaced.')
+
+def supervise(args):
+    fleet = makeFleet(args, residentStatus=True)
+    if args.pid:
+        instances = findInstances(fleet, args.pid)
+    else:
+        instances = [instance for instance in fleet.discover() if instance.isRunning()]
+    if len(instances) == 0:
+        raise CliError('No tangelo instances are running.')
+    supervisor = Supervisor(maxDelay=args.max_delay, crashLoopCount=args.crash_loop)
+    for instance in instances:
+        supervisor.supervise(instance)
+    print('Supervising ' + str(len(instances)) + ' instance(s); press Ctrl-C to stop.')
+
+    try:
+        while True:
+            due, changed = supervisor.poll()
+            for instance in changed:
+                print(supervisor.history(instance)[-1].describe() + ' (' + instance.configPath + ')')
+            for instance in due:
+                supervisor.restarting(instance)
+                instance.nonDaemonProcess = None
+                try:
+                    command, output = fleet.beginCommand(fleet.actionCommand('start', instance), instance)
+                    fleet.finishCommand(instance, fleet.runCommand(command, instance))
+                except Exception as e:
+                    # Whatever went wrong (a bad config, a start that can't
+                    # be found, ...), it is one more crash for the backoff
+                    # and crash loop detection, and the others still need
+                    # watching
+                    instance.pid = None
+                    print("Couldn't restart " + instance.configPath + ': ' + (str(e) or e.__class__.__name__))
+                supervisor.resume(instance)
+                if instance.pid != None:
+                    print('Restarted ' + instance.configPath + ' as pid ' + instance.pid)
+                else:
+                    print(supervisor.history(instance)[-1].describe() + ' (' + instance.configPath + ')')
+            sys.stdout.flush()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+def parseSettings(settings):
+    parsed = {}
+    for setting in settings:
+        key, separator, value = setting.partition('=')
+        if separator == '' or key.strip() == '':
+            raise CliError('--set takes KEY=VALUE, not ' + setting)
+        try:
+            parsed[key.strip()] = json.loads(value)
+        except ValueError:
+            parsed[key.strip()] = value
+    return parsed
+
+def config(args):
+    fleet = Fleet(None, None, residentStatus=False)
+    paths = [os.path.abspath(os.path.expanduser(path)) for path in args.path]
+    if not args.set:
+        loaded = dict((path, fleet.loadConfig(path)) for path in paths)
+        if args.json:
+            print(json.dumps(loaded[paths[0]] if len(paths) == 1 else loaded, indent=4, sort_keys=True))
+            return
+        for path in paths:
+            if len(paths) > 1:
+                print('== ' + path)
+            for key in sorted(loaded[path].keys()):
+                print('%-16s %s' % (key, loaded[path][key]))
+        return
+
+    # The same settings in every file, written together
+    settings = parseSettings(args.set)
+    items = []
+    for path in paths:
+        edited = fleet.loadConfig(path)
+        edited.update(settings)
+        changes = fleet.configChanges(edited, path)
+        if len(changes) > 0:
+            print(path + ':\n' + describeChanges(changes))
+        else:
+            print(path + ': unchanged')
+        items.append((edited, path))
+    if args.dry_run:
+        return
+    written = fleet.saveConfigs(items)
+    print('\nWrote ' + str(len(written)) + ' of ' + str(len(paths)) + ' config file(s).')
+
+def agent(args):
+    fleet = makeFleet(args, residentStatus=True)
+    try:
+        address = parseAddress(args.listen)
+    except AgentError as e:
+        raise CliError(str(e))
+    if not args.token:
+        # Even on localhost: any other user of this machine could connect
+        raise CliError('Anyone who can connect could run tangelo commands as you; give a --token ' + \
+            '(or set $TANGELO_WRAPPER_TOKEN).')
+    server = AgentServer(Agent(fleet, args.token, os.path.expanduser(args.config_dir)), address)
+    print('Agent listening on ' + '%s:%d' % server.server_address[:2] + '; press Ctrl-C to stop.')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+handlers = {
+    'status' : status,
+    'health' : health,
+    'logs' : logs,
+    'start' : start,
+    'stop' : stop,
+    'restart' : restart,
+    'rolling-restart' : rollingRestart,
+    'supervise' : supervise,
+    'config' : config,
+    'agent' : agent
+}
+
+def printTimings():
+    summary = tracer.summary()
+    sys.stderr.write('\n%-20s %7s %10s %10s %10s %10s\n' % ('operation', 'count', 'total (s)', 'p50 (ms)', 'p95 (ms)', \
+        'max (ms)'))
+    for name in sorted(summary.keys(), key=lambda name: summary[name]['total'], reverse=True):
+        timing = summary[name]
+        sys.stderr.write('%-20s %7d %10.3f %10.2f %10.2f %10.2f\n' % (name, timing['count'], timing['total'], \
+            timing['p50'] * 1000, timing['p95'] * 1000, timing['max'] * 1000))
+
+def main(argv):
+    args = buildParser().parse_args(argv)
+    try:
+        try:
+            handlers[args.command](args)
+        except CliError as e:
+            sys.stderr.write(str(e) + '\n')
+            return 1
+        except (IOError, OSError) as e:
+            sys.stderr.write("Sorry, there was an error communicating with tangelo:\n\n" + str(e) + '\n')
+            return 1
+        return 0
+    finally:
+        while len(fleets) > 0:
+            fleets.pop().close()
+        if args.timings:
+            printTimings()
+        if args.trace:
+            tracer.exportChromeTrace(args.trace)
@@ -0,0 +1,165 @@
+import os, sys, stat, json, copy, threading
+from tangelo_wrapper.state import prepareWrite, commitWrite, discardWrite
+from tangelo_wrapper.instrument import tracer
+
+def normalizeConfig(config):
+    # populate with the existing / default state if it doesn't already exist
+    config['hostname'] = config.get('hostname', 'localhost')
+    config['port'] = int(config.get('port', 8080))
+    config['root'] = os.path.expanduser(config.get('root', sys.prefix + '/share/tangelo/web'))
+    config['logdir'] = os.path.expanduser(config.get('logdir', '~/.config/tangelo'))
+    config['vtkpython'] = config.get('vtkpython', "")
+    config['drop_privileges'] = str(config.get('drop_privileges', 'true')).lower() == 'true'
+    config['user'] = config.get('user', "nobody")
+    config['group'] = config.get('group', "nobody")
+    config['daemonize'] = str(config.get('daemonize', 'true')).lower() == 'true'
+    config['access_auth'] = str(config.get('access_auth', 'true')).lower() == 'true'
+    return config
+
+header = "// Tangelo config file auto-generated by tangelo-wrapper\n"
+
+def parseConfig(text):
+    # tangelo allows // comment lines, which json doesn't
+    return normalizeConfig(json.loads("".join(line for line in text.splitlines(True) if not line.strip().startswith("//"))))
+
+@tracer.timed('config.read', 'io')
+def readConfig(configPath):
+    infile = open(configPath, 'rb')
+    try:
+        text = infile.read()
+    finally:
+        infile.close()
+
+    return parseConfig(text)
+
+def configText(config):
+    # What writeConfig puts in the file; config itself is left alone
+    config = dict((key, value) for key, value in config.items() if value != '')
+    if config.get('drop_privileges') == False:
+        config.pop('user', None)
+        config.pop('group', None)
+    return header + json.dumps(config, separators=[", ",": "], indent=4)
+
+def fileMode(path):
+    # A rewritten config keeps its permissions; a new one gets the usual ones
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0666 & ~umask
+
+@tracer.timed('config.write', 'io')
+def writeConfigs(items, current=readConfig):
+    # items: [(config, configPath)]. Writes every config that means something
+    # different from what its file says now (current(configPath) gives that),
+    # so the files of unchanged configs, and their mtimes, are left alone.
+    # Each file is replaced in one rename, and only once every new file is
+    # ready, so a failure while preparing them writes none; a rename that
+    # fails leaves the files renamed before it written. Returns the paths
+    # that were written.
+    pending = []
+    try:
+        for config, configPath in items:
+            text = configText(config)
+            try:
+                if parseConfig(text) == current(configPath):
+                    continue
+            except (IOError, OSError, ValueError):
+                # Missing or unreadable; either way it gets written
+                pass
+            # A symlinked config stays a symlink
+            target = os.path.realpath(configPath)
+            pending.append((prepareWrite(target, text, fileMode(target)), target, configPath))
+    except:
+        for temporary, target, configPath in pending:
+            discardWrite(temporary)
+        raise
+
+    for i, (temporary, target, configPath) in enumerate(pending):
+        try:
+            commitWrite(temporary, target)
+        except:
+            for remaining in pending[i + 1:]:
+                discardWrite(remaining[0])
+            raise
+    return [configPath for temporary, target, configPath in pending]
+
+def writeConfig(config, configPath):
+    # Returns whether the file was written
+    return len(writeConfigs([(config, configPath)])) > 0
+
+def diffConfigs(old, new):
+    # [(key, old value, new value)] for every setting that differs between
+    # the config old (None for no config at all) and what writing new would
+    # give
+    old = normalizeConfig(copy.deepcopy(old)) if old != None else {}
+    new = parseConfig(configText(new))
+    return [(key, old.get(key), new.get(key)) for key in sorted(set(old.keys()) | set(new.keys())) \
+        if old.get(key) != new.get(key)]
+
+def describeChanges(changes):
+    return "\n".join("    %s: %s -> %s" % (key, json.dumps(before), json.dumps(after)) for key, before, after in changes)
+
+class ConfigCache:
+    # Parsed, normalized configs keyed by path. An entry is only trusted while
+    # the file's (mtime, size, inode) is unchanged; callers always get their
+    # own copy, so they can modify it freely.
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def signature(self, configPath):
+        stat = os.stat(configPath)
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    def load(self, configPath):
+        signature = self.signature(configPath)
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(configPath)
+            if entry != None and entry[0] == signature:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        config = readConfig(configPath)
+        self.store(configPath, signature, config)
+        return copy.deepcopy(config)
+
+    def save(self, config, configPath):
+        # Returns whether the file was written (it isn't when nothing changed)
+        return len(self.saveMany([(config, configPath)])) > 0
+
+    def saveMany(self, items):
+        # Write through: what we just wrote is what the next load would parse
+        written = writeConfigs(items, self.load)
+        for config, configPath in items:
+            if configPath in written:
+                self.store(configPath, self.signature(configPath), parseConfig(configText(config)))
+        return written
+
+    def changes(self, config, configPath):
+        # What saving config over configPath would change
+        try:
+            current = self.load(configPath)
+        except (IOError, OSError, ValueError):
+            current = None
+        return diffConfigs(current, config)
+
+    def store(self, configPath, signature, config):
+        self.lock.acquire()
+        try:
+            self.entries[configPath] = (signature, config)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : len(self.entries)}
+
+    def describe(self):
+        return 'config cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses'
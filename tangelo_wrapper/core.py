@@ -0,0 +1,730 @@
+import sys, os, re, subprocess, threading, psutil, socket, time
+from tangelo_wrapper.status import StatusProbe
+from tangelo_wrapper.workers import WorkerPool
+from tangelo_wrapper.discovery import DiscoveryIndex
+from tangelo_wrapper.config import ConfigCache
+from tangelo_wrapper.health import HealthProber, HEALTHY, connectHost
+from tangelo_wrapper.resources import ResourceMonitor
+from tangelo_wrapper.capture import OutputCapture
+from tangelo_wrapper.logindex import LogIndex, DEBUG
+from tangelo_wrapper.ports import PortAllocator
+from tangelo_wrapper.limits import LaunchLimits, spreadCpus, formatCpus, configKey
+from tangelo_wrapper.instrument import tracer
+
+# Everything needed to find, inspect, start and stop tangelo instances,
+# without any GUI. The Qt front end (gui.py) and the command line front end
+# (cli.py) are both built on top of Instance and Fleet.
+
+tangeloProcessCommands = set(['start', 'restart'])
+tangeloDefaultConfigPaths = [
+    '/etc/tangelo.conf',
+    os.path.expanduser('~/.config/tangelo/tangelo.conf'),
+    '/usr/share/tangelo/conf/tangelo.conf.local'
+]
+
+def findExecutable(name):
+    finder = 'where' if sys.platform.startswith('win') else 'which'
+    try:
+        return subprocess.Popen([finder, name], stdout=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        return ''
+
+def defaultConfig():
+    return {
+        'hostname' : 'localhost',
+        'port' : 8080,
+        'root' : sys.prefix + '/share/tangelo/web',
+        'logdir' : os.path.expanduser('~/.config/tangelo'),
+        'vtkpython' : '',
+        'drop_privileges' : True,
+        'user' : 'nobody',
+        'group' : 'nobody',
+        'daemonize' : True,
+        'access_auth' : True
+    }
+
+class LaunchError(Exception):
+    # A tangelo command ran, but what it started couldn't be found
+    pass
+
+def isListening(hostname, port):
+    try:
+        socket.create_connection((connectHost(hostname), port), 0.5).close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+class Instance:
+    def __init__(self, fleet, pid=None, configPath=None, nonDaemonProcess=None, record=None):
+        self.fleet = fleet
+        self.pid = pid
+        self.configPath = configPath
+        assert self.pid != None or self.configPath != None
+        self.nonDaemonProcess = nonDaemonProcess
+        # Console output of a non-daemonized instance we started
+        self.capture = None
+        self.record = record
+        self.config = None
+        self.runningStatus = 'unknown'
+        self.health = None
+        # Restarted by a Supervisor if it crashes
+        self.supervised = False
+        # Where it runs; None for this machine
+        self.host = None
+
+    @tracer.timed('instance.probe', 'config')
+    def probe(self, record):
+        # Collect info about the process without changing anything, so that
+        # it can run on a worker thread; apply() stores the result. The record
+        # comes from a batched status probe covering every instance at once.
+        configPath = self.configPath
+        if self.pid != None and configPath == None:
+            # Ask tangelo where our config file is
+            configPath = record.config if record != None else ''
+            if not os.path.exists(configPath):
+                # This is the odd scenario where a non-daemonized
+                # instance was running before tangelo-wrapper started...
+                # see if a config file was specified:
+                cmdline = psutil.Process(pid=int(self.pid)).cmdline()
+                if '-c' in cmdline:
+                    configPath = cmdline[cmdline.index('-c') + 1]
+                else:
+                    for p in tangeloDefaultConfigPaths:
+                        if os.path.exists(p):
+                            configPath = p
+                            break
+            assert os.path.exists(configPath)
+
+        # Load the configuration stored in the file
+        config = self.fleet.loadConfig(configPath)
+
+        # How are we running?
+        if self.pid == None:
+            runningStatus = 'not running'
+        elif self.nonDaemonProcess == None:
+            config['daemonize'] = True
+            if record == None:
+                # tangelo no longer knows about this pid
+                runningStatus = 'not running'
+            else:
+                runningStatus = record.status
+
+                # Override any other fields with the current state
+                if record.port != None:
+                    config['hostname'] = record.hostname
+                    config['port'] = record.port
+                config['logdir'] = record.logdir()
+                config['root'] = record.root
+        else:
+            assert not sys.platform.startswith('win')
+            config['daemonize'] = False
+            runningStatus = 'running (not daemonized)'
+
+        return (record, configPath, config, runningStatus)
+
+    def apply(self, state):
+        self.record, self.configPath, self.config, self.runningStatus = state
+
+        if self.pid == None or self.nonDaemonProcess == None:
+            # Nothing of ours is running that could still write to it
+            if self.capture != None:
+                self.capture.close()
+                self.capture = None
+
+    def isRunning(self):
+        return self.runningStatus.startswith('running')
+
+    def logPath(self):
+        return os.path.join(self.config['logdir'], 'tangelo.log')
+
+    def describe(self):
+        description = {
+            'pid' : self.pid,
+            'status' : self.runningStatus,
+            'config' : self.configPath
+        }
+        if self.config != None:
+            description['hostname'] = self.config['hostname']
+            description['port'] = self.config['port']
+            description['root'] = self.config['root']
+            description['log'] = self.logPath()
+            description['daemonize'] = self.config['daemonize']
+            if configKey in self.config:
+                description['launch_limits'] = self.config[configKey]
+        if self.health != None:
+            description['health'] = self.health.state
+            description['latency_p50'] = self.health.p50
+            description['latency_p95'] = self.health.p95
+        return description
+
+class BatchResult:
+    # What happened to one instance during a bulk operation
+    def __init__(self, instance, action):
+        self.instance = instance
+        self.action = action
+        self.oldPid = instance.pid
+        self.command = None
+        self.output = ""
+        self.error = None
+        self.elapsed = 0.0
+        self.result = None
+
+    def succeeded(self):
+        return self.error == None
+
+    def describe(self):
+        name = "pid " + str(self.oldPid) if self.oldPid != None else "(not running)"
+        if self.instance.pid != None and self.instance.pid != self.oldPid:
+            name += " -> pid " + str(self.instance.pid)
+        name += " " + str(self.instance.configPath)
+        if self.instance.host != None:
+            name += " on " + self.instance.host
+        return name
+
+class RolloutError(Exception):
+    # A rolling restart that had to stop before replacing an instance
+    pass
+
+def formatBatch(action, results, elapsed, parallelism):
+    failures = len([result for result in results if not result.succeeded()])
+    output = "%s of %d instance(s), %d at a time: %d succeeded, %d failed in %.1fs\n\n" % \
+        (action.capitalize(), len(results), parallelism, len(results) - failures, failures, elapsed)
+    for result in results:
+        if result.succeeded():
+            output += "=== %s: ok in %.1fs\n" % (result.describe(), result.elapsed)
+        else:
+            output += "=== %s: FAILED in %.1fs: %s\n" % (result.describe(), result.elapsed, result.error)
+        output += result.output + "\n\n"
+    return output
+
+def groupByRoot(instances):
+    # [(root, [Instance])], for working on each group of instances that
+    # serve the same content separately
+    groups = {}
+    for instance in instances:
+        groups.setdefault(instance.config['root'], []).append(instance)
+    return sorted(groups.items())
+
+def limitFailures(failures):
+    # For a command's output
+    return ''.join("Couldn't apply launch limit: " + failure + "\n\n" for failure in failures)
+
+class Fleet:
+    def __init__(self, pythonPath, tangeloPath, residentStatus=True):
+        # residentStatus: keep a status helper running between queries (see
+        # StatusProbe); call close() when done with the fleet
+        self.pythonPath = pythonPath
+        self.tangeloPath = tangeloPath
+        self.statusProbe = StatusProbe(pythonPath, tangeloPath, residentStatus)
+        self.discovery = DiscoveryIndex(tangeloProcessCommands)
+        self.configCache = ConfigCache()
+        self.healthProber = HealthProber()
+        self.resourceMonitor = ResourceMonitor()
+        # How long to wait for a newly started daemon to answer on its port
+        self.readinessTimeout = 10.0
+        # Console output of non-daemonized instances: how much to keep in
+        # memory, and where (if anywhere) to also write it
+        self.captureMaxBytes = 1024 * 1024
+        self.captureDir = None
+        # Ports for autodetected starts; only remembered in memory unless a
+        # front end gives it a record file
+        self.portAllocator = PortAllocator()
+        # Where to keep a history of the commands we run, if anywhere
+        self.stateStore = None
+        self.logIndexes = {}
+        self.logIndexLock = threading.Lock()
+
+    def close(self):
+        self.statusProbe.close()
+
+    def getDaemonPids(self):
+        return self.statusProbe.getPids()
+
+    def getDaemonStatuses(self):
+        return self.statusProbe.collect()
+
+    def getAllTangeloProcesses(self):
+        return self.discovery.scan()
+
+    @tracer.timed('fleet.snapshot', 'wrapper')
+    def takeSnapshot(self):
+        return self.getDaemonStatuses(), self.getAllTangeloProcesses()
+
+    def discover(self):
+        # Finds and probes every instance right away; returns Instances
+        # sorted by pid
+        statuses, allProcesses = self.takeSnapshot()
+        instances = []
+        for pid, record in statuses.iteritems():
+            instances.append(Instance(self, pid, record=record))
+        for pid, proc in allProcesses.iteritems():
+            if pid not in statuses:
+                instances.append(Instance(self, pid, nonDaemonProcess=proc))
+
+        probed = []
+        for instance in instances:
+            try:
+                instance.apply(instance.probe(instance.record))
+            except psutil.NoSuchProcess:
+                # Exited since the snapshot
+                continue
+            probed.append(instance)
+        probed.sort(key=lambda instance: int(instance.pid))
+        return probed
+
+    def checkHealth(self, instance):
+        # Worker-safe: one HTTP request to the instance's interface. Returns
+        # a HealthStatus, or None if there's nothing running to check.
+        if not instance.isRunning() or instance.config == None:
+            return None
+        return self.healthProber.check(instance.config['hostname'], instance.config['port'])
+
+    def sampleResources(self, pids):
+        # Worker-safe; returns {pid : ResourceSample}, reusing the handles
+        # discovery already holds
+        return self.resourceMonitor.sample(pids, self.discovery.handle)
+
+    def logSources(self, instances):
+        # {log path : [Instance]}; instances that share a logdir share a log
+        sources = {}
+        for instance in instances:
+            if instance.config == None:
+                continue
+            paths = [instance.logPath()]
+            if instance.capture != None and instance.capture.logPath != None:
+                paths.append(instance.capture.logPath)
+            for path in paths:
+                sources.setdefault(path, []).append(instance)
+        return sources
+
+    def logIndex(self, path):
+        self.logIndexLock.acquire()
+        try:
+            index = self.logIndexes.get(path)
+            if index == None:
+                index = self.logIndexes[path] = LogIndex(path)
+            return index
+        finally:
+            self.logIndexLock.release()
+
+    def searchLogs(self, paths, pattern, since=None, until=None, minSeverity=DEBUG, limit=1000):
+        # Worker-safe. Brings the index of every log up to date and searches
+        # them all for the regular expression pattern, several at a time.
+        # Returns (matches, failures): the newest limit LogMatches, oldest
+        # first, and {path : error} for logs that couldn't be read.
+        if isinstance(pattern, basestring):
+            pattern = re.compile(pattern)
+
+        def search(path):
+            index = self.logIndex(path)
+            try:
+                if not index.update():
+                    return [], IOError('No such log file')
+                return index.search(pattern, since, until, minSeverity, limit), None
+            except (IOError, OSError) as e:
+                return [], e
+
+        pool = WorkerPool(max(1, min(4, len(paths))))
+        try:
+            results = pool.map(search, paths)
+        finally:
+            pool.shutdown()
+
+        matches = []
+        failures = {}
+        for path, result, error in results:
+            if error == None:
+                found, error = result
+                matches.extend(found)
+            if error != None:
+                failures[path] = error
+        # Lines without a known time sort with the oldest
+        matches.sort(key=lambda match: match.when or 0)
+        return matches[-limit:], failures
+
+    def loadConfig(self, configPath):
+        return self.configCache.load(configPath)
+
+    def saveConfig(self, config, configPath):
+        # Returns whether the file had to be written
+        return self.configCache.save(config, configPath)
+
+    def saveConfigs(self, items):
+        # [(config, configPath)], all written together; returns the paths
+        # that changed
+        return self.configCache.saveMany(items)
+
+    def spreadCores(self, instances, cpus=None):
+        # Gives each instance its own share of cpus (by default every CPU we
+        # may use), saved in its config so that restarts stay where they
+        # were put; returns what each got
+        output = ""
+        items = []
+        for instance, share in zip(instances, spreadCpus(len(instances), cpus)):
+            limits = LaunchLimits.fromConfig(instance.config)
+            limits.cpus = share
+            limits.toConfig(instance.config)
+            items.append((instance.config, instance.configPath))
+            output += "cpus " + formatCpus(share) + " for " + instance.configPath + "\n"
+        self.saveConfigs(items)
+        return output
+
+    def configChanges(self, config, configPath):
+        # [(key, old value, new value)] that saving config would make
+        return self.configCache.changes(config, configPath)
+
+    def prepareStart(self, path, autodetectPort=True):
+        # Writes the config for a new instance; returns what was done
+        output = ""
+        if os.path.exists(path):
+            config = self.loadConfig(path)
+        else:
+            config = defaultConfig()
+        if autodetectPort:
+            # Reserved until the instance is up (see runCommand)
+            previous = self.portAllocator.assignment(path)
+            config['port'] = self.portAllocator.allocate(path)
+            if config['port'] == previous:
+                output += "Reusing port " + str(config['port']) + "...\n\n"
+            else:
+                output += "Reserved port " + str(config['port']) + "...\n\n"
+        else:
+            self.portAllocator.claim(path, config['port'])
+        try:
+            written = self.saveConfig(config, path)
+        except:
+            self.portAllocator.release(config['port'], path)
+            raise
+        output += "Wrote config...\n\n" if written else "Config unchanged...\n\n"
+        return output
+
+    def beginCommand(self, command, instance):
+        # Gets an instance ready for a tangelo command; returns the full
+        # command line and what was done so far
+        output = ""
+        command = [self.pythonPath, self.tangeloPath] + command
+
+        # If the process was already running (not as a daemon),
+        # we need to kill it
+        if instance.nonDaemonProcess != None:
+            assert 'start' not in command
+            output += "Killing pid " + str(instance.pid) + "...\n\n"
+            instance.nonDaemonProcess.kill()
+            instance.nonDaemonProcess = None
+            if 'stop' in command and instance.capture != None:
+                instance.capture.close()
+                instance.capture = None
+
+        output += "Running:\n"
+        output += " ".join(command)
+        output += "\n\n"
+
+        if 'stop' not in command and not instance.config['daemonize'] and instance.capture == None:
+            # A restarted instance keeps adding to the same capture
+            instance.capture = OutputCapture(self.captureMaxBytes, self.captureLogPath(instance))
+        return command, output
+
+    def captureLogPath(self, instance):
+        if self.captureDir == None:
+            return None
+        name = os.path.splitext(os.path.basename(instance.configPath))[0]
+        return os.path.join(self.captureDir, name + '-' + str(int(time.time())) + '.log')
+
+    def runCommand(self, command, instance):
+        # Blocks until tangelo is done (and a new daemon is ready, or the
+        # wait for it timed out); returns (pid, nonDaemonProcess, output)
+        since = time.time()
+        pid = None
+        finished = False
+        try:
+            # Stopping isn't limited; anything that starts a server is
+            limits = None if 'stop' in command else LaunchLimits.fromConfig(instance.config)
+            pid, nonDaemonProcess, output = self.launch(command, instance.config['daemonize'], instance.capture, limits)
+            if 'stop' not in command and instance.config['daemonize']:
+                pid, waitOutput = self.waitForLaunch(instance, since)
+                output += waitOutput
+                if limits != None and limits.preexec() != None:
+                    output += limitFailures(limits.applyAfterStart(pid))
+            elif nonDaemonProcess != None and self.portAllocator.isReserved(instance.config['port']):
+                # Only worth waiting for if someone else could take the port
+                output += self.waitForPort(instance, pid, since, time.time() + self.readinessTimeout, nonDaemonProcess)
+            finished = True
+        finally:
+            # Whatever prepareStart reserved has been bound by now, or won't be
+            self.portAllocator.release(instance.config['port'], instance.configPath)
+            if self.stateStore != None:
+                # command is [python, tangelo, action, ...]
+                self.stateStore.recordLaunch(command[2], instance.configPath, pid if 'stop' not in command else instance.pid, \
+                    finished, time.time() - since)
+        return pid, nonDaemonProcess, output
+
+    @tracer.timed('launch.wait', 'wrapper')
+    def waitForLaunch(self, instance, since):
+        # Finds the daemon that was just started for instance, without asking
+        # tangelo: it is the new tangelo process whose command line names
+        # instance's config file. Then waits (at most readinessTimeout in
+        # all) for it to accept connections on its port. Returns (pid, output).
+        deadline = time.time() + self.readinessTimeout
+        pid = self.findLaunchedPid(instance, since)
+        while pid == None and time.time() < deadline:
+            time.sleep(0.1)
+            pid = self.findLaunchedPid(instance, since)
+        if pid == None:
+            # Maybe the daemon doesn't look like its launcher; ask tangelo
+            for candidate, record in self.getDaemonStatuses().iteritems():
+                if candidate != instance.pid and os.path.abspath(record.config) == os.path.abspath(instance.configPath):
+                    pid = candidate
+                    break
+            else:
+                raise LaunchError("Couldn't find the pid of the new tangelo instance")
+
+        return pid, self.waitForPort(instance, pid, since, deadline)
+
+    def waitForPort(self, instance, pid, since, deadline, nonDaemonProcess=None):
+        hostname = instance.config['hostname']
+        port = instance.config['port']
+        interface = str(hostname) + ":" + str(port)
+        while not isListening(hostname, port):
+            if nonDaemonProcess != None and nonDaemonProcess.poll() != None:
+                return "\n\npid " + pid + " exited before answering on " + interface
+            if time.time() >= deadline:
+                return "\n\npid " + pid + " is running but did not answer on " + interface + \
+                    " within " + str(self.readinessTimeout) + "s"
+            time.sleep(0.1)
+        return "\n\npid %s is ready on %s after %.1fs" % (pid, interface, time.time() - since)
+
+    def findLaunchedPid(self, instance, since):
+        configPath = os.path.abspath(instance.configPath)
+        candidates = []
+        for pid, handle in self.getAllTangeloProcesses().iteritems():
+            cmdline = self.discovery.commandLine(pid)
+            if pid == instance.pid or '-c' not in cmdline[:-1]:
+                continue
+            try:
+                createTime = handle.create_time()
+            except psutil.Error:
+                continue
+            # Allow for clocks that disagree a little about when we started
+            if os.path.abspath(cmdline[cmdline.index('-c') + 1]) == configPath and createTime >= since - 1:
+                candidates.append((createTime, int(pid)))
+        if len(candidates) == 0:
+            return None
+        # A double fork leaves the launcher and its child behind for a
+        # moment; the daemon is the youngest
+        return str(max(candidates)[1])
+
+    def launch(self, command, daemonize, capture, limits=None):
+        # Runs the tangelo command; a daemon's pid isn't known yet at this
+        # point, so it comes back as None. Limits are applied to the command
+        # as it is spawned, and so to the daemon it forks, except for what
+        # has to wait until there is a pid (see LaunchLimits.applyAfterStart).
+        output = ""
+        # Don't let the new instance inherit pipes that other worker threads
+        # are waiting on, or those commands would never seem to finish
+        closeFds = not sys.platform.startswith('win')
+        preexec = None
+        if limits != None and not limits.isEmpty():
+            output += "Launch limits: " + limits.describe() + "\n\n"
+            preexec = limits.preexec()
+        if 'stop' not in command and not daemonize:
+            nonDaemonProcess = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, \
+                close_fds=closeFds, preexec_fn=preexec)
+            capture.attach(nonDaemonProcess)
+            if preexec != None:
+                output += limitFailures(limits.applyAfterStart(nonDaemonProcess.pid))
+            elif limits != None and not limits.isEmpty():
+                # No way to apply them before the exec here; right after will do
+                output += limitFailures(limits.applyTo(nonDaemonProcess.pid))
+            output += capture.text()
+            return str(nonDaemonProcess.pid), nonDaemonProcess, output
+        else:
+            with tracer.span('tangelo.' + command[2], 'subprocess'):
+                tangeloProcess = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, \
+                    close_fds=closeFds, preexec_fn=preexec)
+                output += '\n\n'.join(tangeloProcess.communicate())
+            return None, None, output
+
+    def finishCommand(self, instance, result):
+        pid, nonDaemonProcess, output = result
+        instance.pid = pid
+        instance.nonDaemonProcess = nonDaemonProcess
+        # The old process's response times say nothing about the new one
+        if instance.config != None:
+            self.healthProber.forget(instance.config['hostname'], instance.config['port'])
+        instance.health = None
+        return output
+
+    def actionCommand(self, action, instance):
+        if action == 'stop':
+            return ['stop', '--pid', str(instance.pid), '--verbose']
+        elif action == 'restart' and instance.pid != None:
+            return ['restart', '--pid', str(instance.pid), '-c', instance.configPath, '--verbose']
+        else:
+            return ['start', '-c', instance.configPath, '--verbose']
+
+    def runBatch(self, action, instances, parallelism=4):
+        # Stops, starts or restarts many instances, at most parallelism at a
+        # time. One failure doesn't stop the rest; every instance gets a
+        # BatchResult. Call finishBatch() afterwards (on the GUI thread, if
+        # there is one) to record the new pids on the instances.
+        results = []
+        for instance in instances:
+            result = BatchResult(instance, action)
+            try:
+                result.command, result.output = self.beginCommand(self.actionCommand(action, instance), instance)
+            except Exception as e:
+                result.error = e
+                if instance.config != None:
+                    self.portAllocator.release(instance.config['port'], instance.configPath)
+            results.append(result)
+
+        pool = WorkerPool(max(1, min(parallelism, len(results))))
+        try:
+            pool.map(self.launchBatchResult, [result for result in results if result.succeeded()])
+        finally:
+            pool.shutdown()
+        return results
+
+    def launchBatchResult(self, result):
+        # Runs on one of runBatch's workers
+        begin = time.time()
+        try:
+            result.result = self.runCommand(result.command, result.instance)
+        except Exception as e:
+            result.error = e
+        result.elapsed = time.time() - begin
+
+    def finishBatch(self, results):
+        for result in results:
+            if result.succeeded():
+                result.output += self.finishCommand(result.instance, result.result)
+            elif result.action != 'stop':
+                # Whatever may have been started isn't ours to track
+                result.instance.pid = None
+                result.instance.nonDaemonProcess = None
+
+    def rollingRestart(self, instances, atOnce=1, healthTimeout=30.0):
+        # Restarts a group of instances (e.g. all those serving one root)
+        # without ever having fewer of them up: each gets a replacement on a
+        # new port, and its old process is only stopped once the
+        # replacement answers health checks. At most atOnce instances are
+        # being replaced at a time. The first replacement that doesn't come
+        # up healthy ends the rollout, and that instance, like every one not
+        # reached yet, keeps its old process. Returns a BatchResult per
+        # instance; call finishRollingRestart() afterwards (on the GUI
+        # thread, if there is one) to move the instances to their
+        # replacements.
+        results = [BatchResult(instance, 'rolling restart') for instance in instances]
+        aborted = threading.Event()
+        pool = WorkerPool(max(1, min(atOnce, len(results))))
+        try:
+            pool.map(lambda result: self.replaceInstance(result, healthTimeout, aborted), results)
+        finally:
+            pool.shutdown()
+        return results
+
+    def replaceInstance(self, result, healthTimeout, aborted):
+        # Runs on one of rollingRestart's workers. On success, result.result
+        # is the replacement Instance.
+        begin = time.time()
+        instance = result.instance
+        if aborted.isSet():
+            result.error = RolloutError('Not replaced: an earlier replacement failed')
+            return
+        if not instance.isRunning() or instance.config == None:
+            result.error = RolloutError('Not running')
+            return
+
+        oldPort = instance.config['port']
+        fileConfig = None
+        replacement = Instance(self, configPath=instance.configPath)
+        try:
+            fileConfig = self.loadConfig(instance.configPath)
+            replacement.config = self.loadConfig(instance.configPath)
+            # The old process still has its port, so this is a different one
+            replacement.config['port'] = self.portAllocator.allocate(instance.configPath)
+            if replacement.config['port'] == oldPort:
+                self.portAllocator.release(oldPort, instance.configPath)
+                raise RolloutError('pid ' + str(instance.pid) + ' is not listening on its port ' + str(oldPort))
+            result.output += "Replacing pid %s on port %d with one on port %d...\n\n" % \
+                (instance.pid, oldPort, replacement.config['port'])
+            try:
+                self.saveConfig(replacement.config, instance.configPath)
+            except:
+                self.portAllocator.release(replacement.config['port'], instance.configPath)
+                raise
+            command, output = self.beginCommand(self.actionCommand('start', replacement), replacement)
+            result.output += output
+            pid, replacement.nonDaemonProcess, output = self.runCommand(command, replacement)
+            replacement.pid = pid
+            result.output += output
+
+            health = self.waitForHealth(replacement, begin + healthTimeout)
+            if health.state != HEALTHY:
+                raise RolloutError('pid ' + str(pid) + ' on port ' + str(replacement.config['port']) + \
+                    ' was not healthy within ' + str(healthTimeout) + 's: ' + health.describe())
+            result.output += "\n\npid %s is healthy after %.1fs\n\n" % (pid, time.time() - begin)
+        except Exception as e:
+            aborted.set()
+            result.error = e
+            result.output += self.abandonReplacement(replacement, fileConfig)
+            result.elapsed = time.time() - begin
+            return
+
+        # The replacement is serving; retire the old process
+        result.result = replacement
+        old = Instance(self, instance.pid, instance.configPath, instance.nonDaemonProcess)
+        old.config = instance.config
+        old.capture = instance.capture
+        try:
+            command, output = self.beginCommand(self.actionCommand('stop', old), old)
+            result.output += output
+            result.output += self.runCommand(command, old)[2]
+        except Exception as e:
+            # Both are running: more capacity than needed, not less
+            result.error = RolloutError('Replaced, but stopping pid ' + str(instance.pid) + ' failed: ' + str(e))
+        self.healthProber.forget(instance.config['hostname'], oldPort)
+        result.elapsed = time.time() - begin
+
+    def waitForHealth(self, instance, deadline):
+        # Returns the first HEALTHY HealthStatus, or the last one seen if the
+        # deadline passes first
+        while True:
+            health = self.healthProber.check(instance.config['hostname'], instance.config['port'])
+            if health.state == HEALTHY or time.time() >= deadline:
+                return health
+            time.sleep(0.2)
+
+    def abandonReplacement(self, replacement, fileConfig):
+        # Stops a replacement that didn't work out and puts the config file
+        # back as it was; returns what was done
+        output = ""
+        if replacement.pid != None:
+            try:
+                command, stopOutput = self.beginCommand(self.actionCommand('stop', replacement), replacement)
+                output += "\n\nStopping the replacement...\n\n" + stopOutput + self.runCommand(command, replacement)[2]
+            except Exception as e:
+                output += "\n\nCouldn't stop the replacement pid " + str(replacement.pid) + ": " + str(e)
+        elif replacement.capture != None:
+            replacement.capture.close()
+        if fileConfig != None:
+            try:
+                self.saveConfig(fileConfig, replacement.configPath)
+                self.portAllocator.claim(replacement.configPath, fileConfig['port'])
+            except Exception as e:
+                output += "\n\nCouldn't restore " + replacement.configPath + ": " + str(e)
+        if replacement.config != None:
+            self.healthProber.forget(replacement.config['hostname'], replacement.config['port'])
+        return output
+
+    def finishRollingRestart(self, results):
+        for result in results:
+            replacement = result.result
+            if replacement == None:
+                continue
+            instance = result.instance
+            instance.pid = replacement.pid
+            instance.nonDaemonProcess = replacement.nonDaemonProcess
+            instance.capture = replacement.capture
+            instance.config = replacement.config
+            instance.health = None
@@ -0,0 +1,98 @@
+import os, threading, time, psutil
+from tangelo_wrapper.instrument import tracer
+
+def isTangeloCommand(cmdline, commands):
+    if len(cmdline) < 3 or cmdline[2] not in commands:
+        return False
+    script = os.path.basename(cmdline[1])
+    # ... and our own command line (tangelo-wrapper restart ...) looks a lot like one
+    return 'tangelo' in script and not script.startswith('tangelo-wrapper')
+
+class DiscoveryIndex:
+    # Remembers which pids on the machine are tangelo instances, so a scan
+    # only has to look at processes that appeared since the previous scan.
+    # Results are cached per (pid, create_time); pids that exited are
+    # dropped, and a recycled pid is caught by its new create_time and
+    # examined again. Known instances are rechecked on every scan; the other
+    # cached pids a slice at a time, so each is rechecked every
+    # recheckRotation scans and a scan still costs about churn, not every
+    # process on the machine.
+    def __init__(self, commands, settleTime=2.0, recheckRotation=20):
+        self.commands = commands
+        # A process that was just forked may not have exec'd its real
+        # command line yet; don't trust a negative answer for this long
+        self.settleTime = settleTime
+        self.recheckRotation = recheckRotation
+        self.scans = 0
+        self.seen = {}
+        self.handles = {}
+        self.commandLines = {}
+        self.examined = 0
+        self.lock = threading.Lock()
+
+    @tracer.timed('discovery.scan', 'psutil')
+    def scan(self):
+        # Returns {pid : psutil.Process} for every tangelo start/restart
+        # command line currently running
+        self.lock.acquire()
+        try:
+            pids = set(psutil.pids())
+            self.scans += 1
+            for pid, (createTime, matched) in list(self.seen.items()):
+                # Gone, or recycled: a pid we decided wasn't tangelo may be
+                # one now, and an instance's pid may be something else
+                if pid in pids:
+                    if not matched and pid % self.recheckRotation != self.scans % self.recheckRotation:
+                        continue
+                    try:
+                        if psutil.Process(pid).create_time() == createTime:
+                            continue
+                    except psutil.AccessDenied:
+                        continue
+                    except psutil.NoSuchProcess:
+                        pass
+                self.forget(pid)
+
+            for pid in pids:
+                if pid not in self.seen:
+                    self.examine(pid)
+
+            return dict((str(pid), handle) for pid, handle in self.handles.items())
+        finally:
+            self.lock.release()
+
+    def forget(self, pid):
+        del self.seen[pid]
+        self.handles.pop(pid, None)
+        self.commandLines.pop(pid, None)
+
+    def examine(self, pid):
+        self.examined += 1
+        try:
+            handle = psutil.Process(pid)
+            createTime = handle.create_time()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return
+
+        try:
+            cmdline = handle.cmdline()
+            matched = isTangeloCommand(cmdline, self.commands)
+        except psutil.NoSuchProcess:
+            return
+        except psutil.AccessDenied:
+            matched = False
+
+        if not matched and time.time() - createTime < self.settleTime:
+            return
+        self.seen[pid] = (createTime, matched)
+        if matched:
+            self.handles[pid] = handle
+            self.commandLines[pid] = cmdline
+
+    def handle(self, pid):
+        # The psutil handle of a known instance, or None
+        return self.handles.get(int(pid))
+
+    def commandLine(self, pid):
+        # The command line a known instance was started with
+        return self.commandLines.get(int(pid), [])
@@ -0,0 +1,1652 @@
+import sys, os, re, time
+from PySide.QtGui import QApplication, QFileDialog, QMainWindow, QMessageBox, QIcon, QPixmap, QTextCursor, \
+    QWidget, QPainter, QColor, QTableWidgetItem, QSortFilterProxyModel, QInputDialog, QLineEdit
+from PySide.QtCore import QFile, QBuffer, Qt, QObject, QTimer, QPointF, Signal, Slot, QAbstractTableModel, QModelIndex, \
+    QDateTime
+from PySide.QtUiTools import QUiLoader
+from tangelo_wrapper.core import Instance, Fleet, LaunchError, findExecutable, formatBatch, groupByRoot
+from tangelo_wrapper.status import recordKey
+from tangelo_wrapper.config import describeChanges
+from tangelo_wrapper.health import HEALTHY
+from tangelo_wrapper.logindex import severityNames
+from tangelo_wrapper.ports import PortAllocator, PortError, parseRanges, defaultRecordPath
+from tangelo_wrapper.state import StateStore, defaultStatePath
+from tangelo_wrapper.supervisor import Supervisor
+from tangelo_wrapper.limits import LaunchLimits, LimitsError, configKey
+from tangelo_wrapper.agent import AgentPool, AgentError, RemoteInstance, parseAddress
+from tangelo_wrapper.instrument import tracer
+from tangelo_wrapper.workers import WorkerPool
+from tangelo_wrapper.logtail import LogTail
+
+class Globals:
+    mainWindow = None
+    redPixmap = None
+    redIcon = None
+    greenPixmap = None
+    greenIcon = None
+    yellowPixmap = None
+    yellowIcon = None
+    tangeloPath = None
+    pythonPath = None
+    numProcesses = 0
+    dispatcher = None
+    workers = None
+    workerCount = 8
+    logMaxLines = 5000
+    logInitialBytes = 256 * 1024
+    logPageBytes = 256 * 1024
+    logPollInterval = 1000
+    autoRefreshMinInterval = 2000
+    autoRefreshMaxInterval = 60000
+    healthInterval = 5000
+    resourceInterval = 5000
+    captureDir = os.path.expanduser('~/.config/tangelo-wrapper/console')
+    logSearchLimit = 2000
+    portRecordPath = defaultRecordPath
+    statePath = defaultStatePath
+    stateStore = None
+    stateSaveInterval = 5000
+    supervisorInterval = 1000
+    # How long a rolling restart waits for each replacement to be healthy
+    rolloutHealthTimeout = 30.0
+    agentToken = os.environ.get('TANGELO_WRAPPER_TOKEN')
+    # The event loop is expected to get round to a timer this often; being
+    # later than stallThreshold (seconds) counts as a stall
+    heartbeatInterval = 100
+    stallThreshold = 0.05
+    uiLoader = None
+    uiTemplates = {}
+    widgetPool = []
+    widgetPoolSize = 64
+    
+    @staticmethod
+    def load():
+        Globals.redPixmap = QPixmap('ui/images/indicators/red.png')
+        Globals.redIcon = QIcon('ui/images/indicators/red.png')
+        Globals.greenPixmap = QPixmap('ui/images/indicators/green.png')
+        Globals.greenIcon = QIcon('ui/images/indicators/green.png')
+        Globals.yellowPixmap = QPixmap('ui/images/indicators/yellow.png')
+        Globals.yellowIcon = QIcon('ui/images/indicators/yellow.png')
+        Globals.dispatcher = Dispatcher()
+        Globals.workers = WorkerPool(Globals.workerCount, Globals.dispatcher.deliver)
+        Globals.stateStore = StateStore(Globals.statePath)
+        Globals.stateStore.load()
+        Globals.findTangelo()
+    
+    @staticmethod
+    def loadUi(path, parent=None):
+        # Each .ui file is read from disk once; every later widget is built
+        # from the cached bytes by the same loader
+        template = Globals.uiTemplates.get(path)
+        if template == None:
+            infile = QFile(path)
+            infile.open(QFile.ReadOnly)
+            template = Globals.uiTemplates[path] = infile.readAll()
+            infile.close()
+        if Globals.uiLoader == None:
+            Globals.uiLoader = QUiLoader()
+            #TODO: this isn't working:
+            Globals.uiLoader.registerCustomWidget(MainHelper)
+            Globals.uiLoader.registerCustomWidget(ManagerHelper)
+        
+        buffer = QBuffer()
+        buffer.setData(template)
+        buffer.open(QBuffer.ReadOnly)
+        widget = Globals.uiLoader.load(buffer, parent)
+        buffer.close()
+        return widget
+    
+    @staticmethod
+    def criticalError(message):
+        msgBox = QMessageBox()
+        msgBox.setIcon(QMessageBox.Critical)
+        msgBox.setText(message)
+        return msgBox.exec_()
+    
+    @staticmethod
+    def findTangelo():
+        # The python and tangelo we used last time, if they're still there,
+        # save looking them up and asking
+        state = Globals.stateStore
+        if '--choose-tangelo' not in sys.argv and state.pythonPath != None and state.tangeloPath != None and \
+                os.path.exists(state.pythonPath) and os.path.exists(state.tangeloPath):
+            Globals.pythonPath = state.pythonPath
+            Globals.tangeloPath = state.tangeloPath
+            Globals.openOverview()
+            return
+        
+        dialog = Globals.loadUi('ui/find_tangelo.ui')
+        
+        Globals.pythonPath = state.pythonPath or findExecutable('python')
+        Globals.tangeloPath = state.tangeloPath or findExecutable('tangelo')
+        
+        if os.path.exists(Globals.pythonPath):
+            dialog.pythonPathBox.setText(Globals.pythonPath)
+        if os.path.exists(Globals.tangeloPath):
+            dialog.tangeloPathBox.setText(Globals.tangeloPath)
+        
+        def pythonBrowse():
+            path = QFileDialog.getOpenFileName(dialog, u"Find python", dialog.pythonPathBox.text())[0]
+            if path != '':
+                dialog.pythonPathBox.setText(path)
+        
+        def tangeloBrowse():
+            path = QFileDialog.getOpenFileName(dialog, u"Find tangelo", dialog.tangeloPathBox.text())[0]
+            if path != '':
+                dialog.tangeloPathBox.setText(path)
+        
+        def cancel():
+            dialog.hide()
+            sys.exit()
+        
+        def ok():
+            Globals.pythonPath = os.path.expanduser(dialog.pythonPathBox.text())
+            Globals.tangeloPath = os.path.expanduser(dialog.tangeloPathBox.text())
+            
+            if not os.path.exists(Globals.pythonPath):
+                Globals.criticalError("Sorry, that python interpreter doesn't exist.")
+                return
+            if not os.path.exists(Globals.tangeloPath):
+                Globals.criticalError("Sorry, that tangelo executable doesn't exist.")
+                return
+            
+            state.setExecutables(Globals.pythonPath, Globals.tangeloPath)
+            Globals.openOverview()
+            dialog.hide()
+        dialog.show()
+        
+        dialog.tangeloBrowse.clicked.connect(tangeloBrowse)
+        dialog.pythonBrowse.clicked.connect(pythonBrowse)
+        dialog.cancelButton.clicked.connect(cancel)
+        dialog.okButton.clicked.connect(ok)
+    
+    @staticmethod
+    def openOverview():
+        # Shows what we knew last time right away, then finds out what's
+        # actually running
+        Globals.mainWindow = Overview()
+        Globals.mainWindow.restoreState()
+        Globals.mainWindow.refresh()
+
+class Dispatcher(QObject):
+    # Hands worker results back to the GUI thread: a signal emitted from a
+    # worker thread is queued and delivered on the thread this object lives in
+    delivered = Signal(object)
+    
+    def __init__(self):
+        QObject.__init__(self)
+        self.delivered.connect(self.run)
+    
+    @Slot(object)
+    def run(self, call):
+        with tracer.span('gui.callback', 'qt'):
+            call()
+    
+    def deliver(self, function, value):
+        self.delivered.emit(lambda: function(value))
+
+class MainHelper(QMainWindow):
+    def closeEvent(self, event):
+        print 'closing main'
+        for proc in Globals.mainWindow.processes.itervalues():
+            if proc.manager != None:
+                proc.manager.close()
+                proc.manager = None
+        for proc in Globals.mainWindow.deadProcesses.itervalues():
+            if proc.manager != None:
+                proc.manager.close()
+                proc.manager = None
+        event.accept()
+
+class ManagerHelper(QMainWindow):
+    # Sneaky way to override a virtual function on a loaded .ui widget
+    # ... according to the docs, this is how it should be done, but
+    # it still isn't working...
+    def closeEvent(self, event):
+        t = self.windowTitle()
+        print self, 'closing manager:', t
+        '''self.manager = None
+        
+        # If no process is running, remove our widget from the overview as well;
+        # we're done
+        if self.pid == None:
+            Globals.mainWindow.removeDeadProcess(self)'''
+        
+        event.accept()
+        Globals.mainWindow.refresh()
+
+class Sparkline(QWidget):
+    # A small line graph of an instance's recent history, newest on the right
+    def __init__(self, parent, color, capacity):
+        QWidget.__init__(self, parent)
+        self.color = QColor(color)
+        self.capacity = capacity
+        self.values = []
+    
+    def setValues(self, values):
+        self.values = values
+        self.update()
+    
+    def paintEvent(self, event):
+        if len(self.values) < 2:
+            return
+        width = self.width() - 1
+        height = self.height() - 1
+        # Scaled to the largest value shown, so small instances are readable too
+        peak = max(max(self.values), 1)
+        step = float(width) / max(self.capacity - 1, 1)
+        left = width - step * (len(self.values) - 1)
+        points = [QPointF(left + i * step, height - height * float(value) / peak) for i, value in enumerate(self.values)]
+        
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.color)
+        painter.drawPolyline(points)
+        painter.end()
+
+class InstanceModel(QAbstractTableModel):
+    # One row per instance. Views only ask for the rows they show, and a
+    # change to one instance repaints just that row.
+    columns = ['pid', 'host', 'status', 'health', 'hostname', 'port', 'CPU %', 'memory (MB)', 'config', 'root']
+    numericColumns = set(['pid', 'port', 'CPU %', 'memory (MB)'])
+    formats = {'CPU %' : '%.0f', 'memory (MB)' : '%.1f'}
+    
+    def __init__(self, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.processes = []
+        self.rows = {}
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.processes)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.columns[section]
+        return None
+    
+    def data(self, index, role=Qt.DisplayRole):
+        process = self.processes[index.row()]
+        column = self.columns[index.column()]
+        if role == Qt.DisplayRole:
+            value = self.value(process, column)
+            if value == None:
+                return '---'
+            return self.formats.get(column, '%s') % value
+        elif role == Qt.UserRole:
+            # What the proxy sorts by: numbers as numbers
+            value = self.value(process, column)
+            if value == None:
+                return -1 if column in self.numericColumns else ''
+            return value
+        elif role == Qt.DecorationRole and column == 'status':
+            return process.indicator()[1]
+        return None
+    
+    def value(self, process, column):
+        if column == 'pid':
+            return None if process.pid == None else int(process.pid)
+        elif column == 'host':
+            return '(local)' if process.host == None else process.host
+        elif column == 'status':
+            return process.runningStatus
+        elif column == 'health':
+            return None if process.health == None else process.health.describe()
+        elif column == 'config':
+            return process.configPath
+        elif column in ('CPU %', 'memory (MB)'):
+            latest = None if process.resources == None else process.resources.latest()
+            if latest == None or not process.isRunning():
+                return None
+            if column == 'CPU %':
+                return latest.cpu
+            return None if latest.rss == None else latest.rss / (1024.0 * 1024.0)
+        elif process.config == None or process.pid == None:
+            return None
+        return process.config[column]
+    
+    def addProcess(self, process):
+        if self.rows.has_key(process):
+            return
+        row = len(self.processes)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.processes.append(process)
+        self.rows[process] = row
+        self.endInsertRows()
+    
+    def removeProcess(self, process):
+        row = self.rows.pop(process, None)
+        if row == None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.processes[row]
+        for later in self.processes[row:]:
+            self.rows[later] -= 1
+        self.endRemoveRows()
+    
+    def processChanged(self, process):
+        row = self.rows.get(process)
+        if row != None:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+
+class Process(Instance):
+    def __init__(self, pid=None, configPath=None, nonDaemonProcess=None, record=None):
+        Instance.__init__(self, Globals.mainWindow, pid, configPath, nonDaemonProcess, record)
+        Globals.numProcesses += 1
+        self.processNumber = Globals.numProcesses
+        self.widget = None
+        self.manager = None
+        # The pid whose config the manager's fields were last filled from
+        self.managerPid = None
+        self.probeGeneration = 0
+        # Shown from the state file, not found by a refresh yet
+        self.restored = False
+        self.logTail = None
+        self.logTailSource = None
+        self.logTimer = None
+        self.resources = None
+        # The overview panel is only built while the panels tab is shown
+    
+    def createWidget(self):
+        # Widgets of processes that went away are recycled; only build a new
+        # one when the pool is empty
+        if len(Globals.widgetPool) > 0:
+            self.widget = Globals.widgetPool.pop()
+            self.widget.selectCheckBox.setChecked(False)
+            self.widget.cpuGraph.setValues([])
+            self.widget.memoryGraph.setValues([])
+            # Nothing of the previous owner's may show through
+            for label in [self.widget.pidLabel, self.widget.statusLabel, self.widget.interfaceLabel, \
+                    self.widget.configLabel, self.widget.logLabel, self.widget.rootLabel, self.widget.healthLabel, \
+                    self.widget.resourcesLabel, self.widget.limitsLabel]:
+                label.setText('---')
+            self.widget.restartsLabel.setText('not supervised')
+            self.widget.restartsLabel.setToolTip('')
+            self.widget.show()
+        else:
+            self.widget = Globals.loadUi('ui/process_widget.ui', Globals.mainWindow.window)
+            capacity = Globals.mainWindow.resourceMonitor.historySize
+            self.widget.cpuGraph = Sparkline(self.widget.cpuGraphArea, '#2a6fc9', capacity)
+            self.widget.cpuGraphArea.layout().addWidget(self.widget.cpuGraph)
+            self.widget.memoryGraph = Sparkline(self.widget.memoryGraphArea, '#b5482a', capacity)
+            self.widget.memoryGraphArea.layout().addWidget(self.widget.memoryGraph)
+        self.cpuGraph = self.widget.cpuGraph
+        self.memoryGraph = self.widget.memoryGraph
+        
+        self.widget.superviseCheckBox.setChecked(self.supervised)
+        
+        # Connect button events
+        self.widget.manageButton.clicked.connect(self.createManager)
+        self.widget.superviseCheckBox.toggled.connect(self.toggleSupervision)
+        # TODO: Button to wrap as standalone app or VM
+        
+        self.updateWidget()
+        if self.resources != None:
+            self.applyResources(self.resources)
+    
+    def releaseWidget(self):
+        # Takes our widget out of the overview and keeps it for the next
+        # Process that needs one
+        widget = self.widget
+        if widget == None:
+            return
+        self.widget = None
+        Globals.mainWindow.window.scrollContents.layout().removeWidget(widget)
+        widget.hide()
+        widget.manageButton.clicked.disconnect(self.createManager)
+        widget.superviseCheckBox.toggled.disconnect(self.toggleSupervision)
+        if len(Globals.widgetPool) < Globals.widgetPoolSize:
+            Globals.widgetPool.append(widget)
+        else:
+            widget.deleteLater()
+    
+    def probe(self, record, generation):
+        # Runs on a worker thread
+        return (generation,) + Instance.probe(self, record)
+    
+    def applyProbe(self, state):
+        if state[0] != self.probeGeneration:
+            # A newer probe (or a local edit) has superseded this one
+            return
+        self.apply(state[1:])
+        self.updateWidget()
+    
+    @tracer.timed('gui.updateWidget', 'qt')
+    def updateWidget(self):
+        Globals.mainWindow.instanceModel.processChanged(self)
+        if self.widget == None:
+            if self.manager != None and self.config != None:
+                self.updateManager()
+            return
+        
+        if self.config == None:
+            # Still waiting on the first probe
+            self.widget.groupBox.setTitle('(checking status...)')
+            self.widget.indicator.setPixmap(Globals.redPixmap)
+            self.widget.pidLabel.setText('---' if self.pid == None else str(self.pid))
+            self.widget.statusLabel.setText(self.runningStatus)
+            return
+        
+        if self.pid == None:
+            # We're not running...
+            self.widget.indicator.setPixmap(Globals.redPixmap)
+            
+            # Set the widget fields to blank except configLabel
+            self.widget.groupBox.setTitle('(process not running)')
+            self.widget.configLabel.setText(self.configPath)
+            self.widget.pidLabel.setText('---')
+            self.widget.statusLabel.setText(self.runningStatus)
+            self.widget.interfaceLabel.setText('---')
+            self.widget.logLabel.setText('---')
+            self.widget.rootLabel.setText('---')
+            self.widget.healthLabel.setText('---')
+            self.widget.resourcesLabel.setText('---')
+            self.widget.limitsLabel.setText('---')
+            self.cpuGraph.setValues([])
+            self.memoryGraph.setValues([])
+        else:
+            self.updateHealth()
+            
+            # Display info in our widget
+            self.widget.groupBox.setTitle(str(self.pid))
+            self.widget.pidLabel.setText(str(self.pid))
+            self.widget.statusLabel.setText(self.runningStatus)
+            self.widget.interfaceLabel.setText(self.config['hostname'] + ":" + str(self.config['port']))
+            self.widget.configLabel.setText(self.configPath)
+            self.widget.logLabel.setText(os.path.join(self.config['logdir'], 'tangelo.log'))
+            self.widget.rootLabel.setText(self.config['root'])
+        
+        self.updateSupervision()
+        
+        # Update our manager if it exists
+        if self.manager != None:
+            self.updateManager()
+        
+    def toggleSupervision(self, checked):
+        if checked:
+            Globals.mainWindow.supervisor.supervise(self)
+        else:
+            Globals.mainWindow.supervisor.release(self)
+        self.updateSupervision()
+    
+    def updateSupervision(self):
+        if self.widget == None:
+            return
+        supervisor = Globals.mainWindow.supervisor
+        self.widget.restartsLabel.setText(supervisor.describe(self))
+        self.widget.restartsLabel.setToolTip('\n'.join(event.describe() for event in supervisor.history(self)))
+    
+    def indicator(self):
+        # Green when tangelo says we're running and the server answers in
+        # time, yellow when it's running but slow, failing or not answering
+        if not self.isRunning():
+            return Globals.redPixmap, Globals.redIcon
+        if self.health == None or self.health.state == HEALTHY:
+            return Globals.greenPixmap, Globals.greenIcon
+        return Globals.yellowPixmap, Globals.yellowIcon
+    
+    def applyHealth(self, health):
+        if self.pid == None:
+            # Stopped while the check was on its way
+            return
+        self.health = health
+        Globals.mainWindow.instanceModel.processChanged(self)
+        if self.widget != None:
+            self.updateHealth()
+        if self.manager != None:
+            self.manager.setWindowIcon(self.indicator()[1])
+    
+    def updateHealth(self):
+        self.widget.indicator.setPixmap(self.indicator()[0])
+        if self.health != None:
+            self.widget.healthLabel.setText(self.health.describe())
+        elif self.isRunning():
+            self.widget.healthLabel.setText('(not checked yet)')
+        else:
+            self.widget.healthLabel.setText('---')
+    
+    def applyResources(self, history):
+        self.resources = history
+        Globals.mainWindow.instanceModel.processChanged(self)
+        if self.widget == None:
+            return
+        latest = history.latest()
+        self.widget.resourcesLabel.setText(latest.describe())
+        if latest.limits != None:
+            self.widget.limitsLabel.setText(latest.limits.describe())
+        self.cpuGraph.setValues(history.values('cpu'))
+        self.cpuGraph.setToolTip('CPU %%, peak %.0f%%' % max(history.values('cpu')))
+        self.memoryGraph.setValues(history.values('rss'))
+        self.memoryGraph.setToolTip('Memory, peak %d MB' % (max(history.values('rss')) / (1024 * 1024)))
+    
+    def createManager(self):
+        if self.config == None:
+            # Nothing to show until the first probe has finished
+            return
+        if self.manager != None:
+            # Opening the window again starts over from the config
+            self.managerPid = None
+            self.updateManager()
+            self.manager.show()
+        else:
+            # Create the window
+            self.manager = Globals.loadUi('ui/process_manager.ui', Globals.mainWindow.window)
+            
+            self.updateManager(True)
+            self.manager.show()
+    
+    def updateManager(self, wireConnections=False):
+        if self.pid == None:
+            self.manager.setWindowTitle(self.configPath + " (pid: ---)")
+            self.manager.setWindowIcon(Globals.redIcon)
+            # leave all the fields as they are, but change the button text
+            self.manager.restartButton.setText("Save and Start")
+            self.manager.stopButton.setEnabled(False)
+        else:
+            self.manager.setWindowTitle(self.configPath + " (pid: " + str(self.pid) + ")")
+            self.manager.setWindowIcon(self.indicator()[1])
+            # Populate the fields from our config object, but only when the
+            # window opens or the process changes: a timed refresh mustn't
+            # throw away edits that haven't been saved yet
+            if wireConnections or self.managerPid != self.pid:
+                self.fillManagerFields()
+            self.manager.restartButton.setText("Save and Restart")
+            self.manager.stopButton.setEnabled(True)
+        self.managerPid = self.pid
+            
+        # Show the relevant log file (just the console output if not a daemon)
+        self.updateLog()
+        
+        if wireConnections:
+            self.manager.drop_privilegesCheckBox.stateChanged.connect(self.togglePrivileges)
+            self.manager.browseRoot.clicked.connect(self.browseRoot)
+            self.manager.browseLogdir.clicked.connect(self.browseLogdir)
+            self.manager.browseVtk.clicked.connect(self.browseVtk)
+            
+            self.manager.stopButton.clicked.connect(self.stop)
+            self.manager.restartButton.clicked.connect(self.restart)
+            self.manager.cancelButton.clicked.connect(self.manager.close)
+            self.manager.olderLogButton.clicked.connect(self.loadOlderLog)
+            
+            # Keep following the log while the window is open
+            self.logTimer = QTimer(self.manager)
+            self.logTimer.timeout.connect(self.followLog)
+            self.logTimer.start(Globals.logPollInterval)
+    
+    def fillManagerFields(self):
+        self.manager.hostnameField.setText(self.config['hostname'])
+        self.manager.portField.setValue(self.config['port'])
+        self.manager.rootField.setText(self.config['root'])
+        self.manager.logdirField.setText(self.config['logdir'])
+        self.manager.vtkField.setText(self.config['vtkpython'])
+        if self.config['drop_privileges']:
+            self.manager.drop_privilegesCheckBox.setChecked(Qt.Checked)
+            self.manager.drop_privilegesExtras.setEnabled(True)
+        else:
+            self.manager.drop_privilegesCheckBox.setChecked(Qt.Unchecked)
+            self.manager.drop_privilegesExtras.setEnabled(False)
+        self.manager.userField.setText(self.config['user'])
+        self.manager.groupField.setText(self.config['group'])
+        self.manager.daemonizeCheckBox.setChecked(Qt.Checked if self.config['daemonize'] else Qt.Unchecked)
+        if sys.platform.startswith('win'):
+            assert not self.config['daemonize']
+            self.manager.daemonizeCheckBox.setEnabled(False)
+        self.manager.access_authCheckBox.setChecked(Qt.Checked if self.config['access_auth'] else Qt.Unchecked)
+        self.showLimits()
+    
+    def showLimits(self):
+        try:
+            limits = LaunchLimits.fromConfig(self.config)
+        except LimitsError:
+            # Left for the next start to complain about
+            limits = LaunchLimits()
+        settings = {}
+        limits.toConfig(settings)
+        settings = settings.get(configKey, {})
+        self.manager.cpusField.setText(str(settings.get('cpus', '')))
+        self.manager.niceField.setText(str(settings.get('nice', '')))
+        self.manager.ioniceField.setText(str(settings.get('ionice', '')))
+        self.manager.memoryField.setText(str(settings.get('memory', '')))
+        self.manager.openFilesField.setText(str(settings.get('open_files', '')))
+    
+    def limitsFromFields(self):
+        # Raises LimitsError if any of them doesn't make sense
+        return LaunchLimits.fromConfig({configKey : {
+            'cpus' : self.manager.cpusField.text().strip(),
+            'nice' : self.manager.niceField.text().strip(),
+            'ionice' : self.manager.ioniceField.text().strip(),
+            'memory' : self.manager.memoryField.text().strip(),
+            'open_files' : self.manager.openFilesField.text().strip()
+        }})
+    
+    def logSource(self):
+        # The console output we're capturing for a non-daemon we started, or
+        # else tangelo's own log file
+        if self.nonDaemonProcess != None and self.capture != None:
+            return self.capture
+        return os.path.join(self.config['logdir'], 'tangelo.log')
+    
+    def followLog(self):
+        if self.manager != None and self.manager.isVisible():
+            self.updateLog()
+    
+    @tracer.timed('gui.updateLog', 'qt')
+    def updateLog(self):
+        # Only the bytes appended since the last look are read; the browser
+        # keeps at most Globals.logMaxLines lines unless older pages are
+        # explicitly loaded
+        browser = self.manager.logBrowser
+        source = self.logSource()
+        if self.logTail == None or self.logTailSource != source:
+            if source == self.capture:
+                self.logTail = self.capture.reader()
+            else:
+                self.logTail = LogTail(source, Globals.logInitialBytes)
+            self.logTailSource = source
+            browser.clear()
+        
+        if not self.logTail.exists():
+            self.manager.statusbar.showMessage("Couldn't open log file.")
+            self.manager.olderLogButton.setEnabled(False)
+            return
+        
+        reset, text = self.logTail.read()
+        if reset:
+            browser.setMaximumBlockCount(Globals.logMaxLines)
+            browser.clear()
+        if text != '':
+            browser.appendPlainText(text[:-1].decode('utf-8', 'replace'))
+        
+        if source != self.capture:
+            self.manager.statusbar.showMessage(source)
+        elif self.capture.logPath != None:
+            self.manager.statusbar.showMessage("console output (also saved to " + self.capture.logPath + ")")
+        else:
+            self.manager.statusbar.showMessage("console output")
+        self.manager.olderLogButton.setEnabled(self.logTail.hasOlder())
+    
+    def loadOlderLog(self):
+        text = self.logTail.readOlder(Globals.logPageBytes)
+        if text != '':
+            # Make room for the older lines so they aren't trimmed right away
+            browser = self.manager.logBrowser
+            browser.setMaximumBlockCount(browser.blockCount() + text.count('\n'))
+            cursor = QTextCursor(browser.document())
+            cursor.movePosition(QTextCursor.Start)
+            cursor.insertText(text.decode('utf-8', 'replace'))
+        self.manager.olderLogButton.setEnabled(self.logTail.hasOlder())
+    
+    def updateConfig(self):
+        assert self.manager != None
+        limits = self.limitsFromFields()
+        self.config['hostname'] = self.manager.hostnameField.text()
+        self.config['port'] = self.manager.portField.value()
+        self.config['root'] = self.manager.rootField.text()
+        self.config['logdir'] = self.manager.logdirField.text()
+        self.config['vtkpython'] = self.manager.vtkField.text()
+        self.config['drop_privileges'] = self.manager.drop_privilegesCheckBox.checkState() == Qt.Checked
+        self.config['user'] = self.manager.userField.text()
+        self.config['group'] = self.manager.groupField.text()
+        self.config['daemonize'] = self.manager.daemonizeCheckBox.checkState() == Qt.Checked
+        assert not sys.platform.startswith('win') or not self.config['daemonize']
+        self.config['access_auth'] = self.manager.access_authCheckBox.checkState() == Qt.Checked
+        limits.toConfig(self.config)
+        # Anything a probe read before this point is stale
+        self.probeGeneration += 1
+        # Returns what changed in the file
+        changes = Globals.mainWindow.configChanges(self.config, self.configPath)
+        Globals.mainWindow.saveConfig(self.config, self.configPath)
+        return changes
+    
+    def togglePrivileges(self):
+        if self.manager.drop_privilegesCheckBox.checkState() == Qt.Checked:
+            self.manager.drop_privilegesExtras.setEnabled(True)
+        else:
+            self.manager.drop_privilegesExtras.setEnabled(False)
+    
+    def browseRoot(self):
+        path = QFileDialog.getExistingDirectory(self.manager, u"Choose the root directory", self.manager.rootField.text())[0]
+        if path != '':
+            self.manager.rootField.setText(path)
+    
+    def browseLogdir(self):
+        path = QFileDialog.getExistingDirectory(self.manager, u"Choose the log directory", self.manager.logdirField.text())[0]
+        if path != '':
+            self.manager.logdirField.setText(path)
+    
+    def browseVtk(self):
+        path = QFileDialog.getOpenFileName(self.manager, u"Where is vtkpython?", self.manager.vtkField.text())[0]
+        if path != '':
+            self.manager.vtkField.setText(path)
+    
+    def stop(self):
+        Globals.mainWindow.modifyProcess(['stop', '--pid', str(self.pid), '--verbose'], self, Globals.mainWindow.showOutput)
+    
+    def restart(self):
+        # Corner case: we can't change the daemonize flag while a daemon is
+        # running, or tangelo enters a weird state. If we're trying to do this,
+        # we need to stop it separately before we mess with anything
+        try:
+            self.limitsFromFields()
+        except LimitsError as e:
+            QMessageBox.warning(self.manager, u"Launch limits", str(e))
+            return
+        if self.pid != None and self.config['daemonize'] and self.manager.daemonizeCheckBox.checkState() == Qt.Unchecked:
+            Globals.mainWindow.modifyProcess(['stop', '--pid', str(self.pid), '--verbose'], self, \
+                lambda output: self.saveAndStart(output + "\n\n"))
+        else:
+            self.saveAndStart("")
+    
+    def saveAndStart(self, output):
+        changes = self.updateConfig()
+        if len(changes) > 0:
+            output += "Config changes:\n" + describeChanges(changes) + "\n\n"
+        else:
+            output += "Config unchanged...\n\n"
+        # What's about to change is shown before it happens
+        Globals.mainWindow.showOutput(output)
+        
+        def finished(startOutput):
+            Globals.mainWindow.showOutput(output + startOutput)
+        
+        # handles start or restart
+        if self.pid == None:
+            Globals.mainWindow.modifyProcess(['start', '-c', self.configPath, '--verbose'], self, finished)
+        else:
+            Globals.mainWindow.modifyProcess(['restart', '--pid', str(self.pid), '-c', self.configPath, '--verbose'], self, finished)
+
+class RemoteProcess(RemoteInstance):
+    # A row for an instance on another host; it has no panel or manager, and
+    # is only changed through its agent
+    def __init__(self, client, description):
+        RemoteInstance.__init__(self, client, description)
+        self.widget = None
+        self.manager = None
+        self.supervised = False
+    
+    def indicator(self):
+        if self.isRunning():
+            return Globals.greenPixmap, Globals.greenIcon
+        return Globals.redPixmap, Globals.redIcon
+    
+    def releaseWidget(self):
+        pass
+
+class Overview(Fleet):
+    def __init__(self):
+        Fleet.__init__(self, Globals.pythonPath, Globals.tangeloPath)
+        # Keep the console output of instances we run without daemonizing
+        self.captureDir = Globals.captureDir
+        self.portAllocator = PortAllocator(Globals.portRecordPath)
+        self.stateStore = Globals.stateStore
+        
+        # Load UI files
+        self.window = Globals.loadUi('ui/overview.ui')
+        
+        self.processes = {}
+        self.deadProcesses = {}
+        self.refreshing = False
+        
+        # Automatic refreshes back off while nothing changes
+        self.autoRefreshInterval = Globals.autoRefreshMinInterval
+        self.refreshTimer = QTimer(self.window)
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.timeout.connect(self.autoRefresh)
+        
+        # Running instances are checked over HTTP on a fixed schedule
+        self.healthTimer = QTimer(self.window)
+        self.healthTimer.timeout.connect(self.pollHealth)
+        # Processes whose check hasn't come back yet; a hung instance gets
+        # no new check until its last one times out
+        self.checkingHealth = set()
+        self.healthTimer.start(Globals.healthInterval)
+        
+        # ... and so is their resource usage
+        self.sampling = False
+        self.topDialog = None
+        self.searchDialog = None
+        self.diagnosticsDialog = None
+        self.resourceTimer = QTimer(self.window)
+        self.resourceTimer.timeout.connect(self.pollResources)
+        self.resourceTimer.start(Globals.resourceInterval)
+        
+        # What we know is written down every so often (when it changed), so
+        # the next start can show it before anything has been checked
+        self.stateTimer = QTimer(self.window)
+        self.stateTimer.timeout.connect(self.saveState)
+        self.stateTimer.start(Globals.stateSaveInterval)
+        QApplication.instance().aboutToQuit.connect(self.saveState)
+        QApplication.instance().aboutToQuit.connect(self.statusProbe.close)
+        
+        # Supervised instances that crash are started again; a non-daemon
+        # one we started says so itself, the rest are noticed by polling
+        self.supervisor = Supervisor()
+        self.supervisor.notify = lambda instance: Globals.dispatcher.deliver(self.superviseInstances, instance)
+        self.supervisorTimer = QTimer(self.window)
+        self.supervisorTimer.timeout.connect(self.superviseInstances)
+        self.supervisorTimer.start(Globals.supervisorInterval)
+        
+        # Instances on other hosts, through their agents: {(host, pid) : RemoteProcess}
+        self.agents = AgentPool(self.stateStore.agents, Globals.agentToken)
+        self.agents.instanceClass = RemoteProcess
+        self.remoteProcesses = {}
+        self.remoteRefreshing = False
+        QApplication.instance().aboutToQuit.connect(self.agents.close)
+        
+        # Anything that keeps the event loop busy (our own callbacks, Qt
+        # layout and painting) shows up as a late heartbeat
+        self.lastHeartbeat = time.time()
+        self.heartbeatTimer = QTimer(self.window)
+        self.heartbeatTimer.timeout.connect(self.heartbeat)
+        self.heartbeatTimer.start(Globals.heartbeatInterval)
+        
+        # The table lists every instance; the panels tab shows the full
+        # widget of each, built only while that tab is open
+        self.instanceModel = InstanceModel(self.window)
+        self.instanceProxy = QSortFilterProxyModel(self.window)
+        self.instanceProxy.setSourceModel(self.instanceModel)
+        self.instanceProxy.setSortRole(Qt.UserRole)
+        self.instanceProxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.instanceProxy.setDynamicSortFilter(True)
+        self.window.instanceTable.setModel(self.instanceProxy)
+        self.window.instanceTable.sortByColumn(0, Qt.AscendingOrder)
+        
+        # Events
+        self.window.refreshButton.clicked.connect(self.refresh)
+        self.window.startButton.clicked.connect(self.findOrSaveConfig)
+        self.window.autoRefreshCheckBox.toggled.connect(self.toggleAutoRefresh)
+        self.window.stopSelectedButton.clicked.connect(self.stopSelected)
+        self.window.restartSelectedButton.clicked.connect(self.restartSelected)
+        self.window.rollingRestartButton.clicked.connect(self.rollingRestartSelected)
+        self.window.startManyButton.clicked.connect(self.startMany)
+        self.window.topButton.clicked.connect(self.showTopInstances)
+        self.window.searchLogsButton.clicked.connect(self.showLogSearch)
+        self.window.diagnosticsButton.clicked.connect(self.showDiagnostics)
+        self.window.hostsButton.clicked.connect(self.showHosts)
+        self.window.instanceTable.doubleClicked.connect(self.manageRow)
+        self.window.filterField.textChanged.connect(self.filterInstances)
+        self.window.filterColumnBox.currentIndexChanged.connect(self.filterInstances)
+        self.window.viewTabs.currentChanged.connect(self.switchView)
+        self.window.show()
+        
+    def panelsVisible(self):
+        return self.window.viewTabs.currentIndex() == self.window.viewTabs.indexOf(self.window.panelsTab)
+    
+    def addProcess(self, process):
+        self.instanceModel.addProcess(process)
+        if self.panelsVisible():
+            self.showPanel(process)
+    
+    def showPanel(self, process):
+        if process.widget == None and process.host == None:
+            process.createWidget()
+            self.window.scrollContents.layout().addWidget(process.widget)
+    
+    def switchView(self, index):
+        # Panels are only kept while they can be seen, so a long list of
+        # instances costs one table row each the rest of the time
+        self.window.scrollContents.setUpdatesEnabled(False)
+        for process in self.instanceModel.processes:
+            if self.panelsVisible():
+                self.showPanel(process)
+            else:
+                process.releaseWidget()
+        self.window.scrollContents.setUpdatesEnabled(True)
+    
+    def filterInstances(self, *args):
+        column = self.window.filterColumnBox.currentText()
+        if column in InstanceModel.columns:
+            self.instanceProxy.setFilterKeyColumn(InstanceModel.columns.index(column))
+        else:
+            self.instanceProxy.setFilterKeyColumn(-1)
+        self.instanceProxy.setFilterFixedString(self.window.filterField.text())
+    
+    def manageRow(self, index):
+        process = self.instanceModel.processes[self.instanceProxy.mapToSource(index).row()]
+        if process.host != None:
+            self.showRemoteLog(process)
+        else:
+            process.createManager()
+    
+    def restoreState(self):
+        # Rows for the instances that were running when we last looked. They
+        # are checked like any other by the refresh that follows.
+        for entry in self.stateStore.instances:
+            if entry['pid'] == None or self.processes.has_key(entry['pid']):
+                continue
+            process = Process(entry['pid'], entry['configPath'])
+            process.config = entry['config']
+            process.runningStatus = entry['status']
+            process.restored = True
+            self.processes[process.pid] = process
+            if entry.get('supervised'):
+                self.supervisor.supervise(process)
+            self.addProcess(process)
+            process.updateWidget()
+        if len(self.processes) > 0:
+            self.window.statusbar.showMessage('Showing ' + str(len(self.processes)) + \
+                ' instance(s) from last time; checking...')
+    
+    def saveState(self):
+        self.stateStore.setInstances([process for process in self.processes.values() if process.isRunning()])
+        try:
+            self.stateStore.save()
+        except (IOError, OSError) as e:
+            self.window.statusbar.showMessage("Couldn't save " + self.stateStore.path + ": " + str(e))
+    
+    def superviseInstances(self, *args):
+        due, changed = self.supervisor.poll()
+        for process in changed:
+            process.updateSupervision()
+        for process in due:
+            self.restartCrashed(process)
+        # Keep the countdowns current
+        for process in self.instanceModel.processes:
+            if process.supervised and process.widget != None:
+                process.updateSupervision()
+    
+    def restartCrashed(self, process):
+        # Through the same start as the Start button, just on the old config
+        self.supervisor.restarting(process)
+        # Whatever we ran before has exited, so there's nothing to kill
+        process.nonDaemonProcess = None
+        pid = process.pid
+        
+        def finished(output):
+            self.window.consoleOutput.appendPlainText('Restarted crashed pid ' + str(pid) + ' (' + \
+                process.configPath + ') as pid ' + str(process.pid))
+        
+        self.modifyProcess(['start', '-c', process.configPath, '--verbose'], process, finished)
+    
+    def updateWidgets(self):
+        Globals.workers.submit(self.getDaemonStatuses, callback=self.probeProcesses, errback=self.probeFailed)
+    
+    def probeProcesses(self, statuses):
+        for proc in self.processes.itervalues():
+            self.probeProcess(proc, statuses.get(proc.pid))
+        for proc in self.deadProcesses.itervalues():
+            self.probeProcess(proc, None)
+    
+    def probeProcess(self, process, record):
+        # Each instance is probed on its own worker, so slow config reads
+        # or psutil lookups for one instance don't hold up the others
+        process.probeGeneration += 1
+        Globals.workers.submit(process.probe, (record, process.probeGeneration), \
+            callback=process.applyProbe, errback=self.workerFailed)
+    
+    def pollHealth(self):
+        for process in self.processes.values():
+            if process.config != None and process.isRunning() and process not in self.checkingHealth:
+                self.checkingHealth.add(process)
+                Globals.workers.submit(self.checkHealth, (process,), callback=self.healthChecked(process), \
+                    errback=self.healthFailed(process))
+    
+    def healthChecked(self, process):
+        def applyHealth(health):
+            self.checkingHealth.discard(process)
+            process.applyHealth(health)
+        return applyHealth
+    
+    def healthFailed(self, process):
+        def failed(error):
+            self.checkingHealth.discard(process)
+            self.workerFailed(error)
+        return failed
+    
+    def pollResources(self):
+        if self.sampling:
+            # The previous sample is still being taken
+            return
+        self.sampling = True
+        pids = [pid for pid, process in self.processes.iteritems() if process.config != None and process.isRunning()]
+        Globals.workers.submit(self.sampleResources, (pids,), callback=self.applyResources, \
+            errback=self.samplingFailed)
+    
+    def applyResources(self, samples):
+        self.sampling = False
+        for pid in samples:
+            process = self.processes.get(pid)
+            history = self.resourceMonitor.history(pid)
+            if process != None and history != None:
+                process.applyResources(history)
+        if self.topDialog != None and self.topDialog.isVisible():
+            self.updateTopInstances()
+    
+    def samplingFailed(self, error):
+        self.sampling = False
+        self.workerFailed(error)
+    
+    def showTopInstances(self):
+        if self.topDialog == None:
+            self.topDialog = Globals.loadUi('ui/top_instances.ui', self.window)
+            self.topDialog.closeButton.clicked.connect(self.topDialog.hide)
+            self.topDialog.table.sortByColumn(2, Qt.DescendingOrder)
+        self.updateTopInstances()
+        self.topDialog.show()
+    
+    def updateTopInstances(self):
+        table = self.topDialog.table
+        # Sorting while rows are filled in would move them under our feet
+        table.setSortingEnabled(False)
+        top = self.resourceMonitor.top('rss')
+        table.setRowCount(len(top))
+        for row, (pid, sample) in enumerate(top):
+            process = self.processes.get(pid)
+            values = [int(pid), round(sample.cpu, 1), \
+                None if sample.rss == None else round(sample.rss / (1024.0 * 1024.0), 1), \
+                sample.fds, sample.threads, sample.connections, process.configPath if process != None else '']
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, '?' if value == None else value)
+                table.setItem(row, column, item)
+        table.setSortingEnabled(True)
+        table.resizeColumnsToContents()
+    
+    def heartbeat(self):
+        now = time.time()
+        expected = self.lastHeartbeat + Globals.heartbeatInterval / 1000.0
+        if now - expected > Globals.stallThreshold:
+            tracer.record('gui.stall', 'qt', expected, now - expected)
+        self.lastHeartbeat = now
+    
+    def showDiagnostics(self):
+        if self.diagnosticsDialog == None:
+            dialog = self.diagnosticsDialog = Globals.loadUi('ui/diagnostics.ui', self.window)
+            dialog.table.sortByColumn(3, Qt.DescendingOrder)
+            dialog.timer = QTimer(dialog)
+            dialog.timer.timeout.connect(self.updateDiagnostics)
+            
+            def close():
+                dialog.timer.stop()
+                dialog.hide()
+            
+            def reset():
+                tracer.reset()
+                self.updateDiagnostics()
+            
+            def export(caption, suffix, write):
+                path = QFileDialog.getSaveFileName(dialog, caption, os.path.expanduser('~/tangelo-wrapper-' + suffix))[0]
+                if path == '':
+                    return
+                try:
+                    write(path)
+                except IOError as e:
+                    QMessageBox.warning(dialog, caption, "Couldn't write " + path + ": " + e.strerror)
+            
+            dialog.closeButton.clicked.connect(close)
+            dialog.resetButton.clicked.connect(reset)
+            dialog.exportJsonButton.clicked.connect(lambda: export(u"Export timings", 'timings.json', \
+                tracer.exportJson))
+            dialog.exportTraceButton.clicked.connect(lambda: export(u"Export Chrome trace", 'trace.json', \
+                tracer.exportChromeTrace))
+        self.updateDiagnostics()
+        self.diagnosticsDialog.timer.start(1000)
+        self.diagnosticsDialog.show()
+    
+    def updateDiagnostics(self):
+        table = self.diagnosticsDialog.table
+        table.setSortingEnabled(False)
+        summary = tracer.summary()
+        table.setRowCount(len(summary))
+        
+        def milliseconds(seconds):
+            return None if seconds == None else round(seconds * 1000, 2)
+        
+        for row, name in enumerate(sorted(summary.keys())):
+            timing = summary[name]
+            values = [name, timing['category'], timing['count'], round(timing['total'], 3), \
+                milliseconds(timing['mean']), milliseconds(timing['p50']), milliseconds(timing['p95']), \
+                milliseconds(timing['max'])]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                table.setItem(row, column, item)
+        table.setSortingEnabled(True)
+        table.resizeColumnsToContents()
+    
+    def showLogSearch(self):
+        if self.searchDialog == None:
+            dialog = self.searchDialog = Globals.loadUi('ui/log_search.ui', self.window)
+            now = QDateTime.currentDateTime()
+            dialog.sinceEdit.setDateTime(now.addSecs(-3600))
+            dialog.untilEdit.setDateTime(now)
+            dialog.sinceCheckBox.toggled.connect(dialog.sinceEdit.setEnabled)
+            dialog.untilCheckBox.toggled.connect(dialog.untilEdit.setEnabled)
+            dialog.searchButton.clicked.connect(self.searchLogsNow)
+            dialog.patternField.returnPressed.connect(self.searchLogsNow)
+            dialog.closeButton.clicked.connect(dialog.hide)
+        self.searchDialog.show()
+        self.searchDialog.patternField.setFocus()
+    
+    def searchLogsNow(self):
+        # Indexing and searching happen on a worker; logs are indexed
+        # incrementally, so searching again later only reads what's new
+        dialog = self.searchDialog
+        try:
+            pattern = re.compile(dialog.patternField.text(), re.IGNORECASE if dialog.ignoreCaseCheckBox.isChecked() else 0)
+        except re.error as e:
+            dialog.statusLabel.setText('Bad regular expression: ' + str(e))
+            return
+        since = dialog.sinceEdit.dateTime().toTime_t() if dialog.sinceCheckBox.isChecked() else None
+        until = dialog.untilEdit.dateTime().toTime_t() if dialog.untilCheckBox.isChecked() else None
+        sources = self.logSources(self.processes.values())
+        dialog.searchButton.setEnabled(False)
+        dialog.statusLabel.setText('Searching ' + str(len(sources)) + ' log(s)...')
+        begin = time.time()
+        
+        def finished(result):
+            matches, failures = result
+            dialog.searchButton.setEnabled(True)
+            self.showLogMatches(matches, sources)
+            status = '%d match(es) in %d log(s), %.2fs' % (len(matches), len(sources), time.time() - begin)
+            if len(failures) > 0:
+                status += "; couldn't read " + ', '.join(sorted(failures.keys()))
+            dialog.statusLabel.setText(status)
+        
+        def failed(error):
+            dialog.searchButton.setEnabled(True)
+            dialog.statusLabel.setText('Search failed: ' + str(error))
+        
+        Globals.workers.submit(self.searchLogs, (sources.keys(), pattern, since, until, \
+            dialog.severityBox.currentIndex(), Globals.logSearchLimit), callback=finished, errback=failed)
+    
+    def showLogMatches(self, matches, sources):
+        table = self.searchDialog.resultsTable
+        table.setSortingEnabled(False)
+        table.setRowCount(len(matches))
+        for row, match in enumerate(matches):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(match.when)) if match.when != None else ''
+            pids = ', '.join(str(instance.pid) for instance in sources.get(match.path, []))
+            values = [when, severityNames[match.severity], pids, match.lineNumber, \
+                match.text.decode('utf-8', 'replace'), match.path]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                table.setItem(row, column, item)
+        table.setSortingEnabled(True)
+        table.resizeColumnsToContents()
+    
+    def refresh(self, clearOutputOnSuccess=True):
+        self.refreshing = True
+        self.window.refreshButton.setEnabled(False)
+        self.window.consoleOutput.setPlainText('Refreshing...')
+        Globals.workers.submit(self.takeSnapshot, callback=self.applySnapshot, errback=self.refreshFailed)
+        self.refreshRemote()
+    
+    def autoRefresh(self):
+        if self.refreshing:
+            # A refresh is already on its way; look again later
+            self.scheduleAutoRefresh(False)
+            return
+        self.refreshing = True
+        Globals.workers.submit(self.takeSnapshot, callback=lambda snapshot: self.applySnapshot(snapshot, True), \
+            errback=self.refreshFailed)
+        self.refreshRemote()
+    
+    def toggleAutoRefresh(self, checked):
+        if checked:
+            self.speedUpAutoRefresh()
+        else:
+            self.refreshTimer.stop()
+            self.window.statusbar.clearMessage()
+    
+    def scheduleAutoRefresh(self, changed):
+        if changed:
+            self.autoRefreshInterval = Globals.autoRefreshMinInterval
+        else:
+            self.autoRefreshInterval = min(self.autoRefreshInterval * 2, Globals.autoRefreshMaxInterval)
+        if self.window.autoRefreshCheckBox.isChecked():
+            self.refreshTimer.start(self.autoRefreshInterval)
+    
+    def speedUpAutoRefresh(self):
+        # Something was just started or stopped; watch it settle closely
+        self.scheduleAutoRefresh(True)
+    
+    @tracer.timed('gui.applySnapshot', 'qt')
+    def applySnapshot(self, snapshot, onlyChanges=False):
+        # With onlyChanges, instances whose pid, status, interface and root
+        # are the same as last time are left alone
+        self.refreshing = False
+        statuses, allProcesses = snapshot
+        daemonPids = statuses.keys()
+        # Lay the overview out once at the end, not once per added widget
+        self.window.scrollContents.setUpdatesEnabled(False)
+        
+        # Create our Process objects
+        added = []
+        for pid in daemonPids:
+            if not self.processes.has_key(pid):
+                self.processes[pid] = Process(pid, record=statuses[pid])
+                added.append(self.processes[pid])
+        
+        for pid, proc in allProcesses.iteritems():
+            if pid not in daemonPids and not self.processes.has_key(pid):
+                self.processes[pid] = Process(pid, nonDaemonProcess=proc)
+                added.append(self.processes[pid])
+        
+        # Instances remembered from last time only had a pid; a non-daemon
+        # one is told apart by its process, as if it had just been found
+        for pid, process in self.processes.iteritems():
+            if process.restored:
+                process.restored = False
+                if pid not in daemonPids and allProcesses.has_key(pid):
+                    process.nonDaemonProcess = allProcesses[pid]
+        
+        # Add the rows (and panels) that need to be created
+        for process in added:
+            self.addProcess(process)
+        changes = 0
+        for pid, process in self.processes.iteritems():
+            if onlyChanges and process not in added and process.config != None and \
+                    recordKey(statuses.get(pid)) == recordKey(process.record):
+                continue
+            changes += 1
+            self.probeProcess(process, statuses.get(pid))
+        
+        # Remove the ones that need to be removed
+        for processNumber, process in self.deadProcesses.items():
+            if process.manager != None and self.instanceModel.rows.has_key(process):
+                process.releaseWidget()
+                self.instanceModel.removeProcess(process)
+                del self.deadProcesses[processNumber]
+        
+        self.window.scrollContents.setUpdatesEnabled(True)
+        self.window.refreshButton.setEnabled(True)
+        if onlyChanges:
+            self.scheduleAutoRefresh(changes > 0)
+            self.window.statusbar.showMessage('Auto-refreshed: ' + str(changes) + ' changed, next check in ' + \
+                str(self.autoRefreshInterval / 1000) + 's (' + self.configCache.describe() + ')')
+            return
+        
+        if len(self.processes) == 0:
+            self.window.consoleOutput.setPlainText('No tangelo instances are running.')
+        else:
+            self.window.consoleOutput.setPlainText('Successfully refreshed.')
+        self.window.statusbar.showMessage(self.configCache.describe())
+    
+    def refreshRemote(self):
+        # Every agent is asked at once, on the pool's own threads
+        if len(self.agents.clients) == 0 or self.remoteRefreshing:
+            return
+        self.remoteRefreshing = True
+        Globals.workers.submit(self.agents.discover, callback=self.applyRemote, errback=self.remoteFailed)
+    
+    def applyRemote(self, result):
+        self.remoteRefreshing = False
+        instances, failures = result
+        found = {}
+        for instance in instances:
+            key = (instance.host, instance.pid)
+            process = self.remoteProcesses.get(key)
+            if process == None:
+                process = instance
+                self.instanceModel.addProcess(process)
+            else:
+                process.update(instance.description)
+                self.instanceModel.processChanged(process)
+            found[key] = process
+        
+        for key, process in self.remoteProcesses.items():
+            if key in found:
+                continue
+            if key[0] in failures:
+                # Not gone, as far as we know; just out of reach
+                process.runningStatus = 'unreachable'
+                self.instanceModel.processChanged(process)
+                found[key] = process
+            else:
+                self.instanceModel.removeProcess(process)
+        self.remoteProcesses = found
+        
+        for address in sorted(failures.keys()):
+            self.window.consoleOutput.appendPlainText("Couldn't ask " + str(failures[address]))
+    
+    def remoteFailed(self, error):
+        self.remoteRefreshing = False
+        self.window.consoleOutput.appendPlainText('Error: ' + str(error))
+    
+    def showHosts(self):
+        text, ok = QInputDialog.getText(self.window, u"Hosts", \
+            u"Agents whose instances to show too (host:port, separated by commas):", \
+            text=', '.join(self.agents.addresses()))
+        if not ok:
+            return
+        addresses = [address.strip() for address in text.split(',') if address.strip() != '']
+        try:
+            for address in addresses:
+                parseAddress(address)
+        except AgentError as e:
+            QMessageBox.warning(self.window, u"Hosts", str(e))
+            return
+        if len(addresses) > 0 and not Globals.agentToken:
+            # Agents only answer with their token
+            token, ok = QInputDialog.getText(self.window, u"Hosts", u"The agents' token:", QLineEdit.Password)
+            if not ok or token == '':
+                return
+            Globals.agentToken = token
+            self.agents.setToken(token)
+        self.agents.setAddresses(addresses)
+        self.stateStore.setAgents(addresses)
+        # Rows of agents that were taken out go with them
+        for key, process in self.remoteProcesses.items():
+            if key[0] not in addresses:
+                self.instanceModel.removeProcess(process)
+                del self.remoteProcesses[key]
+        self.refreshRemote()
+    
+    def showRemoteLog(self, process):
+        def finished(result):
+            path, text = result
+            self.window.consoleOutput.setPlainText('End of ' + path + ' on ' + process.host + ':\n\n' + text)
+        
+        self.window.consoleOutput.setPlainText('Reading the log of pid ' + str(process.pid) + ' on ' + \
+            process.host + '...')
+        Globals.workers.submit(self.agents.tail, (process,), callback=finished, errback=self.remoteFailed)
+    
+    def remoteAction(self, action, processes, parallelism):
+        # Through the agents, several at a time; the rows are updated in place
+        begin = time.time()
+        
+        def finished(results):
+            self.remoteProcesses = dict(((process.host, process.pid), process) \
+                for process in self.remoteProcesses.values() if process not in processes)
+            for process in processes:
+                if process.pid != None:
+                    self.remoteProcesses[(process.host, process.pid)] = process
+                    self.instanceModel.processChanged(process)
+                else:
+                    self.instanceModel.removeProcess(process)
+            self.window.consoleOutput.appendPlainText(formatBatch(action, results, time.time() - begin, parallelism))
+        
+        Globals.workers.submit(self.agents.runBatch, (action, processes, parallelism), callback=finished, \
+            errback=self.remoteFailed)
+    
+    def refreshFailed(self, error):
+        self.refreshing = False
+        self.window.refreshButton.setEnabled(True)
+        self.scheduleAutoRefresh(False)
+        self.probeFailed(error)
+    
+    def probeFailed(self, error):
+        # Not being able to run tangelo at all is the end of the road
+        if isinstance(error, OSError):
+            self.communicationAlert(error.strerror)
+        else:
+            self.workerFailed(error)
+    
+    def workerFailed(self, error):
+        if isinstance(error, (LaunchError, OSError)):
+            self.window.consoleOutput.appendPlainText(str(error))
+        else:
+            self.window.consoleOutput.appendPlainText('Error: ' + repr(error))
+    
+    def showOutput(self, output):
+        self.window.consoleOutput.setPlainText(output)
+    
+    def findOrSaveConfig(self):
+        dialog = Globals.loadUi('ui/config_path.ui', self.window)
+        
+        def browse():
+            path = QFileDialog.getSaveFileName(dialog, u"Choose or create a configuration file", dialog.pathBox.text())[0]
+            if path != '':
+                dialog.pathBox.setText(path)
+        
+        def cancel():
+            dialog.hide()
+        
+        def ok():
+            autodetectPort = dialog.autodetect.checkState() == Qt.Checked
+            configPath = os.path.expanduser(dialog.pathBox.text())
+            try:
+                self.portAllocator.ranges = parseRanges(dialog.portRangeField.text())
+            except PortError as e:
+                QMessageBox.warning(dialog, u"Port range", str(e))
+                return
+            dialog.hide()
+            self.start(configPath, autodetectPort)
+        
+        dialog.show()
+        dialog.pathBox.setText(os.path.expanduser('~/.config/tangelo/tangelo.conf'))
+        
+        dialog.browseButton.clicked.connect(browse)
+        dialog.cancelButton.clicked.connect(cancel)
+        dialog.okButton.clicked.connect(ok)
+    
+    def start(self, path, autodetectPort=True):
+        try:
+            output = self.prepareStart(path, autodetectPort)
+        except IOError as e:
+            self.window.consoleOutput.setPlainText("Couldn't save " + path + ": " + e.strerror)
+            return
+        except PortError as e:
+            self.window.consoleOutput.setPlainText("Couldn't start " + path + ": " + str(e))
+            return
+        
+        proc = Process(configPath=path)
+        proc.config = self.loadConfig(path)
+        if sys.platform.startswith('win'):
+            proc.config['daemonize'] = False
+        self.addProcess(proc)
+        
+        def finished(startOutput):
+            self.showOutput(output + startOutput)
+        
+        self.window.consoleOutput.setPlainText(output)
+        self.modifyProcess(['start', '-c', path, '--verbose'], proc, finished)
+    
+    def modifyProcess(self, command, process, callback=None):
+        # The tangelo command itself runs on a worker thread; once it is done
+        # (on the GUI thread again) the process is filed under its new pid and
+        # callback is given everything the command printed
+        
+        # Supervision stands aside while we change the process ourselves;
+        # after a stop, it waits for the next start
+        self.supervisor.pause(process)
+        self.forgetProcess(process)
+        command, output = self.beginCommand(command, process)
+        
+        def resume():
+            if 'stop' not in command:
+                self.supervisor.resume(process)
+            process.updateSupervision()
+        
+        def finished(result):
+            commandOutput = self.finishCommand(process, result)
+            self.fileProcess(process)
+            resume()
+            self.updateWidgets()
+            self.speedUpAutoRefresh()
+            if callback != None:
+                callback(output + commandOutput)
+        
+        def failed(error):
+            process.pid = None
+            self.deadProcesses[process.processNumber] = process
+            resume()
+            self.updateWidgets()
+            self.workerFailed(error)
+        
+        Globals.workers.submit(self.runCommand, (command, process), callback=finished, errback=failed)
+    
+    def forgetProcess(self, process):
+        # We don't want to store the process by its old pid anymore
+        if process.pid != None:
+            self.processes.pop(process.pid, None)
+        elif self.deadProcesses.has_key(process.processNumber):
+            del self.deadProcesses[process.processNumber]
+    
+    def fileProcess(self, process):
+        # If we started a new process, store it by its pid,
+        # otherwise remove it if its manager isn't open
+        if process.pid != None:
+            existing = self.processes.get(process.pid)
+            if existing != None and existing is not process:
+                # A refresh found the new pid before we did
+                self.removeDeadProcess(existing)
+            self.processes[process.pid] = process
+        else:
+            self.deadProcesses[process.processNumber] = process
+    
+    def selectedProcesses(self):
+        if self.panelsVisible():
+            selected = [process for process in self.instanceModel.processes \
+                if process.widget != None and process.widget.selectCheckBox.isChecked()]
+        else:
+            rows = self.window.instanceTable.selectionModel().selectedRows()
+            selected = [self.instanceModel.processes[self.instanceProxy.mapToSource(index).row()] for index in rows]
+        return [process for process in selected if process.config != None]
+    
+    def stopSelected(self):
+        self.bulkAction('stop', [process for process in self.selectedProcesses() if process.pid != None])
+    
+    def restartSelected(self):
+        self.bulkAction('restart', self.selectedProcesses())
+    
+    def rollingRestartSelected(self):
+        # Each selected instance is replaced by a healthy one on a new port
+        # before it is stopped, so no root loses capacity along the way
+        processes = [process for process in self.selectedProcesses() if process.host == None and process.isRunning()]
+        if len(processes) == 0:
+            self.window.consoleOutput.setPlainText('No running instances on this machine are selected.')
+            return
+        atOnce, ok = QInputDialog.getInt(self.window, u"Rolling restart", \
+            u"How many instances of each root to replace at a time:", 1, 1, len(processes))
+        if not ok:
+            return
+        for process in processes:
+            self.supervisor.pause(process)
+            if process.widget != None:
+                process.widget.selectCheckBox.setChecked(False)
+        self.window.instanceTable.clearSelection()
+        groups = groupByRoot(processes)
+        self.window.consoleOutput.setPlainText('Rolling restart of ' + str(len(processes)) + ' instance(s) serving ' + \
+            str(len(groups)) + ' root(s), ' + str(atOnce) + ' at a time...')
+        
+        def rollOut():
+            # One root after the other
+            batches = []
+            for root, group in groups:
+                begin = time.time()
+                batches.append((self.rollingRestart(group, atOnce, Globals.rolloutHealthTimeout), time.time() - begin))
+            return batches
+        
+        def resume():
+            for process in processes:
+                self.supervisor.resume(process)
+                process.updateSupervision()
+        
+        def finished(batches):
+            output = ""
+            for (root, group), (results, elapsed) in zip(groups, batches):
+                for process in group:
+                    self.forgetProcess(process)
+                self.finishRollingRestart(results)
+                for process in group:
+                    self.fileProcess(process)
+                output += "== " + root + "\n" + formatBatch('rolling restart', results, elapsed, atOnce)
+            resume()
+            self.updateWidgets()
+            self.speedUpAutoRefresh()
+            self.showOutput(output)
+        
+        def failed(error):
+            resume()
+            self.updateWidgets()
+            self.workerFailed(error)
+        
+        Globals.workers.submit(rollOut, callback=finished, errback=failed)
+    
+    def startMany(self):
+        paths = QFileDialog.getOpenFileNames(self.window, u"Choose configuration files to start", \
+            os.path.expanduser('~/.config/tangelo'))[0]
+        processes = []
+        for path in paths:
+            process = Process(configPath=path)
+            try:
+                process.config = self.loadConfig(path)
+            except (IOError, ValueError) as e:
+                self.window.consoleOutput.appendPlainText("Couldn't read " + path + ": " + str(e))
+                continue
+            if sys.platform.startswith('win'):
+                process.config['daemonize'] = False
+            processes.append(process)
+        if self.window.spreadCoresCheckBox.isChecked() and len(processes) > 0:
+            try:
+                self.spreadCores(processes)
+            except (LimitsError, IOError, OSError) as e:
+                self.window.consoleOutput.appendPlainText("Couldn't spread the instances across cores: " + str(e))
+                return
+        for process in processes:
+            self.addProcess(process)
+        self.bulkAction('start', processes)
+    
+    def bulkAction(self, action, processes):
+        # Runs action on every process, several at a time, on a worker thread;
+        # the per-instance results are summarized in the console
+        if len(processes) == 0:
+            self.window.consoleOutput.setPlainText('No instances are selected.')
+            return
+        parallelism = self.window.parallelismBox.value()
+        remote = [process for process in processes if process.host != None]
+        if len(remote) > 0:
+            self.window.instanceTable.clearSelection()
+            self.remoteAction(action, remote, parallelism)
+            processes = [process for process in processes if process.host == None]
+            if len(processes) == 0:
+                self.window.consoleOutput.setPlainText(action.capitalize() + ' of ' + str(len(remote)) + \
+                    ' instance(s) on other hosts...')
+                return
+        for process in processes:
+            self.supervisor.pause(process)
+            self.forgetProcess(process)
+            if process.widget != None:
+                process.widget.selectCheckBox.setChecked(False)
+        self.window.instanceTable.clearSelection()
+        self.window.consoleOutput.setPlainText(action.capitalize() + ' of ' + str(len(processes)) + \
+            ' instance(s), ' + str(parallelism) + ' at a time...')
+        begin = time.time()
+        
+        def resume():
+            for process in processes:
+                if action != 'stop':
+                    self.supervisor.resume(process)
+                process.updateSupervision()
+        
+        def finished(results):
+            self.finishBatch(results)
+            for process in processes:
+                self.fileProcess(process)
+            resume()
+            self.updateWidgets()
+            self.speedUpAutoRefresh()
+            self.showOutput(formatBatch(action, results, time.time() - begin, parallelism))
+        
+        def failed(error):
+            for process in processes:
+                process.pid = None
+                self.fileProcess(process)
+            resume()
+            self.updateWidgets()
+            self.workerFailed(error)
+        
+        Globals.workers.submit(self.runBatch, (action, processes, parallelism), callback=finished, errback=failed)
+    
+    def removeDeadProcess(self, process):
+        self.supervisor.release(process)
+        process.releaseWidget()
+        self.instanceModel.removeProcess(process)
+        if process.manager != None:
+            process.manager.close()
+            process.manager = None
+    
+    def communicationAlert(self, message):
+        sys.exit(Globals.criticalError("Sorry, there was an error communicating with tangelo:\n\n" + message))
+
+def main():
+    app = QApplication(sys.argv)
+    Globals.load()
+    exitCode = app.exec_()
+    del Globals.mainWindow
+    return exitCode
@@ -0,0 +1,149 @@
+import httplib, socket, threading, time
+from collections import deque
+from tangelo_wrapper.instrument import tracer
+
+# HTTP health checks of running instances. Connections are kept alive and
+# pooled per interface, so a check is normally one request on an open socket.
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+DOWN = 'down'
+
+def connectHost(hostname):
+    # An instance listening on every interface is reached through loopback
+    if hostname in ('', '0.0.0.0'):
+        return '127.0.0.1'
+    return hostname
+
+class LatencyWindow:
+    # The most recent response times of one interface, in seconds
+    def __init__(self, size=20):
+        self.samples = deque(maxlen=size)
+
+    def add(self, latency):
+        self.samples.append(latency)
+
+    def percentile(self, p):
+        if len(self.samples) == 0:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+    def p50(self):
+        return self.percentile(50)
+
+    def p95(self):
+        return self.percentile(95)
+
+class HealthStatus:
+    def __init__(self, state, latency=None, p50=None, p95=None, code=None, error=None):
+        self.state = state
+        self.latency = latency
+        self.p50 = p50
+        self.p95 = p95
+        self.code = code
+        self.error = error
+
+    def describe(self):
+        if self.state == DOWN:
+            return 'not answering (' + str(self.error) + ')'
+        text = self.state + ': p50 %.0f ms, p95 %.0f ms' % (self.p50 * 1000, self.p95 * 1000)
+        if self.code >= 500:
+            text += ' (HTTP ' + str(self.code) + ')'
+        return text
+
+class HealthProber:
+    # An instance is DEGRADED when it answers with a server error, or when
+    # the 95th percentile of its recent response times is above
+    # degradedLatency; DOWN when it can't be reached at all
+    def __init__(self, path='/', timeout=2.0, degradedLatency=1.0, windowSize=20):
+        self.path = path
+        self.timeout = timeout
+        self.degradedLatency = degradedLatency
+        self.windowSize = windowSize
+        self.idle = {}
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    @tracer.timed('health.check', 'http')
+    def check(self, hostname, port):
+        # Safe to call from several worker threads at once
+        key = (connectHost(hostname), int(port))
+        connection, pooled = self.takeConnection(key)
+        try:
+            latency, code = self.request(connection)
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            # A kept-alive connection may have been closed by the server in
+            # the meantime, so that is worth one more try on a fresh one; a
+            # fresh connection failing, or anything timing out, means it's
+            # down (and trying again would only hold a worker twice as long)
+            if not pooled or isinstance(e, socket.timeout):
+                return HealthStatus(DOWN, error=e)
+            connection = self.newConnection(key)
+            try:
+                latency, code = self.request(connection)
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                return HealthStatus(DOWN, error=e)
+        self.putConnection(key, connection)
+
+        self.lock.acquire()
+        try:
+            window = self.windows.get(key)
+            if window == None:
+                window = self.windows[key] = LatencyWindow(self.windowSize)
+            window.add(latency)
+            p50, p95 = window.p50(), window.p95()
+        finally:
+            self.lock.release()
+
+        state = HEALTHY
+        if code >= 500 or p95 > self.degradedLatency:
+            state = DEGRADED
+        return HealthStatus(state, latency, p50, p95, code)
+
+    def request(self, connection):
+        begin = time.time()
+        connection.request('GET', self.path, headers={'Connection' : 'keep-alive'})
+        response = connection.getresponse()
+        # The body has to be read before the connection can be reused
+        response.read()
+        latency = time.time() - begin
+        if response.getheader('connection', '').lower() == 'close':
+            connection.close()
+        return latency, response.status
+
+    def takeConnection(self, key):
+        # Returns (connection, whether it came from the idle pool)
+        self.lock.acquire()
+        try:
+            pool = self.idle.get(key)
+            if pool:
+                return pool.pop(), True
+        finally:
+            self.lock.release()
+        return self.newConnection(key), False
+
+    def newConnection(self, key):
+        return httplib.HTTPConnection(key[0], key[1], timeout=self.timeout)
+
+    def putConnection(self, key, connection):
+        self.lock.acquire()
+        try:
+            self.idle.setdefault(key, []).append(connection)
+        finally:
+            self.lock.release()
+
+    def forget(self, hostname, port):
+        # Drops the connections and latency history of an interface that is
+        # no longer in use, e.g. after a restart on a different port
+        key = (connectHost(hostname), int(port))
+        self.lock.acquire()
+        try:
+            connections = self.idle.pop(key, [])
+            self.windows.pop(key, None)
+        finally:
+            self.lock.release()
+        for connection in connections:
+            connection.close()
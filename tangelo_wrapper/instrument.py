@@ -0,0 +1,185 @@
+import threading, time, json
+from collections import deque
+
+# Timing of the wrapper's own work: every tangelo invocation, psutil scan,
+# config read, log read and widget update runs inside a span. Spans feed a
+# histogram per operation, and the most recent ones are kept for a Chrome
+# trace (chrome://tracing, or https://ui.perfetto.dev). A span costs a few
+# microseconds, against the milliseconds of the work it wraps, so this is
+# always on.
+
+class Histogram:
+    # Durations in power-of-two buckets of microseconds: bucket i holds
+    # durations under 2**i us, so percentiles are accurate to within 2x
+    bucketCount = 40
+
+    def __init__(self):
+        self.counts = [0] * Histogram.bucketCount
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(int(seconds * 1000000).bit_length(), Histogram.bucketCount - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min == None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        if self.count == 0:
+            return None
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min((2 ** bucket) / 1000000.0, self.max)
+        return self.max
+
+    def describe(self):
+        return {
+            'count' : self.count,
+            'total' : self.total,
+            'mean' : self.total / self.count if self.count > 0 else None,
+            'min' : self.min,
+            'max' : self.max,
+            'p50' : self.percentile(0.5),
+            'p95' : self.percentile(0.95),
+            'p99' : self.percentile(0.99)
+        }
+
+class Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.begin = time.time()
+        return self
+
+    def __exit__(self, *exception):
+        self.tracer.record(self.name, self.category, self.begin, time.time() - self.begin, self.args)
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        pass
+
+nullSpan = NullSpan()
+
+class Tracer:
+    def __init__(self, enabled=True, traceSize=20000):
+        self.enabled = enabled
+        self.histograms = {}
+        self.categories = {}
+        # (name, category, begin, duration, thread, args), oldest first
+        self.events = deque(maxlen=traceSize)
+        self.threadNames = {}
+        self.lock = threading.Lock()
+
+    def span(self, name, category='wrapper', **args):
+        # with tracer.span('status.helper', 'subprocess'): ...
+        if not self.enabled:
+            return nullSpan
+        return Span(self, name, category, args)
+
+    def timed(self, name, category='wrapper'):
+        # Decorator: the whole function is one span
+        def decorate(function):
+            def wrapper(*args, **kwargs):
+                with self.span(name, category):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            return wrapper
+        return decorate
+
+    def record(self, name, category, begin, duration, args=None):
+        thread = threading.current_thread()
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.get(name)
+            if histogram == None:
+                histogram = self.histograms[name] = Histogram()
+                self.categories[name] = category
+            histogram.add(duration)
+            self.events.append((name, category, begin, duration, thread.ident, args))
+            if thread.ident not in self.threadNames:
+                self.threadNames[thread.ident] = thread.name
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.histograms = {}
+            self.categories = {}
+            self.events.clear()
+        finally:
+            self.lock.release()
+
+    def summary(self):
+        # {operation : {category, count, total, mean, min, max, p50, p95, p99}}, in seconds
+        self.lock.acquire()
+        try:
+            summary = {}
+            for name, histogram in self.histograms.iteritems():
+                summary[name] = histogram.describe()
+                summary[name]['category'] = self.categories[name]
+            return summary
+        finally:
+            self.lock.release()
+
+    def chromeTrace(self):
+        # The Trace Event Format: complete ("X") events in microseconds,
+        # plus the names of the threads they ran on
+        self.lock.acquire()
+        try:
+            events = list(self.events)
+            threadNames = dict(self.threadNames)
+        finally:
+            self.lock.release()
+
+        pid = 1
+        traceEvents = []
+        for thread, name in threadNames.iteritems():
+            traceEvents.append({'name' : 'thread_name', 'ph' : 'M', 'pid' : pid, 'tid' : thread, 'args' : {'name' : name}})
+        for name, category, begin, duration, thread, args in events:
+            event = {
+                'name' : name,
+                'cat' : category,
+                'ph' : 'X',
+                'ts' : int(begin * 1000000),
+                'dur' : int(duration * 1000000),
+                'pid' : pid,
+                'tid' : thread
+            }
+            if args:
+                event['args'] = args
+            traceEvents.append(event)
+        return {'traceEvents' : traceEvents, 'displayTimeUnit' : 'ms'}
+
+    def exportJson(self, path):
+        outfile = open(path, 'w')
+        try:
+            json.dump(self.summary(), outfile, indent=4, sort_keys=True)
+        finally:
+            outfile.close()
+
+    def exportChromeTrace(self, path):
+        outfile = open(path, 'w')
+        try:
+            json.dump(self.chromeTrace(), outfile)
+        finally:
+            outfile.close()
+
+# The one everything records into
+tracer = Tracer()
@@ -0,0 +1,336 @@
+import sys, os, psutil
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# What a launched instance may use: the CPUs it runs on, its CPU and I/O
+# priority, and its address space and open file limits. They are kept in the
+# instance's config file, e.g.
+#
+#   "launch_limits": {"cpus": "0-3", "nice": 10, "ionice": "best-effort:4",
+#                     "memory": "2G", "open_files": 4096}
+#
+# The niceness and the resource limits are applied to the tangelo command as
+# it is spawned, so a daemon it forks inherits them. The CPUs and the I/O
+# priority need psutil, which isn't safe between fork and exec, so they are
+# set on every thread of the instance once it has started. psutil reads back
+# what a running instance actually has, whoever started it.
+
+configKey = 'launch_limits'
+ioniceClasses = ['realtime', 'best-effort', 'idle']
+sizeSuffixes = {'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3, 'T' : 1024 ** 4}
+
+class LimitsError(Exception):
+    pass
+
+def parseCpus(text):
+    # "0-3,6" -> [0, 1, 2, 3, 6]
+    cpus = set()
+    for part in str(text).split(','):
+        part = part.strip()
+        if part == '':
+            continue
+        try:
+            if '-' in part:
+                low, high = [int(bound) for bound in part.split('-', 1)]
+            else:
+                low = high = int(part)
+        except ValueError:
+            raise LimitsError('Not a CPU list: ' + repr(text))
+        if low < 0 or high < low:
+            raise LimitsError('Not a CPU list: ' + repr(text))
+        cpus.update(range(low, high + 1))
+    return sorted(cpus)
+
+def formatCpus(cpus):
+    # [0, 1, 2, 3, 6] -> "0-3,6"
+    parts = []
+    for cpu in sorted(cpus):
+        if len(parts) > 0 and parts[-1][1] == cpu - 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ','.join(str(low) if low == high else '%d-%d' % (low, high) for low, high in parts)
+
+def parseSize(text):
+    # "2G" -> 2147483648; a plain number is in bytes
+    original = text
+    text = str(text).strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    multiplier = 1
+    if text[-1:] in sizeSuffixes:
+        multiplier = sizeSuffixes[text[-1]]
+        text = text[:-1]
+    try:
+        size = int(float(text) * multiplier)
+    except ValueError:
+        raise LimitsError('Not a size: ' + repr(original))
+    if size <= 0:
+        raise LimitsError('Not a size: ' + repr(original))
+    return size
+
+def formatSize(size):
+    for suffix in ['T', 'G', 'M', 'K']:
+        if size >= sizeSuffixes[suffix] and size % sizeSuffixes[suffix] == 0:
+            return str(size / sizeSuffixes[suffix]) + suffix
+    return str(size)
+
+def parseIonice(text):
+    # "idle", "best-effort:4" or "realtime:0" -> (class, level or None)
+    name, separator, level = str(text).strip().lower().partition(':')
+    if name not in ioniceClasses:
+        raise LimitsError('Not an I/O class: ' + repr(text) + ' (use ' + ', '.join(ioniceClasses) + ')')
+    if separator == '' or name == 'idle':
+        return name, None
+    try:
+        level = int(level)
+    except ValueError:
+        level = -1
+    if not 0 <= level <= 7:
+        raise LimitsError('I/O priority levels go from 0 to 7, not ' + repr(text))
+    return name, level
+
+def availableCpus():
+    # The CPUs we may run on (and so may hand out)
+    process = psutil.Process()
+    if hasattr(process, 'cpu_affinity'):
+        return process.cpu_affinity()
+    return range(psutil.cpu_count())
+
+def spreadCpus(count, cpus=None):
+    # Divides cpus (by default all we may use) between count instances:
+    # [[CPU]] with as even and disjoint a share as possible; with more
+    # instances than CPUs, instances share single CPUs round-robin
+    if cpus == None:
+        cpus = availableCpus()
+    cpus = sorted(cpus)
+    if count <= len(cpus):
+        shares = []
+        start = 0
+        for i in range(count):
+            end = start + len(cpus) / count + (1 if i < len(cpus) % count else 0)
+            shares.append(cpus[start:end])
+            start = end
+        return shares
+    return [[cpus[i % len(cpus)]] for i in range(count)]
+
+class LaunchLimits:
+    def __init__(self, cpus=None, nice=None, ionice=None, memory=None, openFiles=None):
+        # Each one None when it isn't limited. cpus: [int]; ionice: (class
+        # name, level or None); memory: bytes of address space.
+        self.cpus = cpus
+        self.nice = nice
+        self.ionice = ionice
+        self.memory = memory
+        self.openFiles = openFiles
+
+    @staticmethod
+    def fromConfig(config):
+        settings = config.get(configKey) or {}
+        if not isinstance(settings, dict):
+            raise LimitsError(configKey + ' should be a dictionary of settings')
+        limits = LaunchLimits()
+        try:
+            if settings.get('cpus') not in (None, ''):
+                cpus = settings['cpus']
+                limits.cpus = sorted(set(int(cpu) for cpu in cpus)) if isinstance(cpus, list) else parseCpus(cpus)
+            if settings.get('nice') not in (None, ''):
+                limits.nice = int(settings['nice'])
+            if settings.get('ionice') not in (None, ''):
+                limits.ionice = parseIonice(settings['ionice'])
+            if settings.get('memory') not in (None, ''):
+                limits.memory = parseSize(settings['memory'])
+            if settings.get('open_files') not in (None, ''):
+                limits.openFiles = int(settings['open_files'])
+        except (TypeError, ValueError):
+            raise LimitsError('Bad ' + configKey + ': ' + repr(settings))
+        limits.check()
+        return limits
+
+    def check(self):
+        if self.cpus != None and len(self.cpus) == 0:
+            raise LimitsError('An instance needs at least one CPU')
+        if self.nice != None and not -20 <= self.nice <= 19:
+            raise LimitsError('Niceness goes from -20 to 19, not ' + str(self.nice))
+        if self.openFiles != None and self.openFiles <= 0:
+            raise LimitsError('Not an open file limit: ' + str(self.openFiles))
+
+    def toConfig(self, config):
+        # Stores the limits in config, leaving no trace when there are none
+        settings = {}
+        if self.cpus != None:
+            settings['cpus'] = formatCpus(self.cpus)
+        if self.nice != None:
+            settings['nice'] = self.nice
+        if self.ionice != None:
+            settings['ionice'] = self.ionice[0] if self.ionice[1] == None else '%s:%d' % self.ionice
+        if self.memory != None:
+            settings['memory'] = formatSize(self.memory)
+        if self.openFiles != None:
+            settings['open_files'] = self.openFiles
+        if len(settings) > 0:
+            config[configKey] = settings
+        else:
+            config.pop(configKey, None)
+
+    def isEmpty(self):
+        return self.cpus == None and self.nice == None and self.ionice == None and self.memory == None and \
+            self.openFiles == None
+
+    def describe(self):
+        parts = []
+        if self.cpus != None:
+            parts.append('cpus ' + formatCpus(self.cpus))
+        if self.nice != None:
+            parts.append('nice ' + str(self.nice))
+        if self.ionice != None:
+            parts.append('io ' + (self.ionice[0] if self.ionice[1] == None else '%s:%d' % self.ionice))
+        if self.memory != None:
+            parts.append('memory ' + formatSize(self.memory))
+        if self.openFiles != None:
+            parts.append(str(self.openFiles) + ' files')
+        return ', '.join(parts) if len(parts) > 0 else 'none'
+
+    def preexec(self):
+        # A function for Popen's preexec_fn, or None if there's nothing it
+        # has to do (or no way to do it before the exec)
+        if self.isEmpty() or sys.platform.startswith('win'):
+            return None
+        return self.applyToSelf
+
+    def applyToSelf(self):
+        # Runs in the child between fork and exec, where a lock some other
+        # thread held at the fork stays locked, so only plain os and resource
+        # calls belong here; applyAfterStart does the rest. A LimitsError
+        # raised here comes back out of Popen in the parent.
+        try:
+            if self.nice != None:
+                os.nice(self.nice - os.nice(0))
+            if resource != None:
+                if self.memory != None:
+                    setLimit(resource.RLIMIT_AS, self.memory)
+                if self.openFiles != None:
+                    setLimit(resource.RLIMIT_NOFILE, self.openFiles)
+            elif self.memory != None or self.openFiles != None:
+                raise LimitsError('Memory and open file limits are not supported here')
+        except (OSError, ValueError) as e:
+            raise LimitsError("Couldn't apply launch limits (" + self.describe() + "): " + str(e))
+
+    def applyAfterStart(self, pid):
+        # What applyToSelf leaves out, the CPUs and the I/O priority, for the
+        # instance pid that was started with it: set on each of its threads,
+        # since a thread keeps what it had when it was created. Returns what
+        # couldn't be applied.
+        if self.cpus == None and self.ionice == None:
+            return []
+        try:
+            process = psutil.Process(int(pid))
+            # Only Linux threads can be told apart like processes
+            ids = [thread.id for thread in process.threads()] if sys.platform.startswith('linux') else [process.pid]
+        except psutil.Error as e:
+            return [str(e)]
+        for id in ids:
+            try:
+                self.applyScheduling(psutil.Process(id))
+            except psutil.NoSuchProcess:
+                # A thread that has finished since
+                pass
+            except (OSError, ValueError, psutil.Error, LimitsError) as e:
+                return [str(e)]
+        return []
+
+    def applyTo(self, pid):
+        # The same for a process that is already running (Linux only for the
+        # memory and open file limits); returns what couldn't be applied
+        failures = []
+        try:
+            process = psutil.Process(int(pid))
+        except psutil.NoSuchProcess as e:
+            return [str(e)]
+        for name, limit, value in [('memory', 'RLIMIT_AS', self.memory), ('open files', 'RLIMIT_NOFILE', self.openFiles)]:
+            if value == None:
+                continue
+            if not hasattr(process, 'rlimit'):
+                failures.append(name + ': not supported here')
+                continue
+            try:
+                soft, hard = process.rlimit(getattr(psutil, limit))
+                process.rlimit(getattr(psutil, limit), (value, raisedHard(value, hard)))
+            except (OSError, ValueError, psutil.Error) as e:
+                failures.append(name + ': ' + str(e))
+        try:
+            if self.nice != None:
+                process.nice(self.nice)
+            self.applyScheduling(process)
+        except (OSError, ValueError, psutil.Error, LimitsError) as e:
+            failures.append(str(e))
+        return failures
+
+    def applyScheduling(self, process):
+        if self.cpus != None:
+            if not hasattr(process, 'cpu_affinity'):
+                raise LimitsError('CPU affinity is not supported here')
+            process.cpu_affinity(self.cpus)
+        if self.ionice != None:
+            if not hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+                raise LimitsError('I/O priorities are not supported here')
+            ioclass = {'realtime' : psutil.IOPRIO_CLASS_RT, 'best-effort' : psutil.IOPRIO_CLASS_BE, \
+                'idle' : psutil.IOPRIO_CLASS_IDLE}[self.ionice[0]]
+            if self.ionice[1] != None:
+                process.ionice(ioclass, self.ionice[1])
+            else:
+                process.ionice(ioclass)
+
+def raisedHard(value, hard):
+    # A soft limit above the hard one needs the hard one raised too (which
+    # only the superuser may do)
+    infinity = resource.RLIM_INFINITY if resource != None else -1
+    if hard != infinity and value > hard:
+        return value
+    return hard
+
+def setLimit(limit, value):
+    soft, hard = resource.getrlimit(limit)
+    resource.setrlimit(limit, (value, raisedHard(value, hard)))
+
+def readLimits(handle):
+    # The LaunchLimits a running process actually has, as far as we may see:
+    # only what differs from an unlimited default, except the open file
+    # limit, which every process has. Returns None if it has exited.
+    limits = LaunchLimits()
+    try:
+        if hasattr(handle, 'cpu_affinity'):
+            try:
+                cpus = handle.cpu_affinity()
+                if len(cpus) < psutil.cpu_count():
+                    limits.cpus = cpus
+            except psutil.AccessDenied:
+                pass
+        nice = handle.nice()
+        if isinstance(nice, int) and nice != 0:
+            limits.nice = nice
+        if hasattr(handle, 'ionice') and hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+            try:
+                ioclass, level = handle.ionice()
+                names = {psutil.IOPRIO_CLASS_RT : 'realtime', psutil.IOPRIO_CLASS_BE : 'best-effort', \
+                    psutil.IOPRIO_CLASS_IDLE : 'idle'}
+                if ioclass in names:
+                    limits.ionice = (names[ioclass], None if ioclass == psutil.IOPRIO_CLASS_IDLE else level)
+            except psutil.AccessDenied:
+                pass
+        if hasattr(handle, 'rlimit'):
+            try:
+                memory = handle.rlimit(psutil.RLIMIT_AS)[0]
+                if memory != psutil.RLIM_INFINITY:
+                    limits.memory = memory
+                openFiles = handle.rlimit(psutil.RLIMIT_NOFILE)[0]
+                if openFiles != psutil.RLIM_INFINITY:
+                    limits.openFiles = openFiles
+            except psutil.AccessDenied:
+                pass
+    except psutil.NoSuchProcess:
+        return None
+    return limits
@@ -0,0 +1,309 @@
+import os, re, time, threading
+from array import array
+from collections import deque
+from tangelo_wrapper.instrument import tracer
+
+# Searchable index of a log file. Rather than one entry per line, the log is
+# cut into blocks of about blockSize bytes at line boundaries, and for each
+# block only its offset, first line number, time range and worst severity
+# are kept: a few dozen bytes per 64K of log, worked out from the block as a
+# whole. A search picks the blocks that could match, reads just those back
+# from disk, and only works out the time and severity of matching lines.
+
+DEBUG = 0
+INFO = 1
+WARNING = 2
+ERROR = 3
+severityNames = ['debug', 'info', 'warning', 'error']
+
+# cherrypy / tangelo: [18/Oct/2026:07:37:47]; python logging and most
+# everything else: 2026-10-18 07:37:47. Split into minute and second, since
+# only the minute needs the (slow) strptime.
+timestampPattern = re.compile(r'\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}):(\d{2})|(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}):(\d{2})')
+# One pass finds every severity hint in a line: keywords, and the status
+# of an access log entry
+severityPattern = re.compile(r'\b(?:(CRITICAL|FATAL|ERROR|Traceback)|(WARNING|WARN)|(DEBUG))\b|" (?:(5)|(4))\d\d ')
+# ... and a rougher but much faster check of a whole block at once
+errorWords = ['CRITICAL', 'FATAL', 'ERROR', 'Traceback']
+serverErrorPattern = re.compile(r'" 5\d\d ')
+clientErrorPattern = re.compile(r'" 4\d\d ')
+
+def severityOf(text):
+    hints = severityPattern.findall(text)
+    if len(hints) == 0:
+        return INFO
+    severity = DEBUG
+    for error, warning, debug, serverError, clientError in hints:
+        if error or serverError:
+            return ERROR
+        elif warning or clientError:
+            severity = WARNING
+    return severity
+
+def blockSeverity(data):
+    # May overestimate (e.g. ERRORS counts), which only costs a search a
+    # block read; never underestimates
+    for word in errorWords:
+        if word in data:
+            return ERROR
+    if serverErrorPattern.search(data):
+        return ERROR
+    if 'WARN' in data or clientErrorPattern.search(data):
+        return WARNING
+    return INFO
+
+class LineParser:
+    # Works out when each line was written and how bad it is. Lines without
+    # a timestamp (e.g. a traceback) belong to the entry above them.
+    def __init__(self):
+        self.times = {}
+        self.lastTime = None
+        self.lastSeverity = INFO
+
+    def parse(self, line):
+        when = self.timestamp(line)
+        severity = severityOf(line)
+
+        if when == None:
+            when = self.lastTime
+            if when != None:
+                severity = max(severity, self.lastSeverity)
+        self.lastTime = when
+        self.lastSeverity = severity
+        return when, severity
+
+    def timestamp(self, line):
+        return self.timeOf(timestampPattern.search(line, 0, 64))
+
+    def timeOf(self, match):
+        if match == None:
+            return None
+        cherrypyMinute, cherrypySecond, isoMinute, isoSecond = match.groups()
+        minute = cherrypyMinute or isoMinute
+        when = self.times.get(minute)
+        if when == None:
+            try:
+                if cherrypyMinute != None:
+                    when = time.mktime(time.strptime(minute, '%d/%b/%Y:%H:%M'))
+                else:
+                    when = time.mktime(time.strptime(minute.replace('T', ' '), '%Y-%m-%d %H:%M'))
+            except ValueError:
+                return None
+            if len(self.times) > 10000:
+                self.times.clear()
+            self.times[minute] = when
+        return when + int(cherrypySecond or isoSecond)
+
+def splitLines(data):
+    # Like splitlines(True), but only on '\n', which is what line numbers count
+    lines = [line + '\n' for line in data.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+class LogMatch:
+    def __init__(self, path, lineNumber, offset, when, severity, text):
+        self.path = path
+        self.lineNumber = lineNumber
+        self.offset = offset
+        self.when = when
+        self.severity = severity
+        self.text = text
+
+    def describe(self):
+        return {
+            'log' : self.path,
+            'line' : self.lineNumber,
+            'offset' : self.offset,
+            'time' : self.when,
+            'severity' : severityNames[self.severity],
+            'text' : self.text
+        }
+
+class LogIndex:
+    def __init__(self, path, blockSize=64 * 1024):
+        self.path = path
+        self.blockSize = blockSize
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.starts = array('l')
+        self.lineNumbers = array('l')
+        self.firstTimes = array('d')
+        self.lastTimes = array('d')
+        self.severities = array('b')
+        # What the parser knew going into each block, for continuation lines
+        self.entryTimes = array('d')
+        self.entrySeverities = array('b')
+        self.end = 0
+        self.lines = 0
+        self.inode = None
+        self.parser = LineParser()
+
+    @tracer.timed('log.index', 'io')
+    def update(self):
+        # Indexes whatever was appended since the last update; starts over if
+        # the file was rotated or truncated. Returns False if there's no log.
+        self.lock.acquire()
+        try:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self.clear()
+                return False
+            if stat.st_ino != self.inode or stat.st_size < self.end:
+                self.clear()
+                self.inode = stat.st_ino
+            if stat.st_size == self.end:
+                return True
+
+            infile = open(self.path, 'rb')
+            try:
+                infile.seek(self.end)
+                while True:
+                    data = infile.read(self.blockSize)
+                    if data == '':
+                        break
+                    complete = data.rfind('\n') + 1
+                    if complete == 0:
+                        if len(data) < self.blockSize:
+                            # Only half a line so far; index it when it's done
+                            break
+                        # A huge line; index it as far as we've read
+                        complete = len(data)
+                    self.indexLines(data[:complete])
+                    if complete < len(data):
+                        infile.seek(self.end)
+            finally:
+                infile.close()
+            return True
+        finally:
+            self.lock.release()
+
+    def indexLines(self, data):
+        # data is whole lines. Appended to the last block if that is still
+        # small, so frequent small updates don't make lots of tiny blocks.
+        parser = self.parser
+        entryTime, entrySeverity = parser.lastTime, parser.lastSeverity
+        lines = data.count('\n') + (0 if data.endswith('\n') else 1)
+
+        first = timestampPattern.search(data)
+        severity = blockSeverity(data)
+        if entryTime != None and (first == None or data.rfind('\n', 0, first.start()) != -1):
+            # The block starts in the middle of an entry
+            severity = max(severity, entrySeverity)
+
+        # Pick up the parser's state at the end of the block from the last
+        # entry in it, which is normally within the last few lines
+        last = None
+        for match in timestampPattern.finditer(data, max(0, len(data) - 8192)):
+            last = match
+        if last == None and first != None:
+            for match in timestampPattern.finditer(data):
+                last = match
+        tail = data
+        if last != None:
+            tail = data[data.rfind('\n', 0, last.start()) + 1:]
+        for line in splitLines(tail):
+            parser.parse(line)
+
+        firstTime = parser.timeOf(first) if first != None else entryTime
+        firstTime = -1.0 if firstTime == None else firstTime
+        lastTime = -1.0 if parser.lastTime == None else parser.lastTime
+        if len(self.starts) > 0 and self.end - self.starts[-1] + len(data) <= self.blockSize:
+            if self.firstTimes[-1] < 0:
+                self.firstTimes[-1] = firstTime
+            self.lastTimes[-1] = max(self.lastTimes[-1], lastTime)
+            self.severities[-1] = max(self.severities[-1], severity)
+        else:
+            self.starts.append(self.end)
+            self.lineNumbers.append(self.lines)
+            self.entryTimes.append(-1.0 if entryTime == None else entryTime)
+            self.entrySeverities.append(entrySeverity)
+            self.firstTimes.append(firstTime)
+            self.lastTimes.append(lastTime)
+            self.severities.append(severity)
+        self.end += len(data)
+        self.lines += lines
+
+    def candidateBlocks(self, since, until, minSeverity):
+        # Lines without any known time can't be ruled out by a time range
+        blocks = []
+        for i in range(len(self.starts)):
+            if self.severities[i] < minSeverity:
+                continue
+            if since != None and 0 <= self.lastTimes[i] < since:
+                continue
+            if until != None and self.firstTimes[i] > until:
+                continue
+            end = self.starts[i + 1] if i + 1 < len(self.starts) else self.end
+            entryTime = self.entryTimes[i] if self.entryTimes[i] >= 0 else None
+            blocks.append((self.starts[i], end, self.lineNumbers[i], entryTime, self.entrySeverities[i]))
+        return blocks
+
+    @tracer.timed('log.search', 'io')
+    def search(self, pattern, since=None, until=None, minSeverity=DEBUG, limit=None):
+        # pattern is a compiled regular expression. Returns the last limit
+        # LogMatches in file order, reading only the blocks that could
+        # contain one.
+        self.lock.acquire()
+        try:
+            blocks = self.candidateBlocks(since, until, minSeverity)
+        finally:
+            self.lock.release()
+
+        matches = deque(maxlen=limit)
+        parser = LineParser()
+        infile = open(self.path, 'rb')
+        try:
+            for start, end, lineNumber, entryTime, entrySeverity in blocks:
+                infile.seek(start)
+                data = infile.read(end - start)
+                # Severity and time depend on the lines above, so pick up
+                # where the indexer was when it got to this block
+                parser.lastTime = entryTime
+                parser.lastSeverity = entrySeverity
+                lines = splitLines(data)
+                parsed = 0
+                offset = start
+                for i in range(len(lines)):
+                    line = lines[i]
+                    offset += len(line)
+                    if not pattern.search(line):
+                        continue
+                    # Catch the parser up to this line. Anything before the
+                    # closest line with its own timestamp doesn't matter.
+                    j = i
+                    while j > parsed and timestampPattern.search(lines[j], 0, 64) == None:
+                        j -= 1
+                    for k in range(j, i + 1):
+                        when, severity = parser.parse(lines[k])
+                    parsed = i + 1
+                    if severity >= minSeverity and (since == None or when == None or when >= since) and \
+                            (until == None or when == None or when <= until):
+                        matches.append(LogMatch(self.path, lineNumber + i + 1, offset - len(line), when, severity, \
+                            line.rstrip('\r\n')))
+        finally:
+            infile.close()
+        return list(matches)
+
+    def stats(self):
+        return {'blocks' : len(self.starts), 'lines' : self.lines, 'bytes' : self.end}
+
+def parseTime(text, now=None):
+    # "90s", "15m", "2h", "3d" ago, or an absolute local time like
+    # "2026-10-18 07:30" / "2026-10-18T07:30:00"
+    if now == None:
+        now = time.time()
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', text.strip())
+    if match != None:
+        return now - float(match.group(1)) * {'s' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400}[match.group(2)]
+    text = text.strip().replace('T', ' ')
+    for format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(text, format))
+        except ValueError:
+            pass
+    raise ValueError("Don't know when " + repr(text) + " is")
@@ -0,0 +1,93 @@
+import os
+from tangelo_wrapper.instrument import tracer
+
+class LogTail:
+    # Follows a (possibly huge) log file: only the end of the file is read at
+    # first, after that only bytes appended since the last read, and older
+    # content is paged in from disk on request. Only whole lines are handed
+    # out; a partially written last line waits for the next read.
+    def __init__(self, path, initialBytes=256 * 1024, maxReadBytes=1024 * 1024):
+        self.path = path
+        self.initialBytes = initialBytes
+        self.maxReadBytes = maxReadBytes
+        self.inode = None
+        self.start = 0
+        self.offset = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @tracer.timed('log.read', 'io')
+    def read(self):
+        # Returns (reset, text). reset is True when everything handed out
+        # before is gone (first read, rotation or truncation) and the
+        # viewer should start over with text.
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return (False, '')
+
+        reset = False
+        if self.inode == None or stat.st_ino != self.inode or stat.st_size < self.offset:
+            # First look at this file, it was rotated, or it was truncated
+            reset = True
+            self.inode = stat.st_ino
+            self.start = self.offset = max(0, stat.st_size - self.initialBytes)
+        elif stat.st_size - self.offset > self.maxReadBytes:
+            # Too much arrived at once to be worth showing; skip to the end
+            reset = True
+            self.start = self.offset = stat.st_size - self.initialBytes
+
+        if stat.st_size == self.offset:
+            return (reset, '')
+
+        infile = open(self.path, 'rb')
+        try:
+            infile.seek(self.offset)
+            data = infile.read(stat.st_size - self.offset)
+        finally:
+            infile.close()
+
+        if reset and self.start > 0:
+            # We started in the middle of the file; drop the partial first line
+            newline = data.find(b'\n')
+            if newline == -1:
+                return (reset, '')
+            self.start += newline + 1
+            self.offset += newline + 1
+            data = data[newline + 1:]
+
+        end = data.rfind(b'\n')
+        if end == -1:
+            return (reset, '')
+        self.offset += end + 1
+        return (reset, data[:end + 1])
+
+    def hasOlder(self):
+        return self.start > 0
+
+    @tracer.timed('log.readOlder', 'io')
+    def readOlder(self, maxBytes=256 * 1024):
+        # Returns the whole lines just before what has been handed out so
+        # far, reading at most about maxBytes from disk
+        if self.start == 0:
+            return ''
+
+        begin = max(0, self.start - maxBytes)
+        infile = open(self.path, 'rb')
+        try:
+            infile.seek(begin)
+            data = infile.read(self.start - begin)
+        finally:
+            infile.close()
+
+        if begin > 0:
+            newline = data.find(b'\n')
+            if newline == -1:
+                # A single line longer than maxBytes; hand it out in pieces
+                self.start = begin
+                return data
+            begin += newline + 1
+            data = data[newline + 1:]
+        self.start = begin
+        return data
@@ -0,0 +1,192 @@
+import os, json, socket, threading
+from tangelo_wrapper.state import writeAtomically
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Hands out ports for new instances. Finding a port by binding port 0 and
+# closing the socket again leaves a window before tangelo binds it, in which
+# a parallel start (or anything else) can take the same port. Instead, a
+# port stays reserved here until the instance using it is up, and the port
+# each config file got is remembered on disk, so the same config gets the
+# same port next time, and no other config is given it meanwhile.
+
+defaultRecordPath = os.path.expanduser('~/.config/tangelo-wrapper/ports.json')
+
+class PortError(Exception):
+    pass
+
+def parseRanges(text):
+    # "8080-8099,9000" -> [(8080, 8099), (9000, 9000)]
+    ranges = []
+    for part in text.split(','):
+        part = part.strip()
+        if part == '':
+            continue
+        try:
+            if '-' in part:
+                low, high = [int(bound) for bound in part.split('-', 1)]
+            else:
+                low = high = int(part)
+        except ValueError:
+            raise PortError('Not a port range: ' + repr(part))
+        if not 0 < low <= high < 65536:
+            raise PortError('Not a port range: ' + repr(part))
+        ranges.append((low, high))
+    return ranges
+
+def isFree(port):
+    # Whether we could listen on port right now. Like tangelo, allow
+    # reusing a port whose old connections are still closing, so a restart
+    # can get its port back straight away.
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('', port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+def ephemeralPort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+class PortAllocator:
+    def __init__(self, recordPath=None, ranges=None):
+        # recordPath: where assignments are kept (None: only in memory).
+        # ranges: [(low, high)] to allocate from; by default any port the
+        # system would hand out.
+        self.recordPath = recordPath
+        self.ranges = ranges or []
+        self.assignments = {}
+        # port : config path, for ports given out that may not be bound yet
+        self.reservations = {}
+        self.lock = threading.Lock()
+
+    def allocate(self, configPath):
+        # Returns a port for configPath and reserves it until release(). The
+        # port configPath had before is preferred if it is still free.
+        configPath = os.path.abspath(configPath)
+        self.lock.acquire()
+        try:
+            lockFile = self.lockRecord()
+            try:
+                self.load()
+                # Ports other configs have, or are about to bind
+                taken = set(port for port, path in self.reservations.iteritems() if path != configPath)
+                taken.update(port for path, port in self.assignments.iteritems() if path != configPath)
+
+                port = self.assignments.get(configPath)
+                if port == None or port in taken or not self.inRanges(port) or not isFree(port):
+                    port = self.findPort(taken)
+                self.assignments[configPath] = port
+                self.reservations[port] = configPath
+                self.save()
+                return port
+            finally:
+                self.unlockRecord(lockFile)
+        finally:
+            self.lock.release()
+
+    def claim(self, configPath, port):
+        # Records that configPath uses port (e.g. one set by hand), so that
+        # it isn't given to anything else
+        configPath = os.path.abspath(configPath)
+        self.lock.acquire()
+        try:
+            lockFile = self.lockRecord()
+            try:
+                self.load()
+                if self.assignments.get(configPath) != port:
+                    self.assignments[configPath] = port
+                    self.save()
+            finally:
+                self.unlockRecord(lockFile)
+        finally:
+            self.lock.release()
+
+    def release(self, port, configPath):
+        # The instance has bound port (or won't any more); the assignment stays
+        self.lock.acquire()
+        try:
+            if self.reservations.get(port) == os.path.abspath(configPath):
+                del self.reservations[port]
+        finally:
+            self.lock.release()
+
+    def isReserved(self, port):
+        return self.reservations.has_key(port)
+
+    def assignment(self, configPath):
+        self.lock.acquire()
+        try:
+            self.load()
+            return self.assignments.get(os.path.abspath(configPath))
+        finally:
+            self.lock.release()
+
+    def inRanges(self, port):
+        if len(self.ranges) == 0:
+            return True
+        for low, high in self.ranges:
+            if low <= port <= high:
+                return True
+        return False
+
+    def findPort(self, taken):
+        if len(self.ranges) == 0:
+            for attempt in range(100):
+                port = ephemeralPort()
+                if port not in taken:
+                    return port
+            raise PortError("Couldn't find a free port")
+        for low, high in self.ranges:
+            for port in xrange(low, high + 1):
+                if port not in taken and isFree(port):
+                    return port
+        raise PortError('No free port left in ' + ', '.join('%d-%d' % portRange for portRange in self.ranges))
+
+    def load(self):
+        if self.recordPath == None or not os.path.exists(self.recordPath):
+            return
+        try:
+            infile = open(self.recordPath, 'rb')
+            try:
+                record = json.load(infile)
+            finally:
+                infile.close()
+        except (IOError, ValueError):
+            # Unreadable or half written by something else; start a new one
+            return
+        # Configs that are gone don't need their ports any more
+        self.assignments = dict((path, int(port)) for path, port in record.get('ports', {}).iteritems() \
+            if os.path.exists(path))
+
+    def save(self):
+        if self.recordPath != None:
+            writeAtomically(self.recordPath, json.dumps({'ports' : self.assignments}, indent=4, sort_keys=True))
+
+    def lockRecord(self):
+        # Other tangelo-wrappers (e.g. two command line starts) share the
+        # record; only one of them picks a port at a time
+        if self.recordPath == None or fcntl == None:
+            return None
+        directory = os.path.dirname(self.recordPath)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        lockFile = open(self.recordPath + '.lock', 'ab')
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+        return lockFile
+
+    def unlockRecord(self, lockFile):
+        if lockFile != None:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+            lockFile.close()
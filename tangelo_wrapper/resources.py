@@ -0,0 +1,215 @@
+import threading, time, psutil
+from collections import deque
+from tangelo_wrapper.instrument import tracer
+from tangelo_wrapper.limits import readLimits
+
+# Periodic CPU / memory / fd / thread / connection sampling of tangelo
+# instances and everything they spawned. psutil handles are kept between
+# samples: cpu_percent() measures since the previous call on the same
+# handle, and reusing them saves re-reading /proc for every process.
+
+class ResourceSample:
+    # One instance's usage at one moment, children included. Anything we
+    # aren't allowed to read (e.g. a daemon that dropped privileges) is None.
+    def __init__(self, when, cpu, rss, fds, threads, connections, processes, limits=None):
+        self.when = when
+        self.cpu = cpu
+        self.rss = rss
+        self.fds = fds
+        self.threads = threads
+        self.connections = connections
+        self.processes = processes
+        # The LaunchLimits in effect, if known
+        self.limits = limits
+
+    def describe(self):
+        def show(value, suffix):
+            return ('?' if value == None else str(value)) + suffix
+        text = '%.0f%% cpu, ' % self.cpu + show(None if self.rss == None else self.rss / (1024 * 1024), ' MB')
+        text += ', ' + show(self.fds, ' fds') + ', ' + show(self.threads, ' threads') + ', ' + \
+            show(self.connections, ' connections')
+        if self.processes > 1:
+            text += ' (' + str(self.processes) + ' processes)'
+        return text
+
+class ResourceHistory:
+    # Ring buffer of the most recent samples of one instance
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+
+    def add(self, sample):
+        self.samples.append(sample)
+
+    def latest(self):
+        return self.samples[-1] if len(self.samples) > 0 else None
+
+    def values(self, attribute):
+        return [getattr(sample, attribute) or 0 for sample in self.samples]
+
+def addKnown(total, value):
+    if total == None or value == None:
+        return None
+    return total + value
+
+class ResourceMonitor:
+    def __init__(self, historySize=120, treeInterval=5):
+        self.historySize = historySize
+        # Process trees and connection counts are the expensive parts, and
+        # change slowly; they are only refreshed every treeInterval samples
+        self.treeInterval = treeInterval
+        self.handles = {}
+        self.children = {}
+        self.histories = {}
+        self.connections = {}
+        self.limits = {}
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    @tracer.timed('resources.sample', 'psutil')
+    def sample(self, pids, lookup=None):
+        # Samples every pid in pids (strings, like everywhere else); lookup
+        # may supply an existing psutil handle for a pid. Returns
+        # {pid : ResourceSample} for the pids that are still alive.
+        self.lock.acquire()
+        try:
+            pids = set(pids)
+            for pid in list(self.handles.keys()):
+                if pid not in pids:
+                    self.forget(pid)
+
+            fullSample = self.samples % self.treeInterval == 0
+            self.samples += 1
+            if fullSample:
+                self.updateTrees(pids)
+
+            results = {}
+            now = time.time()
+            for pid in pids:
+                sample = self.measure(pid, lookup, fullSample, now)
+                if sample != None:
+                    history = self.histories.get(pid)
+                    if history == None:
+                        history = self.histories[pid] = ResourceHistory(self.historySize)
+                    history.add(sample)
+                    results[pid] = sample
+            return results
+        finally:
+            self.lock.release()
+
+    def measure(self, pid, lookup, fullSample, now):
+        handle = self.handles.get(pid)
+        if handle == None:
+            handle = lookup(pid) if lookup != None else None
+            try:
+                if handle == None:
+                    handle = psutil.Process(int(pid))
+            except psutil.NoSuchProcess:
+                return None
+            self.handles[pid] = handle
+
+        usage = measureProcess(handle, fullSample)
+        if usage == None:
+            self.forget(pid)
+            return None
+        cpu, rss, fds, threads, connections = usage
+        processes = 1
+        for childPid, child in list(self.children.get(pid, {}).items()):
+            childUsage = measureProcess(child, fullSample)
+            if childUsage == None:
+                del self.children[pid][childPid]
+                continue
+            processes += 1
+            cpu += childUsage[0]
+            rss = addKnown(rss, childUsage[1])
+            fds = addKnown(fds, childUsage[2])
+            threads = addKnown(threads, childUsage[3])
+            connections = addKnown(connections, childUsage[4])
+
+        if fullSample:
+            self.connections[pid] = connections
+            # Limits rarely change either
+            self.limits[pid] = readLimits(handle)
+        return ResourceSample(now, cpu, rss, fds, threads, self.connections.get(pid), processes, self.limits.get(pid))
+
+    def updateTrees(self, pids):
+        # One pass over the process table finds the children of every
+        # instance, instead of one pass per instance
+        childPids = {}
+        for process in psutil.process_iter():
+            try:
+                childPids.setdefault(str(process.ppid()), []).append(str(process.pid))
+            except psutil.Error:
+                pass
+
+        for pid in pids:
+            known = self.children.get(pid, {})
+            children = {}
+            pending = list(childPids.get(pid, []))
+            while len(pending) > 0:
+                childPid = pending.pop()
+                pending.extend(childPids.get(childPid, []))
+                if childPid in pids:
+                    # Another instance (e.g. a daemon's launcher); counted on its own
+                    continue
+                try:
+                    children[childPid] = known.get(childPid) or psutil.Process(int(childPid))
+                except psutil.NoSuchProcess:
+                    pass
+            self.children[pid] = children
+
+    def forget(self, pid):
+        self.handles.pop(pid, None)
+        self.children.pop(pid, None)
+        self.histories.pop(pid, None)
+        self.connections.pop(pid, None)
+        self.limits.pop(pid, None)
+
+    def history(self, pid):
+        # Returns a copy that is safe to use on another thread, or None
+        self.lock.acquire()
+        try:
+            history = self.histories.get(pid)
+            if history == None:
+                return None
+            copy = ResourceHistory(self.historySize)
+            copy.samples.extend(history.samples)
+            return copy
+        finally:
+            self.lock.release()
+
+    def top(self, attribute, count=None):
+        # [(pid, ResourceSample)] with the heaviest users of attribute first
+        self.lock.acquire()
+        try:
+            latest = [(pid, history.latest()) for pid, history in self.histories.items() if history.latest() != None]
+        finally:
+            self.lock.release()
+        latest.sort(key=lambda item: getattr(item[1], attribute) or 0, reverse=True)
+        return latest if count == None else latest[:count]
+
+def measureProcess(handle, countConnections):
+    # Returns (cpu, rss, fds, threads, connections) of a single process, or
+    # None if it has exited
+    try:
+        with handle.oneshot():
+            cpu = handle.cpu_percent(None)
+            threads = handle.num_threads()
+            try:
+                rss = handle.memory_info().rss
+            except psutil.AccessDenied:
+                rss = None
+            try:
+                fds = handle.num_fds() if hasattr(handle, 'num_fds') else handle.num_handles()
+            except psutil.AccessDenied:
+                fds = None
+        connections = None
+        if countConnections:
+            try:
+                connections = len(getattr(handle, 'net_connections', handle.connections)('inet'))
+            except psutil.AccessDenied:
+                pass
+        return cpu, rss, fds, threads, connections
+    except psutil.NoSuchProcess:
+        return None
+    except psutil.AccessDenied:
+        return 0.0, None, None, None, None
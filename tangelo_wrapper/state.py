@@ -0,0 +1,187 @@
+import os, json, time, threading, tempfile
+
+# What the GUI knew when it was last closed: the python and tangelo it used,
+# the instances it was showing and how they were doing, the config files it
+# has seen, the agents on other hosts it shows, and the commands it ran. On
+# the next start the overview is drawn from this straight away, and brought
+# up to date in the background.
+
+defaultStatePath = os.path.expanduser('~/.config/tangelo-wrapper/state.json')
+
+def writeAtomically(path, text, mode=None):
+    # Written next to path and renamed over it, so nobody ever reads half of
+    # it, and a crash leaves the old version in place
+    commitWrite(prepareWrite(path, text, mode), path)
+
+def prepareWrite(path, text, mode=None):
+    # The first half of writeAtomically: returns the temporary file holding
+    # text. mode is the new file's permissions; by default only we can read
+    # it.
+    directory = os.path.dirname(path)
+    if directory != '' and not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temporary = tempfile.mkstemp(dir=directory or '.', prefix='.' + os.path.basename(path) + '-')
+    try:
+        outfile = os.fdopen(handle, 'wb')
+        try:
+            outfile.write(text)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        finally:
+            outfile.close()
+        if mode != None:
+            os.chmod(temporary, mode)
+    except:
+        os.remove(temporary)
+        raise
+    return temporary
+
+def commitWrite(temporary, path):
+    # The second half: puts the temporary file in place
+    try:
+        if os.name == 'nt' and os.path.exists(path):
+            # rename doesn't replace on Windows
+            os.remove(path)
+        os.rename(temporary, path)
+    except:
+        discardWrite(temporary)
+        raise
+
+def discardWrite(temporary):
+    if os.path.exists(temporary):
+        os.remove(temporary)
+
+class StateStore:
+    def __init__(self, path=defaultStatePath, historySize=200, configPathsSize=50):
+        self.path = path
+        self.historySize = historySize
+        self.configPathsSize = configPathsSize
+        self.pythonPath = None
+        self.tangeloPath = None
+        # [{pid, configPath, config, status, supervised}] as last seen
+        self.instances = []
+        # Most recently used first
+        self.configPaths = []
+        # [{time, action, config, pid, ok, elapsed}], oldest first
+        self.launches = []
+        # 'host:port' of every agent
+        self.agents = []
+        self.written = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        # A missing or damaged state file just means starting from scratch
+        try:
+            infile = open(self.path, 'rb')
+            try:
+                text = infile.read()
+            finally:
+                infile.close()
+            state = json.loads(text)
+        except (IOError, ValueError):
+            return False
+
+        self.lock.acquire()
+        try:
+            self.pythonPath = state.get('pythonPath')
+            self.tangeloPath = state.get('tangeloPath')
+            self.instances = state.get('instances', [])
+            self.configPaths = state.get('configPaths', [])
+            self.launches = state.get('launches', [])
+            self.agents = state.get('agents', [])
+            self.written = text
+        finally:
+            self.lock.release()
+        return True
+
+    def save(self):
+        # Only touches the disk when something changed since the last save
+        self.lock.acquire()
+        try:
+            text = json.dumps({
+                'pythonPath' : self.pythonPath,
+                'tangeloPath' : self.tangeloPath,
+                'instances' : self.instances,
+                'configPaths' : self.configPaths,
+                'launches' : self.launches,
+                'agents' : self.agents
+            }, indent=1, sort_keys=True)
+            if text == self.written:
+                return False
+            writeAtomically(self.path, text)
+            self.written = text
+            return True
+        finally:
+            self.lock.release()
+
+    def setExecutables(self, pythonPath, tangeloPath):
+        self.lock.acquire()
+        try:
+            self.pythonPath = pythonPath
+            self.tangeloPath = tangeloPath
+        finally:
+            self.lock.release()
+
+    def setAgents(self, addresses):
+        self.lock.acquire()
+        try:
+            self.agents = list(addresses)
+        finally:
+            self.lock.release()
+
+    def setInstances(self, instances):
+        # instances: every Instance that's known, probed or not
+        entries = []
+        for instance in instances:
+            if instance.config == None:
+                continue
+            entries.append({
+                'pid' : instance.pid,
+                'configPath' : instance.configPath,
+                'config' : instance.config,
+                'status' : instance.runningStatus,
+                'supervised' : instance.supervised
+            })
+        entries.sort(key=lambda entry: (entry['pid'] == None, int(entry['pid'] or 0), entry['configPath']))
+        self.lock.acquire()
+        try:
+            self.instances = entries
+        finally:
+            self.lock.release()
+        for entry in entries:
+            self.addConfigPath(entry['configPath'], False)
+
+    def addConfigPath(self, configPath, recent=True):
+        # recent moves configPath to the front; otherwise it's only added
+        if configPath == None:
+            return
+        configPath = os.path.abspath(configPath)
+        self.lock.acquire()
+        try:
+            if configPath in self.configPaths:
+                if not recent:
+                    return
+                self.configPaths.remove(configPath)
+            if recent:
+                self.configPaths.insert(0, configPath)
+            else:
+                self.configPaths.append(configPath)
+            del self.configPaths[self.configPathsSize:]
+        finally:
+            self.lock.release()
+
+    def recordLaunch(self, action, configPath, pid, ok, elapsed):
+        self.lock.acquire()
+        try:
+            self.launches.append({
+                'time' : time.time(),
+                'action' : action,
+                'config' : configPath,
+                'pid' : pid,
+                'ok' : ok,
+                'elapsed' : round(elapsed, 3)
+            })
+            del self.launches[:-self.historySize]
+        finally:
+            self.lock.release()
+        self.addConfigPath(configPath)
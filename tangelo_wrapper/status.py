@@ -0,0 +1,217 @@
+import os, sys, subprocess, json, select, threading
+from tangelo_wrapper.instrument import tracer
+
+helperPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'status_helper.py')
+statusAttributes = ['status', 'interface', 'log', 'root', 'config']
+
+class StatusRecord:
+    # Everything tangelo reports about one daemonized instance
+    def __init__(self, pid, attrs):
+        self.pid = pid
+        self.status = attrs.get('status', '')
+        self.config = attrs.get('config', '')
+        self.log = attrs.get('log', '')
+        self.root = attrs.get('root', '')
+
+        self.hostname = None
+        self.port = None
+        interface = attrs.get('interface', '').split(':')
+        if len(interface) == 2:
+            self.hostname = interface[0].strip()
+            try:
+                self.port = int(interface[1])
+            except ValueError:
+                self.port = None
+
+    def logdir(self):
+        return os.path.split(self.log)[0]
+
+    def isRunning(self):
+        return self.status.startswith('running')
+
+def recordKey(record):
+    # The parts of a record that matter for display; two snapshots with the
+    # same key for a pid don't need that instance redrawn
+    if record == None:
+        return None
+    return (record.pid, record.status, record.hostname, record.port, record.root)
+
+class StatusServer:
+    # A status_helper.py --serve that stays up between queries, so neither
+    # the interpreter nor tangelo's imports are paid for more than once. Any
+    # failure shuts it down and raises IOError; the next query starts a
+    # fresh one.
+    def __init__(self, pythonPath, tangeloPath, timeout=30.0):
+        self.pythonPath = pythonPath
+        self.tangeloPath = tangeloPath
+        self.timeout = timeout
+        self.helper = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def query(self, attributes):
+        # Returns the helper's {'pids' : [...], 'attrs' : {...}} document
+        self.lock.acquire()
+        try:
+            try:
+                if self.closed:
+                    raise IOError('status helper was closed')
+                if self.helper == None:
+                    self.helper = subprocess.Popen([self.pythonPath, helperPath, self.tangeloPath, '--serve'], \
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+                self.helper.stdin.write(json.dumps({'attrs' : attributes}) + '\n')
+                self.helper.stdin.flush()
+                # A helper stuck inside tangelo shouldn't hang us with it
+                if len(select.select([self.helper.stdout], [], [], self.timeout)[0]) == 0:
+                    raise IOError('status helper did not answer within ' + str(self.timeout) + 's')
+                line = self.helper.stdout.readline()
+                if line == '':
+                    raise IOError('status helper exited with code ' + str(self.helper.wait()))
+                response = json.loads(line)
+                if not response['ok']:
+                    raise IOError('status helper failed: ' + response['error'])
+                return response['result']
+            except (IOError, OSError, ValueError, KeyError) as e:
+                self.shutdown()
+                raise IOError(str(e))
+        finally:
+            self.lock.release()
+
+    def shutdown(self):
+        if self.helper == None:
+            return
+        try:
+            self.helper.stdin.close()
+            if self.helper.poll() == None:
+                self.helper.kill()
+            self.helper.wait()
+        except (IOError, OSError):
+            pass
+        self.helper = None
+
+    def close(self):
+        # For good: a query that comes in afterwards doesn't start a new one
+        self.lock.acquire()
+        try:
+            self.closed = True
+            self.shutdown()
+        finally:
+            self.lock.release()
+
+class StatusProbe:
+    def __init__(self, pythonPath, tangeloPath, resident=True):
+        self.pythonPath = pythonPath
+        self.tangeloPath = tangeloPath
+        self.useHelper = True
+        # The resident helper only pays off when there is more than one query
+        # to make; it needs select() on a pipe, which Windows lacks, and it is
+        # given up on after a few failures in a row
+        self.server = None
+        if resident and not sys.platform.startswith('win'):
+            self.server = StatusServer(pythonPath, tangeloPath)
+        self.serverFailures = 0
+        self.maxServerFailures = 3
+        # Worker threads share the probe; this guards giving up on the server
+        self.lock = threading.Lock()
+
+    def collect(self):
+        # Returns a {pid : StatusRecord} dict for every daemonized instance
+        # that tangelo knows about: from the resident helper if it works,
+        # else from a single interpreter launch
+        server = self.server
+        if server != None:
+            try:
+                return self.collectResident(server, statusAttributes)
+            except IOError:
+                self.serverFailed(server)
+        if self.useHelper:
+            try:
+                return self.collectBatched()
+            except (ValueError, KeyError, IOError):
+                # The tangelo executable couldn't be loaded in-process (e.g.
+                # it's a compiled launcher); fall back to asking it directly
+                self.useHelper = False
+        return self.collectDirect()
+
+    @tracer.timed('status.resident', 'pipe')
+    def collectResident(self, server, attributes):
+        # {pid : StatusRecord}; only a usable answer counts as success
+        records = self.records(server.query(attributes))
+        self.lock.acquire()
+        try:
+            self.serverFailures = 0
+        finally:
+            self.lock.release()
+        return records
+
+    def serverFailed(self, server):
+        # Another thread may have given up on server already
+        self.lock.acquire()
+        try:
+            if self.server is not server:
+                return
+            self.serverFailures += 1
+            if self.serverFailures < self.maxServerFailures:
+                return
+            self.server = None
+        finally:
+            self.lock.release()
+        server.close()
+
+    def records(self, result):
+        # A malformed document counts as a failed query (IOError)
+        records = {}
+        try:
+            for pid in result['pids']:
+                records[str(pid)] = StatusRecord(str(pid), result['attrs'][pid])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise IOError('malformed status document: ' + repr(e))
+        return records
+
+    def close(self):
+        server = self.server
+        if server != None:
+            server.close()
+
+    @tracer.timed('status.helper', 'subprocess')
+    def collectBatched(self):
+        helper = subprocess.Popen([self.pythonPath, helperPath, self.tangeloPath, ','.join(statusAttributes)], \
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = helper.communicate()[0]
+        if helper.returncode != 0:
+            raise IOError('status helper exited with code ' + str(helper.returncode))
+        return self.records(json.loads(output))
+
+    def collectDirect(self):
+        records = {}
+        for pid in self.getPidsDirect():
+            attrs = {}
+            for attr in statusAttributes:
+                attrs[attr] = self.getAttribute(pid, attr)
+            records[pid] = StatusRecord(pid, attrs)
+        return records
+
+    def getPids(self):
+        server = self.server
+        if server != None:
+            try:
+                return sorted(self.collectResident(server, []).keys())
+            except IOError:
+                self.serverFailed(server)
+        return self.getPidsDirect()
+
+    @tracer.timed('status.pids', 'subprocess')
+    def getPidsDirect(self):
+        status = subprocess.Popen([self.pythonPath, self.tangeloPath, 'status', '--pids'], \
+            stderr=subprocess.PIPE).communicate()[1]
+
+        if status.startswith('no tangelo instances'):
+            return []
+        else:
+            return [x.strip() for x in status.split('\n')[0].split(':')[1].split(',')]
+
+    @tracer.timed('status.attr', 'subprocess')
+    def getAttribute(self, pid, attr):
+        return subprocess.Popen( \
+            [self.pythonPath, self.tangeloPath, 'status', '--pid', str(pid), '--attr', attr], \
+            stdout=subprocess.PIPE).communicate()[0].strip()
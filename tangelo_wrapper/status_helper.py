@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Batched tangelo status queries. This script is run with the same python
+# interpreter that runs tangelo; it runs the tangelo script in-process for
+# every query instead of spawning a new interpreter for every attribute, and
+# prints everything it learned as one JSON document on stdout.
+#
+# With --serve it stays up instead, so that tangelo and everything it
+# imports only have to be loaded once: every line on stdin is a request
+# ({"attrs" : [attr, ...]}) and gets one line back on stdout, either
+# {"ok" : true, "result" : <the same document>} or {"ok" : false, "error" : ...}.
+# It exits when stdin is closed.
+#
+# usage: status_helper.py <path to tangelo> [attr,attr,...]
+#        status_helper.py <path to tangelo> --serve
+import sys, os, json
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+defaultAttributes = ['status', 'interface', 'log', 'root', 'config']
+
+def compileTangelo(tangeloPath):
+    infile = open(tangeloPath, 'rb')
+    try:
+        source = infile.read()
+    finally:
+        infile.close()
+    return compile(source, tangeloPath, 'exec')
+
+def runTangelo(tangeloPath, code, args):
+    oldArgv = sys.argv
+    oldStdout = sys.stdout
+    oldStderr = sys.stderr
+    sys.argv = [tangeloPath] + args
+    sys.stdout = StringIO()
+    sys.stderr = StringIO()
+    try:
+        try:
+            exec(code, {'__name__' : '__main__', '__file__' : tangeloPath})
+        except SystemExit:
+            pass
+        return sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.argv = oldArgv
+        sys.stdout = oldStdout
+        sys.stderr = oldStderr
+
+def parsePids(status):
+    status = status.strip()
+    if status == '' or status.startswith('no tangelo instances'):
+        return []
+    return [x.strip() for x in status.split('\n')[0].split(':')[1].split(',') if x.strip() != '']
+
+def collect(tangeloPath, code, attributes):
+    result = {'pids' : [], 'attrs' : {}}
+    result['pids'] = parsePids(runTangelo(tangeloPath, code, ['status', '--pids'])[1])
+    for pid in result['pids']:
+        values = {}
+        for attr in attributes:
+            values[attr] = runTangelo(tangeloPath, code, ['status', '--pid', pid, '--attr', attr])[0].strip()
+        result['attrs'][pid] = values
+    return result
+
+def serve(tangeloPath, code):
+    # runTangelo swaps sys.stdout out, so hold on to the real one
+    output = sys.stdout
+    while True:
+        line = sys.stdin.readline()
+        if line == '':
+            break
+        try:
+            request = json.loads(line)
+            response = {'ok' : True, 'result' : collect(tangeloPath, code, request.get('attrs', defaultAttributes))}
+        except Exception as e:
+            response = {'ok' : False, 'error' : repr(e)}
+        output.write(json.dumps(response) + '\n')
+        output.flush()
+
+if __name__ == '__main__':
+    tangeloPath = sys.argv[1]
+    # Behave as if tangelo had been run directly
+    sys.path.insert(0, os.path.dirname(os.path.abspath(tangeloPath)))
+    code = compileTangelo(tangeloPath)
+    
+    if sys.argv[2:3] == ['--serve']:
+        serve(tangeloPath, code)
+        sys.exit(0)
+    
+    attributes = defaultAttributes
+    if len(sys.argv) > 2:
+        attributes = sys.argv[2].split(',')
+    result = collect(tangeloPath, code, attributes)
+    sys.stdout.write(json.dumps(result))
+    sys.stdout.flush()
@@ -0,0 +1,247 @@
+import threading, time, psutil
+from collections import deque
+
+# Brings crashed instances back. Supervised instances are checked on every
+# poll() (cheaply: is the pid still the process we started?), and
+# non-daemonized ones we started also report their own exit as soon as it
+# happens. A crashed instance is restarted after a delay that doubles with
+# every crash in a row, and one that keeps crashing is given up on rather
+# than restarted forever. Whoever calls poll() does the restarting, through
+# the same path as any other start.
+
+class RestartEvent:
+    def __init__(self, when, pid, reason, delay):
+        self.when = when
+        self.pid = pid
+        self.reason = reason
+        # Seconds until the restart, or None if there won't be one
+        self.delay = delay
+
+    def describe(self):
+        text = time.strftime('%H:%M:%S', time.localtime(self.when)) + ' pid ' + str(self.pid) + ' ' + self.reason
+        if self.delay != None:
+            text += ', restarting in %.0fs' % self.delay
+        return text
+
+class Supervision:
+    # Everything the supervisor knows about one instance
+    def __init__(self, instance, historySize):
+        self.instance = instance
+        self.pid = None
+        self.createTime = None
+        self.upSince = None
+        # Commands of ours (stop, restart) replace the process on purpose
+        self.paused = False
+        self.exited = False
+        self.crashes = deque()
+        self.consecutive = 0
+        self.nextRestart = None
+        self.gaveUp = False
+        self.restarts = 0
+        self.history = deque(maxlen=historySize)
+
+    def describe(self):
+        if self.paused:
+            if self.instance.pid == None:
+                return 'stopped; watched again once started'
+            return 'waiting for a command to finish'
+        if self.gaveUp:
+            return 'crash loop: gave up after ' + str(len(self.crashes)) + ' crashes'
+        if self.nextRestart != None:
+            return 'crashed; restarting in %.0fs' % max(0, self.nextRestart - time.time())
+        if self.restarts == 0:
+            return 'watching'
+        return 'restarted ' + str(self.restarts) + ' time(s), last at ' + \
+            time.strftime('%H:%M:%S', time.localtime(self.history[-1].when))
+
+class Supervisor:
+    def __init__(self, initialDelay=1.0, maxDelay=60.0, crashLoopCount=5, crashLoopWindow=300.0, stableTime=60.0, \
+            historySize=50):
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        # This many crashes within crashLoopWindow seconds is a crash loop
+        self.crashLoopCount = crashLoopCount
+        self.crashLoopWindow = crashLoopWindow
+        # Staying up this long forgives the crashes before
+        self.stableTime = stableTime
+        self.historySize = historySize
+        self.supervisions = {}
+        # Called (on the exiting child's watcher thread) with the instance
+        # when a process we started exits, so the caller can poll() now
+        self.notify = None
+        self.lock = threading.Lock()
+
+    def supervise(self, instance):
+        self.lock.acquire()
+        try:
+            if instance not in self.supervisions:
+                supervision = self.supervisions[instance] = Supervision(instance, self.historySize)
+                # Nothing to watch until it's started
+                supervision.paused = instance.pid == None
+                self.watch(supervision)
+            instance.supervised = True
+        finally:
+            self.lock.release()
+
+    def release(self, instance):
+        self.lock.acquire()
+        try:
+            self.supervisions.pop(instance, None)
+            instance.supervised = False
+        finally:
+            self.lock.release()
+
+    def supervision(self, instance):
+        return self.supervisions.get(instance)
+
+    def pause(self, instance):
+        # A command of ours is about to stop or replace the process. After a
+        # stop, it stays paused until the next start.
+        self.lock.acquire()
+        try:
+            supervision = self.supervisions.get(instance)
+            if supervision != None:
+                supervision.paused = True
+                supervision.nextRestart = None
+        finally:
+            self.lock.release()
+
+    def resume(self, instance):
+        # The command is done: watch whatever is running now. If nothing
+        # is (a start that failed), that counts as another crash.
+        self.lock.acquire()
+        try:
+            supervision = self.supervisions.get(instance)
+            if supervision == None:
+                return
+            supervision.paused = False
+            if instance.pid == None:
+                self.crashed(supervision, time.time(), 'failed to start')
+            else:
+                self.watch(supervision)
+        finally:
+            self.lock.release()
+
+    def reset(self, instance):
+        # Forget the crashes, e.g. after fixing whatever caused a crash loop
+        self.lock.acquire()
+        try:
+            supervision = self.supervisions.get(instance)
+            if supervision != None:
+                supervision.crashes.clear()
+                supervision.consecutive = 0
+                supervision.gaveUp = False
+                if supervision.pid == None and not supervision.paused:
+                    supervision.nextRestart = time.time()
+        finally:
+            self.lock.release()
+
+    def watch(self, supervision):
+        instance = supervision.instance
+        supervision.exited = False
+        supervision.pid = instance.pid
+        supervision.createTime = None
+        supervision.upSince = time.time()
+        if instance.pid == None:
+            return
+        try:
+            supervision.createTime = psutil.Process(int(instance.pid)).create_time()
+        except psutil.Error:
+            pass
+        popen = instance.nonDaemonProcess
+        if popen != None and hasattr(popen, 'returncode'):
+            # Our own child: hear about its exit right away
+            thread = threading.Thread(target=self.waitForExit, args=(supervision, popen), \
+                name='tangelo-wrapper-supervisor')
+            thread.daemon = True
+            thread.start()
+
+    def waitForExit(self, supervision, popen):
+        popen.wait()
+        if supervision.pid == str(popen.pid):
+            supervision.exited = True
+            if self.notify != None:
+                self.notify(supervision.instance)
+
+    def isAlive(self, supervision):
+        if supervision.exited:
+            return False
+        try:
+            process = psutil.Process(int(supervision.pid))
+            if supervision.createTime != None and process.create_time() != supervision.createTime:
+                # The pid was reused by something else
+                return False
+            return process.status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+        except psutil.AccessDenied:
+            return True
+
+    def poll(self, now=None):
+        # Returns (due, changed): instances to restart now (call
+        # restarting() for each as it is restarted), and instances whose
+        # supervision state changed
+        if now == None:
+            now = time.time()
+        due = []
+        changed = []
+        self.lock.acquire()
+        try:
+            for instance, supervision in self.supervisions.items():
+                if supervision.paused or supervision.gaveUp:
+                    continue
+                if supervision.pid != None and not self.isAlive(supervision):
+                    self.crashed(supervision, now, self.exitReason(supervision))
+                    changed.append(instance)
+                if supervision.nextRestart != None and supervision.nextRestart <= now:
+                    due.append(instance)
+        finally:
+            self.lock.release()
+        return due, changed
+
+    def exitReason(self, supervision):
+        popen = supervision.instance.nonDaemonProcess
+        if popen != None and getattr(popen, 'returncode', None) != None:
+            if popen.returncode < 0:
+                return 'killed by signal ' + str(-popen.returncode)
+            return 'exited with code ' + str(popen.returncode)
+        return 'exited'
+
+    def crashed(self, supervision, now, reason):
+        if supervision.upSince != None and now - supervision.upSince >= self.stableTime:
+            supervision.consecutive = 0
+        supervision.consecutive += 1
+        supervision.crashes.append(now)
+        while len(supervision.crashes) > 0 and supervision.crashes[0] < now - self.crashLoopWindow:
+            supervision.crashes.popleft()
+
+        pid = supervision.pid
+        supervision.pid = None
+        if len(supervision.crashes) >= self.crashLoopCount:
+            supervision.gaveUp = True
+            supervision.nextRestart = None
+            supervision.history.append(RestartEvent(now, pid, reason + '; ' + str(len(supervision.crashes)) + \
+                ' crashes in ' + str(int(self.crashLoopWindow)) + 's, not restarting', None))
+            return
+        delay = min(self.maxDelay, self.initialDelay * 2 ** (supervision.consecutive - 1))
+        supervision.nextRestart = now + delay
+        supervision.history.append(RestartEvent(now, pid, reason, delay))
+
+    def restarting(self, instance):
+        self.lock.acquire()
+        try:
+            supervision = self.supervisions.get(instance)
+            if supervision != None:
+                supervision.restarts += 1
+                supervision.paused = True
+                supervision.nextRestart = None
+        finally:
+            self.lock.release()
+
+    def describe(self, instance):
+        supervision = self.supervisions.get(instance)
+        return supervision.describe() if supervision != None else 'not supervised'
+
+    def history(self, instance):
+        supervision = self.supervisions.get(instance)
+        return list(supervision.history) if supervision != None else []
@@ -0,0 +1,83 @@
+import threading, traceback, time
+from tangelo_wrapper.instrument import tracer
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+class Job:
+    def __init__(self, function, args, callback, errback):
+        self.function = function
+        self.args = args
+        self.callback = callback
+        self.errback = errback
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.submitted = time.time()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.done.isSet()
+
+class WorkerPool:
+    # A fixed set of threads that run blocking work (tangelo invocations,
+    # psutil scans, file reads) away from the caller. Results are handed to
+    # deliver(function, value), which lets a GUI marshal callbacks back onto
+    # its own thread; by default callbacks run on the worker thread.
+    def __init__(self, size=8, deliver=None):
+        self.jobs = queue.Queue()
+        self.deliver = deliver
+        self.threads = []
+        for i in range(size):
+            thread = threading.Thread(target=self.work, name='tangelo-wrapper-worker-' + str(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, function, args=(), callback=None, errback=None):
+        job = Job(function, args, callback, errback)
+        self.jobs.put(job)
+        return job
+
+    def map(self, function, items):
+        # Runs function over items concurrently and blocks until every call
+        # has finished; returns (item, result, error) in the original order
+        jobs = [self.submit(function, (item,)) for item in items]
+        for job in jobs:
+            job.wait()
+        return [(item, job.result, job.error) for item, job in zip(items, jobs)]
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job == None:
+                break
+            # How long it sat in the queue: all the workers were busy
+            started = time.time()
+            tracer.record('worker.queued', 'queue', job.submitted, started - job.submitted)
+            try:
+                job.result = job.function(*job.args)
+            except Exception as e:
+                job.error = e
+                if job.errback == None:
+                    traceback.print_exc()
+            job.done.set()
+
+            if job.error == None and job.callback != None:
+                self.hand(job.callback, job.result)
+            elif job.error != None and job.errback != None:
+                self.hand(job.errback, job.error)
+
+    def hand(self, function, value):
+        if self.deliver != None:
+            self.deliver(function, value)
+        else:
+            function(value)
+
+    def shutdown(self, wait=True):
+        for thread in self.threads:
+            self.jobs.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
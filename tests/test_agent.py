@@ -0,0 +1,140 @@
+import unittest, threading, tempfile, shutil, socket, time, os, sys
+from tangelo_wrapper.core import Fleet, defaultConfig
+from tangelo_wrapper.agent import Agent, AgentServer, AgentClient, AgentPool, AgentError
+
+# Two agents on localhost, each with its own config directory, managing
+# bench/fake_tangelo.py stand-ins. Run from the top of the repository with:
+# python -m unittest discover tests
+
+fakeTangelo = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'fake_tangelo.py')
+token = 'test-token'
+
+def freePort():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+class AgentTest(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        # Where the fake tangelo keeps what is running; the daemons it starts
+        # inherit this from the agents
+        self.oldState = os.environ.get('FAKE_TANGELO_STATE')
+        os.environ['FAKE_TANGELO_STATE'] = os.path.join(self.root, 'state')
+        self.servers = []
+        self.addresses = []
+        for name in ['a', 'b']:
+            directory = os.path.join(self.root, name)
+            os.mkdir(directory)
+            agent = Agent(Fleet(sys.executable, fakeTangelo), token, directory)
+            server = AgentServer(agent, ('127.0.0.1', 0))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.servers.append(server)
+            self.addresses.append('127.0.0.1:' + str(server.server_address[1]))
+        self.pool = AgentPool(self.addresses, token)
+
+    def tearDown(self):
+        self.pool.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+            server.agent.fleet.close()
+        state = os.environ['FAKE_TANGELO_STATE']
+        if os.path.isdir(state):
+            for pid in os.listdir(state):
+                if pid.isdigit():
+                    try:
+                        os.kill(int(pid), 15)
+                    except OSError:
+                        pass
+        if self.oldState == None:
+            del os.environ['FAKE_TANGELO_STATE']
+        else:
+            os.environ['FAKE_TANGELO_STATE'] = self.oldState
+        shutil.rmtree(self.root)
+
+    def configPath(self, name):
+        return os.path.join(self.root, name, name + '.conf')
+
+    def testHello(self):
+        for name, address in zip(['a', 'b'], self.addresses):
+            client = AgentClient(address, token)
+            self.assertEqual(client.call('ping')['configDirectory'], os.path.join(self.root, name, ''))
+            client.close()
+
+    def testWrongToken(self):
+        client = AgentClient(self.addresses[0], 'not-the-token')
+        self.assertRaises(AgentError, client.call, 'ping')
+        client.close()
+
+    def testNoHello(self):
+        client = AgentClient(self.addresses[0])
+        self.assertRaises(AgentError, client.call, 'ping')
+        client.close()
+
+    def testConfigPaths(self):
+        config = {'port' : freePort()}
+        self.assertTrue(self.pool.saveConfig(self.addresses[0], self.configPath('a'), config))
+        # Not a .conf file, outside the directory, and the other agent's
+        self.assertRaises(AgentError, self.pool.saveConfig, self.addresses[0], \
+            os.path.join(self.root, 'a', 'a.txt'), config)
+        self.assertRaises(AgentError, self.pool.saveConfig, self.addresses[0], \
+            os.path.join(self.root, 'a', '..', 'x.conf'), config)
+        self.assertRaises(AgentError, self.pool.loadConfig, self.addresses[1], self.configPath('a'))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'a', 'a.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'x.conf')))
+
+    def testBadArguments(self):
+        client = AgentClient(self.addresses[0], token)
+        try:
+            client.call('loadConfig', path=self.configPath('a'))
+        except AgentError as e:
+            self.assertTrue('Bad arguments to loadConfig' in str(e), str(e))
+        else:
+            self.fail('unknown argument accepted')
+        # A TypeError from inside an operation is the agent's, not the client's
+        def broken():
+            return len(None)
+        self.servers[0].agent.operations['ping'] = broken
+        try:
+            client.call('ping')
+        except AgentError as e:
+            self.assertTrue('TypeError' in str(e) and 'Bad arguments' not in str(e), str(e))
+        else:
+            self.fail('broken operation succeeded')
+        client.close()
+
+    def testStatusFanOut(self):
+        for name, address in zip(['a', 'b'], self.addresses):
+            config = defaultConfig()
+            config.update({'hostname' : '127.0.0.1', 'port' : freePort(), 'logdir' : os.path.join(self.root, name)})
+            self.pool.saveConfig(address, self.configPath(name), config)
+            instance, output = self.pool.start(address, self.configPath(name))
+            self.assertNotEqual(instance.pid, None, output)
+
+        # Slow every agent down: asking them one after the other would take
+        # twice as long
+        for server in self.servers:
+            discover = server.agent.discover
+            def slowDiscover(discover=discover):
+                time.sleep(0.5)
+                return discover()
+            server.agent.operations['discover'] = slowDiscover
+        begin = time.time()
+        instances, failures = self.pool.discover()
+        elapsed = time.time() - begin
+        self.assertEqual(failures, {})
+        self.assertTrue(elapsed < 0.9, elapsed)
+        # Each agent only reports the instance under its own directory
+        self.assertEqual(sorted((instance.host, instance.configPath) for instance in instances), \
+            sorted(zip(self.addresses, [self.configPath('a'), self.configPath('b')])))
+
+        results = self.pool.runBatch('stop', instances)
+        self.assertEqual([result.error for result in results], [None, None])
+
+if __name__ == '__main__':
+    unittest.main()
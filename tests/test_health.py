@@ -0,0 +1,107 @@
+import unittest, threading, socket, time
+import BaseHTTPServer, SocketServer
+from tangelo_wrapper.health import HealthProber, HEALTHY, DEGRADED, DOWN
+
+# HealthProber against stand-in instances on localhost. Run from the top of
+# the repository with: python -m unittest discover tests
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def startServer(delay=0, code=200):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        # Keeps connections alive, as tangelo does
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = 'ok'
+            self.send_response(code)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = StandInServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def unusedPort():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+class HealthProberTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        self.prober = HealthProber(timeout=0.5, degradedLatency=0.1)
+
+    def tearDown(self):
+        # Closing the kept-alive connections lets the handler threads finish
+        for hostname, port in list(self.prober.idle.keys()):
+            self.prober.forget(hostname, port)
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def serve(self, delay=0, code=200):
+        server = startServer(delay, code)
+        self.servers.append(server)
+        return server.server_address[1]
+
+    def testUp(self):
+        port = self.serve()
+        for i in range(3):
+            status = self.prober.check('localhost', port)
+            self.assertEqual(status.state, HEALTHY)
+            self.assertEqual(status.code, 200)
+        # The connection was kept open between checks
+        self.assertEqual(len(self.prober.idle[('localhost', port)]), 1)
+
+    def testDegradedWhenSlow(self):
+        port = self.serve(delay=0.2)
+        status = self.prober.check('localhost', port)
+        self.assertEqual(status.state, DEGRADED)
+        self.assertTrue(status.p95 >= 0.2)
+
+    def testDegradedOnServerError(self):
+        port = self.serve(code=503)
+        status = self.prober.check('localhost', port)
+        self.assertEqual(status.state, DEGRADED)
+        self.assertEqual(status.code, 503)
+
+    def testDown(self):
+        status = self.prober.check('localhost', unusedPort())
+        self.assertEqual(status.state, DOWN)
+        self.assertNotEqual(status.error, None)
+
+    def testHungIsDownAfterOneTimeout(self):
+        # Accepts connections but never answers
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        try:
+            begin = time.time()
+            status = self.prober.check('localhost', listener.getsockname()[1])
+            elapsed = time.time() - begin
+        finally:
+            listener.close()
+        self.assertEqual(status.state, DOWN)
+        self.assertTrue(elapsed < 1.5 * self.prober.timeout, elapsed)
+
+    def testStalePooledConnectionIsRetried(self):
+        port = self.serve()
+        self.assertEqual(self.prober.check('localhost', port).state, HEALTHY)
+        # The server drops the kept-alive connection in the meantime
+        for connection in self.prober.idle[('localhost', port)]:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.prober.check('localhost', port).state, HEALTHY)
+
+if __name__ == '__main__':
+    unittest.main()